@@ -1,13 +1,36 @@
 from fastapi import FastAPI, Response, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-import requests
+from starlette.background import BackgroundTask
+import httpx
 import os
-import json
-import google.generativeai as genai
+import sys
+import logging
+import time
 from typing import Dict, Any, AsyncIterator, Literal, Optional
 import asyncio
+from contextlib import asynccontextmanager
 
-app = FastAPI()
+# Shared engine modules live in backend/ (bundled via includeFiles in vercel.json)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+from streaming import StreamTimer, stream_model
+from sse import create_sse_streams, parse_last_event_id
+from http_clients import pool as http_pool
+from models import registry as model_registry
+from responses import CancellableStreamingResponse
+import intent_router
+import metrics
+from tts import RelayStats, TTSUpstreamError, open_tts_stream, relay_audio
+
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Upstream clients are created on first use (http_pool.get), so a cold
+    # start only builds the TLS context of the upstream its request needs
+    yield
+    await http_pool.close()
+
+app = FastAPI(lifespan=lifespan)
 
 # Add CORS middleware to allow frontend to connect
 app.add_middleware(
@@ -16,69 +39,69 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Stream-Id", "X-Turn-Id"],
 )
 
+# Request counts, durations, in-flight gauges and a correlation id (X-Turn-Id) per turn
+app.add_middleware(metrics.MetricsMiddleware)
+
 # Read API keys from environment variables
 ELEVENLABS_API_KEY = os.environ.get("ELEVENLABS_API_KEY")
 DEEPGRAM_API_KEY = os.environ.get("DEEPGRAM_API_KEY")
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
 
-# Configure the Gemini API
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
+FLASH_FALLBACK = "I'm sorry, I couldn't process that request. Please try again later."
+MED_FALLBACK = "I'm sorry, I couldn't process that medical request. Please try again later."
+
+# The Gemini SDK is imported and configured with this key on the first model call
+model_registry.configure(GEMINI_API_KEY)
+
+# Coalesced /api/stream replies, resumable while this instance is alive
+sse_streams = create_sse_streams()
 
 def classify_intent(message: str) -> Literal['medical', 'general']:
-    medical_keywords = ['diabetes', 'asthma', 'cancer', 'pregnancy', 'treatment', 'symptom']
-    return 'medical' if any(word in message.lower() for word in medical_keywords) else 'general'
+    # Same compiled vocabulary router as backend/main.py
+    return intent_router.classify_intent(message)
 
-async def query_gemini_flash(message: str) -> AsyncIterator[str]:
+async def query_gemini_flash(message: str, timer: Optional[StreamTimer] = None) -> AsyncIterator[str]:
     """Query Gemini Flash model for general conversational responses"""
-    try:
-        if not GEMINI_API_KEY:
-            raise Exception("GEMINI_API_KEY not configured")
-        
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        response = await model.generate_content_async(message, stream=True)
-        
-        async for chunk in response:
-            if hasattr(chunk, 'text') and chunk.text:
-                yield chunk.text
-    except Exception as e:
-        print(f"Error querying Gemini Flash: {e}")
-        # Fallback response in case of error
-        yield "I'm sorry, I couldn't process that request. Please try again later."
+    if not GEMINI_API_KEY:
+        logger.error("Error querying Gemini Flash: GEMINI_API_KEY not configured")
+        yield FLASH_FALLBACK
+        return
+
+    async for token in stream_model('gemini-1.5-flash', message, FLASH_FALLBACK, timer=timer):
+        yield token
 
-async def query_gemini_med(message: str) -> AsyncIterator[str]:
+async def query_gemini_med(message: str, timer: Optional[StreamTimer] = None) -> AsyncIterator[str]:
     """Query Gemini model with medical context for healthcare-related questions"""
-    try:
-        if not GEMINI_API_KEY:
-            raise Exception("GEMINI_API_KEY not configured")
-        
-        # Using a more capable model for medical questions
-        model = genai.GenerativeModel('gemini-1.5-pro')
-        med_prompt = f"""You are MedGemma, a helpful medical assistant AI. 
+    if not GEMINI_API_KEY:
+        logger.error("Error querying Gemini Med: GEMINI_API_KEY not configured")
+        yield MED_FALLBACK
+        return
+
+    med_prompt = f"""You are MedGemma, a helpful medical assistant AI. 
         Please provide a thoughtful response to the following health question:
         {message}
         
         Always mention that you're an AI and not a doctor, and the user should consult healthcare professionals.
         """
-        response = await model.generate_content_async(med_prompt, stream=True)
-        
-        async for chunk in response:
-            if hasattr(chunk, 'text') and chunk.text:
-                yield chunk.text
-    except Exception as e:
-        print(f"Error querying Gemini Med: {e}")
-        # Fallback response in case of error
-        yield "I'm sorry, I couldn't process that medical request. Please try again later."
+    # Using a more capable model for medical questions
+    async for token in stream_model('gemini-1.5-pro', med_prompt, MED_FALLBACK, timer=timer):
+        yield token
 
 @app.get("/api/health")
 async def health_check():
     """Health check endpoint to verify the service is running"""
     return {"status": "healthy"}
 
+@app.get("/api/metrics")
+async def metrics_endpoint():
+    """Prometheus metrics for this instance"""
+    return Response(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
 @app.post("/api/stream")
-async def stream_response(request: Request, response: Response):
+async def stream_response(request: Request):
     """Stream AI response based on user message intent"""
     try:
         data = await request.json()
@@ -88,21 +111,41 @@ async def stream_response(request: Request, response: Response):
         
         intent = classify_intent(message)
         
-        response.headers["Content-Type"] = "text/event-stream"
-        response.headers["Cache-Control"] = "no-cache"
-        response.headers["Connection"] = "keep-alive"
-        
         # Select the appropriate model based on intent
-        if intent == 'medical':
-            async for token in query_gemini_med(message):
-                yield f"data: {json.dumps({'token': token})}\n\n"
-        else:
-            async for token in query_gemini_flash(message):
-                yield f"data: {json.dumps({'token': token})}\n\n"
+        query = query_gemini_med if intent == 'medical' else query_gemini_flash
+        timer = StreamTimer(intent)
+        stream = await sse_streams.open(query(message, timer), timer, resumable=data.get("resumable") is True)
+        return CancellableStreamingResponse(
+            sse_streams.read(stream),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "Connection": "keep-alive", "X-Stream-Id": stream.stream_id}
+        )
     
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error in stream_response: {e}")
-        yield f"data: {json.dumps({'token': 'Error: Could not process your request.'})}\n\n"
+        logger.exception(f"Error in stream_response: {e}")
+        raise HTTPException(status_code=500, detail="Error: Could not process your request.")
+
+@app.get("/api/stream/{stream_id}")
+async def resume_stream(stream_id: str, request: Request, last_event_id: Optional[str] = None):
+    """Resume an /api/stream reply after the Last-Event-ID header (or ?last_event_id=)"""
+    after_id = parse_last_event_id(request.headers.get("Last-Event-ID") or last_event_id)
+    resumed = sse_streams.resume(stream_id, after_id)
+    if resumed is None:
+        raise HTTPException(status_code=404, detail="Stream expired or unknown")
+    stream, _ = resumed
+    return CancellableStreamingResponse(
+        sse_streams.read(stream, after_id, resumed=True),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "Connection": "keep-alive", "X-Stream-Id": stream.stream_id}
+    )
+
+@app.delete("/api/stream/{stream_id}", status_code=204)
+async def cancel_stream(stream_id: str):
+    """Cancel a resumable /api/stream reply the client has abandoned"""
+    if not sse_streams.cancel(stream_id):
+        raise HTTPException(status_code=404, detail="Stream expired or unknown")
 
 @app.post("/api/tts")
 async def text_to_speech(request: Request):
@@ -117,88 +160,71 @@ async def text_to_speech(request: Request):
         if not ELEVENLABS_API_KEY:
             raise HTTPException(status_code=500, detail="ElevenLabs API key not configured")
         
-        url = "https://api.elevenlabs.io/v1/text-to-speech/21m00Tcm4TlvDq8ikWAM/stream"
-        headers = {
-            "xi-api-key": ELEVENLABS_API_KEY,
-            "Content-Type": "application/json"
-        }
-        data = {
-            "text": text,
-            "voice_settings": {
-                "stability": 0.5,
-                "similarity_boost": 0.5
-            }
-        }
-        
-        tts_response = requests.post(url, json=data, headers=headers, stream=True)
-        
-        if tts_response.status_code != 200:
-            raise HTTPException(status_code=tts_response.status_code, 
-                              detail=f"ElevenLabs API error: {tts_response.text}")
+        stats = RelayStats("tts")
+        try:
+            upstream = await open_tts_stream(
+                text, "21m00Tcm4TlvDq8ikWAM", ELEVENLABS_API_KEY,
+                {"stability": 0.5, "similarity_boost": 0.5},
+                stats
+            )
+        except TTSUpstreamError as e:
+            raise HTTPException(status_code=e.status_code, detail=f"ElevenLabs API error: {e.detail}")
         
-        return Response(
-            content=tts_response.content,
+        # Relay audio as it arrives instead of buffering the whole MP3
+        return CancellableStreamingResponse(
+            relay_audio(upstream, stats=stats),
             media_type="audio/mpeg",
-            headers={"Content-Disposition": "attachment; filename=speech.mp3"}
+            headers={
+                "Content-Disposition": "attachment; filename=speech.mp3",
+                "Server-Timing": f"upstream;dur={stats.upstream_ms}"
+            },
+            background=BackgroundTask(upstream.aclose)
         )
     
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error in text_to_speech: {e}")
+        logger.exception(f"Error in text_to_speech: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/deepgram-proxy")
 async def deepgram_proxy(request: Request):
     """Proxy requests to Deepgram API to avoid exposing API key to frontend"""
     try:
-        # Debug information
-        print("Deepgram proxy called")
         content_type = request.headers.get("Content-Type", "audio/webm")
-        print(f"Content-Type: {content_type}")
         
         if not DEEPGRAM_API_KEY:
-            print("Deepgram API key not configured")
+            logger.error("Deepgram API key not configured")
             raise HTTPException(status_code=500, detail="Deepgram API key not configured")
             
         # Get the request body
         body = await request.body()
-        print(f"Request body size: {len(body)} bytes")
         
         if len(body) == 0:
-            print("Empty request body")
             raise HTTPException(status_code=400, detail="No audio data provided")
         
-        # Set up headers for Deepgram
-        # Debug the API key format (showing only first 3 chars for security)
-        if DEEPGRAM_API_KEY:
-            key_prefix = DEEPGRAM_API_KEY[:3] if len(DEEPGRAM_API_KEY) > 3 else "[empty]"
-            key_format = f"{key_prefix}...{len(DEEPGRAM_API_KEY)} chars"
-            print(f"Using Deepgram API key format: {key_format}")
-        
         # Deepgram's newer API keys don't require the 'Token ' prefix
         headers = {
             "Authorization": DEEPGRAM_API_KEY,  # Direct API key without 'Token ' prefix
             "Content-Type": content_type
         }
-        print(f"Using direct authorization with key: '{DEEPGRAM_API_KEY[:3]}...'")
-
-
         
         # Call Deepgram API
-        print("Calling Deepgram API...")
-        dg_url = "https://api.deepgram.com/v1/listen?model=nova-2&smart_format=true&filler_words=false"
+        dg_url = "/v1/listen?model=nova-2&smart_format=true&filler_words=false"
         
         try:
-            dg_response = requests.post(
+            # Pooled client applies the upstream's 10s read timeout
+            started = time.perf_counter()
+            dg_response = await http_pool.get("deepgram").request(
+                "POST",
                 dg_url,
-                data=body,
-                headers=headers,
-                timeout=10  # Add timeout to prevent hanging
+                content=body,
+                headers=headers
             )
-            
-            print(f"Deepgram response status: {dg_response.status_code}")
+            metrics.observe_stage("stt", started)
             
             if dg_response.status_code != 200:
-                print(f"Deepgram error: {dg_response.text}")
+                logger.warning(f"Deepgram error {dg_response.status_code} (turn {metrics.current_turn()}): {dg_response.text}")
                 raise HTTPException(status_code=dg_response.status_code, 
                                 detail=f"Deepgram API error: {dg_response.text}")
                 
@@ -208,16 +234,13 @@ async def deepgram_proxy(request: Request):
                 media_type="application/json"
             )
             
-        except requests.exceptions.RequestException as req_err:
-            print(f"Request exception: {req_err}")
+        except httpx.HTTPError as req_err:
+            logger.warning(f"Deepgram request failed (turn {metrics.current_turn()}): {req_err}")
             raise HTTPException(status_code=500, detail=f"Error connecting to Deepgram: {str(req_err)}")
     
     except HTTPException as he:
         # Re-raise HTTP exceptions
         raise he
     except Exception as e:
-        print(f"Unexpected error in deepgram_proxy: {e}")
-        import traceback
-        traceback.print_exc()  # Print full traceback for debugging
+        logger.exception(f"Unexpected error in deepgram_proxy: {e}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
-
@@ -0,0 +1,28 @@
+"""Liveness check for Vercel, split out of api/backend.py
+
+/api/health only needs to answer, so it gets a function of its own with
+nothing but Starlette to import. A probe or uptime monitor hitting it does
+not cold start the backend function with its FastAPI, HTTP client and model
+routing stack.
+"""
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+async def health_check(request: Request):
+    """Health check endpoint to verify the service is running"""
+    return JSONResponse({"status": "healthy"})
+
+app = Starlette(
+    routes=[Route("/api/health", health_check)],
+    middleware=[Middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )],
+)
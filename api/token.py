@@ -1,70 +1,119 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
+"""LiveKit token routes for Vercel
+
+Built on Starlette alone rather than FastAPI: every cold start of this
+function imports only Starlette and the stdlib-only token signer, so
+/api/get-token and /api/token-health skip FastAPI's OpenAPI and pydantic
+models. pydantic is imported on the first /api/batch-token request, the only
+route that validates a JSON body.
+"""
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
 import os
-import time
-from jose import jwt
+import sys
+from functools import lru_cache
 from typing import Optional
 
-app = FastAPI()
-
-# Add CORS to allow requests from any origin (for development)
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# Token issuance is shared with token_server/ (bundled via includeFiles in vercel.json)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "token_server"))
+from livekit_tokens import TokenIssuer
 
-# Get API keys from environment variables
+# Get API keys from environment variables (read once per instance)
 LIVEKIT_API_KEY = os.environ.get("LIVEKIT_API_KEY")
 LIVEKIT_SECRET = os.environ.get("LIVEKIT_SECRET")
 
-@app.get("/api/token-health")
-async def health_check():
+_issuer: Optional[TokenIssuer] = None
+
+def get_issuer() -> TokenIssuer:
+    """Shared issuer with 24 hour tokens, created on first use"""
+    global _issuer
+    if _issuer is None:
+        _issuer = TokenIssuer(LIVEKIT_API_KEY, LIVEKIT_SECRET, ttl_seconds=86400)
+    return _issuer
+
+def error(status_code: int, detail) -> JSONResponse:
+    """Error body in FastAPI's shape, as the other API routes answer"""
+    return JSONResponse({"detail": detail}, status_code=status_code)
+
+async def health_check(request: Request):
     """Health check endpoint to verify the service is running"""
     keys_configured = LIVEKIT_API_KEY is not None and LIVEKIT_SECRET is not None
-    return {
+    return JSONResponse({
         "status": "healthy",
         "keys_configured": keys_configured
-    }
+    })
 
-@app.get("/api/get-token")
-async def get_token(user_id: str, room_name: Optional[str] = None):
-    """Generate a LiveKit JWT token for the specified user and room"""
+async def get_token(request: Request):
+    """Generate a LiveKit JWT token for the specified user and room
+
+    Accepts the token server's identity/room parameters as well as user_id/room_name.
+    """
+    params = request.query_params
     try:
         if not LIVEKIT_API_KEY or not LIVEKIT_SECRET:
-            raise HTTPException(status_code=500, detail="LiveKit API keys not configured")
-        
+            return error(500, "LiveKit API keys not configured")
+
+        user_id = params.get("identity") or params.get("user_id")
         if not user_id:
-            raise HTTPException(status_code=400, detail="User ID is required")
-        
+            return error(400, "User ID is required")
+
         # Use provided room name or default to "voice-room"
-        room = room_name if room_name else "voice-room"
-        
-        # Create token with 24 hour validity
-        expiration = int(time.time()) + 86400  # 24 hours
-        
-        # Define the token claims
-        claims = {
-            "sub": user_id,
-            "iss": LIVEKIT_API_KEY,
-            "nbf": int(time.time()),
-            "exp": expiration,
-            "video": {
-                "room": room,
-                "roomJoin": True,
-                "canPublish": True,
-                "canSubscribe": True,
-                "canPublishData": True
-            }
-        }
-        
-        # Create the JWT token
-        token = jwt.encode(claims, LIVEKIT_SECRET, algorithm="HS256")
-        
-        return {"token": token, "room": room}
-    
+        room = params.get("room") or params.get("room_name") or "voice-room"
+
+        token, _ = get_issuer().issue(user_id, room)
+
+        return JSONResponse({"token": token, "identity": user_id, "room": room})
+
     except Exception as e:
         print(f"Error generating token: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        return error(500, str(e))
+
+@lru_cache(maxsize=None)
+def batch_request_model():
+    """Request body model for /api/batch-token, defined on first use"""
+    from pydantic import BaseModel, Field
+    from typing import List
+
+    class TokenRequest(BaseModel):
+        identity: str = Field(..., min_length=1)
+        room: str = Field(..., min_length=1)
+
+    class BatchTokenRequest(BaseModel):
+        requests: List[TokenRequest] = Field(..., max_length=1000)
+
+    return BatchTokenRequest
+
+async def batch_token(request: Request):
+    """Generate tokens for many (identity, room) pairs in one request"""
+    from pydantic import ValidationError
+
+    try:
+        batch = batch_request_model().model_validate_json(await request.body())
+    except ValidationError as e:
+        return error(422, e.errors(include_url=False, include_context=False, include_input=False))
+    if not LIVEKIT_API_KEY or not LIVEKIT_SECRET:
+        return error(500, "LiveKit API keys not configured")
+    try:
+        return JSONResponse({"tokens": get_issuer().issue_many((item.identity, item.room) for item in batch.requests)})
+    except Exception as e:
+        print(f"Error generating tokens: {e}")
+        return error(500, str(e))
+
+app = Starlette(
+    routes=[
+        Route("/api/token-health", health_check),
+        Route("/api/get-token", get_token),
+        Route("/api/batch-token", batch_token, methods=["POST"]),
+    ],
+    # Add CORS to allow requests from any origin (for development)
+    middleware=[Middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )],
+)
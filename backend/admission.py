@@ -0,0 +1,342 @@
+"""Admission control for upstream calls (Gemini, ElevenLabs, Deepgram)
+
+Every upstream gets a gate: a concurrency limit, an optional token bucket for
+its request rate, and a bounded priority queue with a wait deadline. A
+request that cannot start immediately waits in the queue; when the queue is
+full or the deadline passes it is rejected at once with 429 (rate limited) or
+503 (out of capacity) and a Retry-After estimate, instead of piling onto an
+upstream that is already throttling us. Turns of conversations already in
+progress are admitted ahead of new conversations and may displace them from
+a full queue.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from http_clients import UPSTREAMS
+from metrics import registry as metrics_registry
+
+logger = logging.getLogger(__name__)
+
+# Queue priorities; lower is admitted first
+ONGOING = 0
+NEW = 1
+
+QUEUE_DEPTH = metrics_registry.gauge(
+    "medconvo_admission_queue_depth", "Requests waiting for an upstream slot", ("upstream",))
+IN_USE = metrics_registry.gauge(
+    "medconvo_admission_in_use", "Upstream slots currently held", ("upstream",))
+SHED = metrics_registry.counter(
+    "medconvo_admission_shed_total", "Requests rejected by admission control", ("upstream", "reason"))
+WAIT_SECONDS = metrics_registry.histogram(
+    "medconvo_admission_wait_seconds", "Time admitted requests spent queued", ("upstream",))
+
+
+class Overloaded(HTTPException):
+    """An upstream gate rejected the request; carries a Retry-After header"""
+
+    def __init__(self, upstream: str, reason: str, retry_after: int):
+        status_code = 429 if reason == "rate_limited" else 503
+        super().__init__(
+            status_code=status_code,
+            detail=f"{upstream} is busy ({reason}), retry in {retry_after}s",
+            headers={"Retry-After": str(retry_after)},
+        )
+        self.upstream = upstream
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Refills `rate` tokens per second up to `burst`"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self) -> bool:
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self) -> float:
+        """Seconds until the next token is available"""
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class Ticket:
+    """One admitted request; release exactly once when the upstream work is done"""
+
+    __slots__ = ("gate", "admitted_at", "released")
+
+    def __init__(self, gate: "AdmissionGate"):
+        self.gate = gate
+        self.admitted_at = time.monotonic()
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.gate._release(time.monotonic() - self.admitted_at)
+
+    def transfer(self) -> "Ticket":
+        """The same slot under a new ticket, for work that outlives this holder; releasing this one then does nothing
+
+        A ticket that was already released transfers as released.
+        """
+        ticket = Ticket(self.gate)
+        ticket.admitted_at = self.admitted_at
+        ticket.released, self.released = self.released, True
+        return ticket
+
+    async def __aenter__(self) -> "Ticket":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+
+class AdmissionGate:
+    def __init__(
+        self,
+        name: str,
+        concurrency: int,
+        rate: float = 0.0,
+        burst: Optional[float] = None,
+        max_queue: int = 64,
+        max_wait: float = 5.0,
+    ):
+        self.name = name
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate, burst or max(1.0, rate)) if rate > 0 else None
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.in_use = 0
+        self.admitted = 0
+        self.shed: Dict[str, int] = {}
+        self.hold_ewma = 1.0  # Seconds a slot is typically held, for Retry-After
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._refill_timer: Optional[asyncio.TimerHandle] = None
+        self._depth = QUEUE_DEPTH.labels(name)
+        self._in_use = IN_USE.labels(name)
+        self._wait = WAIT_SECONDS.labels(name)
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    def _take(self) -> Ticket:
+        self.in_use += 1
+        self.admitted += 1
+        self._in_use.set(self.in_use)
+        return Ticket(self)
+
+    def _retry_after(self, reason: str) -> int:
+        if reason == "rate_limited" and self.bucket is not None:
+            seconds = self.bucket.wait_time() + len(self._waiters) / self.bucket.rate
+        else:
+            seconds = self.hold_ewma * (len(self._waiters) + 1) / self.concurrency
+        return min(60, max(1, math.ceil(seconds)))
+
+    def _reject(self, reason: str) -> Overloaded:
+        self.shed[reason] = self.shed.get(reason, 0) + 1
+        SHED.labels(self.name, reason).inc()
+        return Overloaded(self.name, reason, self._retry_after(reason))
+
+    def _rate_limited(self) -> bool:
+        return self.bucket is not None and self.bucket.wait_time() > 0
+
+    def _remove(self, entry: Tuple[int, int, asyncio.Future]):
+        if entry in self._waiters:
+            self._waiters.remove(entry)
+            heapq.heapify(self._waiters)
+            self._depth.set(len(self._waiters))
+
+    def _displace_new(self) -> bool:
+        """Reject the most recently queued new conversation to make room"""
+        newest = max((entry for entry in self._waiters if entry[0] == NEW), key=lambda entry: entry[1], default=None)
+        if newest is None:
+            return False
+        self._remove(newest)
+        newest[2].set_exception(self._reject("displaced"))
+        return True
+
+    def try_acquire(self) -> Optional[Ticket]:
+        """A slot if one is free now and nobody is queued for it, else None; never waits or sheds"""
+        if not self._waiters and self.in_use < self.concurrency and (self.bucket is None or self.bucket.try_take()):
+            self._wait.observe(0.0)
+            return self._take()
+        return None
+
+    async def acquire(self, priority: int = NEW) -> Ticket:
+        """Wait for a slot (and a rate token) or raise Overloaded
+
+        Raises:
+            Overloaded: The queue is full or the wait deadline passed
+        """
+        ticket = self.try_acquire()
+        if ticket is not None:
+            return ticket
+
+        if len(self._waiters) >= self.max_queue and not (priority == ONGOING and self._displace_new()):
+            raise self._reject("rate_limited" if self._rate_limited() else "queue_full")
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._seq), future)
+        heapq.heappush(self._waiters, entry)
+        self._depth.set(len(self._waiters))
+        self._dispatch()
+        queued_at = time.monotonic()
+        try:
+            ticket = await asyncio.wait_for(future, self.max_wait)
+        except asyncio.TimeoutError:
+            raise self._reject("rate_limited" if self._rate_limited() else "deadline")
+        except asyncio.CancelledError:
+            # Admitted in the same instant the caller went away: give the slot back
+            if future.done() and not future.cancelled() and future.exception() is None:
+                future.result().release()
+            raise
+        finally:
+            self._remove(entry)
+        self._wait.observe(time.monotonic() - queued_at)
+        return ticket
+
+    def _dispatch(self):
+        """Hand free slots to queued requests in priority order"""
+        while self._waiters and self.in_use < self.concurrency:
+            entry = self._waiters[0]
+            if entry[2].done():  # Timed out or cancelled, removal pending
+                heapq.heappop(self._waiters)
+                continue
+            if self.bucket is not None and not self.bucket.try_take():
+                if self._refill_timer is None:
+                    self._refill_timer = asyncio.get_running_loop().call_later(self.bucket.wait_time(), self._refilled)
+                break
+            heapq.heappop(self._waiters)
+            entry[2].set_result(self._take())
+        self._depth.set(len(self._waiters))
+
+    def _refilled(self):
+        self._refill_timer = None
+        self._dispatch()
+
+    def _release(self, held: float):
+        self.in_use -= 1
+        self._in_use.set(self.in_use)
+        self.hold_ewma = 0.9 * self.hold_ewma + 0.1 * held
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, priority: int = NEW):
+        ticket = await self.acquire(priority)
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "concurrency": self.concurrency,
+            "in_use": self.in_use,
+            "queue_depth": len(self._waiters),
+            "rate": self.bucket.rate if self.bucket else None,
+            "admitted": self.admitted,
+            "shed": dict(self.shed),
+            "hold_ewma_s": round(self.hold_ewma, 3),
+        }
+
+
+class HeldStream:
+    """A stream that owns an admission ticket until it ends or is closed
+
+    Unlike a generator, `aclose` releases the ticket whether or not iteration
+    ever started, so a caller that drops the stream unread (a disconnect or
+    barge-in before the first token) still frees the slot. Callers own the
+    stream: iterate it under `aclosing` (or `async with`) entered before
+    their first await.
+    """
+
+    __slots__ = ("ticket", "_items", "_closed")
+
+    def __init__(self, ticket: Ticket, items: AsyncIterator):
+        self.ticket = ticket
+        self._items = items
+        self._closed = False
+
+    def __aiter__(self) -> "HeldStream":
+        return self
+
+    async def __anext__(self):
+        if self._closed:
+            raise StopAsyncIteration
+        try:
+            return await self._items.__anext__()
+        except BaseException:
+            # Exhausted, failed or cancelled: nothing more will be read
+            await self.aclose()
+            raise
+
+    async def aclose(self):
+        self._closed = True
+        try:
+            aclose = getattr(self._items, "aclose", None)
+            if aclose is not None:
+                await aclose()
+        finally:
+            self.ticket.release()
+
+    async def __aenter__(self) -> "HeldStream":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+
+def hold(ticket: Ticket, items: AsyncIterator) -> HeldStream:
+    """Pass a stream through, releasing `ticket` once it ends or is closed (started or not)"""
+    return HeldStream(ticket, items)
+
+
+def _gate_from_env(name: str, concurrency: int) -> AdmissionGate:
+    prefix = f"ADMISSION_{name.upper()}_"
+    rate = float(os.getenv(prefix + "RATE", "0"))
+    return AdmissionGate(
+        name,
+        concurrency=int(os.getenv(prefix + "CONCURRENCY", str(concurrency))),
+        rate=rate,
+        burst=float(os.getenv(prefix + "BURST", str(max(1.0, rate)))),
+        max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", "64")),
+        max_wait=float(os.getenv("ADMISSION_MAX_WAIT", "5")),
+    )
+
+
+def create_gates() -> Dict[str, AdmissionGate]:
+    """Gates for each upstream from ADMISSION_* environment settings
+
+    HTTP upstreams default to the connection pool's concurrency cap so the
+    gate queues requests instead of letting them block on the pool.
+    """
+    return {
+        "gemini": _gate_from_env("gemini", 32),
+        "elevenlabs": _gate_from_env("elevenlabs", UPSTREAMS["elevenlabs"].max_concurrency),
+        "deepgram": _gate_from_env("deepgram", UPSTREAMS["deepgram"].max_concurrency),
+    }
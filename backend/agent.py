@@ -0,0 +1,493 @@
+"""Server-side LiveKit agent: STT, LLM and TTS for a room without the browser in the loop
+
+    uvicorn agent:app --port 8082     (from backend/)
+
+The worker joins rooms on request (POST /dispatch {"room": ...}, or every room
+in AGENT_ROOMS at startup) with a token from the token server, subscribes to
+each participant's microphone and streams it to live STT. Endpointed
+utterances go through the same intent routing, admission, model routing and
+session history as /stream; the reply is synthesized sentence by sentence as
+raw PCM and published into the room as a LiveKit audio track frame by frame
+while TTS is still producing it, so nothing is downloaded in full, decoded in
+the browser or re-encoded. Transcripts and reply text are sent on the data
+channel. One asyncio worker serves many rooms; every room is a task.
+
+Dispatching requires a LiveKit token for the room from the token server, sent
+as "Authorization: Bearer <token>" and checked against LIVEKIT_SECRET, so only
+someone allowed into a room can send the agent there (or call it away).
+
+The room connection is behind `RoomTransport`. `LiveKitTransport` needs the
+`livekit` package; the benchmarks drive the agent through a stand-in room
+instead (bench/stubs.py).
+"""
+import abc
+import asyncio
+import json
+import logging
+import os
+import time
+from contextlib import aclosing, asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, List, Optional, Set, Tuple
+
+import httpx
+from fastapi import FastAPI, Header, HTTPException, Response
+from fastapi.middleware.cors import CORSMiddleware
+from pydantic import BaseModel
+
+import main
+import metrics
+from admission import Overloaded
+from audio import StreamingPreprocessor
+from auth import InvalidToken, bearer_token
+from http_clients import pool as http_pool
+from pipeline import pipeline_events
+from sessions import session_key
+from speculation import Speculation, tracker as speculation_tracker
+from stt import STTStream
+
+logger = logging.getLogger(__name__)
+
+LIVEKIT_URL = os.getenv("LIVEKIT_URL", "ws://localhost:7880")
+TOKEN_SERVER_URL = os.getenv("TOKEN_SERVER_URL", "http://localhost:8081")
+AGENT_IDENTITY = os.getenv("AGENT_IDENTITY", "medconvo-agent")
+AGENT_MAX_ROOMS = int(os.getenv("AGENT_MAX_ROOMS", "100"))
+
+# Microphone audio as requested from LiveKit and described to Deepgram
+INPUT_SAMPLE_RATE = 16000
+# ElevenLabs raw PCM output, published as-is
+OUTPUT_SAMPLE_RATE = 24000
+OUTPUT_FORMAT = f"pcm_{OUTPUT_SAMPLE_RATE}"
+FRAME_MS = 20
+
+AGENT_ROOMS = metrics.registry.gauge("medconvo_agent_rooms", "Rooms the agent worker is serving")
+
+
+class AudioSink(abc.ABC):
+    """Publishing side of the agent's audio track"""
+
+    @abc.abstractmethod
+    async def capture(self, pcm: bytes):
+        """Queue one frame of 16-bit mono PCM for playout"""
+
+    @abc.abstractmethod
+    def clear(self):
+        """Drop audio queued but not yet played (barge-in)"""
+
+
+class RoomTransport(abc.ABC):
+    """A room connection as the agent sees it"""
+
+    @abc.abstractmethod
+    async def connect(self, url: str, token: str):
+        ...
+
+    @abc.abstractmethod
+    def audio_tracks(self) -> AsyncIterator[Tuple[str, AsyncIterator[bytes]]]:
+        """Yield (participant identity, PCM frames at INPUT_SAMPLE_RATE) per subscribed microphone
+
+        Ends when the room closes or the last participant leaves.
+        """
+
+    @abc.abstractmethod
+    async def publish_audio(self, name: str, sample_rate: int) -> AudioSink:
+        ...
+
+    @abc.abstractmethod
+    async def send_data(self, payload: Dict[str, object], topic: str = "agent"):
+        ...
+
+    @abc.abstractmethod
+    async def disconnect(self):
+        ...
+
+
+class _LiveKitSink(AudioSink):
+    def __init__(self, rtc, source, sample_rate: int):
+        self.rtc = rtc
+        self.source = source
+        self.sample_rate = sample_rate
+
+    async def capture(self, pcm: bytes):
+        frame = self.rtc.AudioFrame(
+            data=pcm, sample_rate=self.sample_rate, num_channels=1, samples_per_channel=len(pcm) // 2
+        )
+        await self.source.capture_frame(frame)
+
+    def clear(self):
+        self.source.clear_queue()
+
+
+class LiveKitTransport(RoomTransport):
+    """RoomTransport over the LiveKit realtime SDK"""
+
+    _END = object()
+
+    def __init__(self):
+        from livekit import rtc  # Optional dependency, only needed by the agent worker
+
+        self.rtc = rtc
+        self.room = rtc.Room()
+        self._tracks: asyncio.Queue = asyncio.Queue()
+        self.room.on("track_subscribed", self._on_track_subscribed)
+        self.room.on("participant_disconnected", self._on_participant_disconnected)
+        self.room.on("disconnected", lambda *args: self._tracks.put_nowait(self._END))
+
+    def _on_track_subscribed(self, track, publication, participant):
+        if track.kind != self.rtc.TrackKind.KIND_AUDIO:
+            return
+        stream = self.rtc.AudioStream(track, sample_rate=INPUT_SAMPLE_RATE, num_channels=1)
+        self._tracks.put_nowait((participant.identity, self._frames(stream)))
+
+    def _on_participant_disconnected(self, participant):
+        if not self.room.remote_participants:
+            self._tracks.put_nowait(self._END)
+
+    async def _frames(self, stream) -> AsyncIterator[bytes]:
+        try:
+            async for event in stream:
+                yield bytes(event.frame.data)
+        finally:
+            await stream.aclose()
+
+    async def connect(self, url: str, token: str):
+        await self.room.connect(url, token, options=self.rtc.RoomOptions(auto_subscribe=True))
+
+    async def audio_tracks(self) -> AsyncIterator[Tuple[str, AsyncIterator[bytes]]]:
+        while True:
+            item = await self._tracks.get()
+            if item is self._END:
+                return
+            yield item
+
+    async def publish_audio(self, name: str, sample_rate: int) -> AudioSink:
+        source = self.rtc.AudioSource(sample_rate, 1)
+        track = self.rtc.LocalAudioTrack.create_audio_track(name, source)
+        options = self.rtc.TrackPublishOptions(source=self.rtc.TrackSource.SOURCE_MICROPHONE)
+        await self.room.local_participant.publish_track(track, options)
+        return _LiveKitSink(self.rtc, source, sample_rate)
+
+    async def send_data(self, payload: Dict[str, object], topic: str = "agent"):
+        await self.room.local_participant.publish_data(json.dumps(payload), reliable=True, topic=topic)
+
+    async def disconnect(self):
+        await self.room.disconnect()
+
+
+class PCMFramer:
+    """Cut a 16-bit PCM byte stream into fixed-size frames"""
+
+    def __init__(self, sample_rate: int, frame_ms: int = FRAME_MS):
+        self.frame_bytes = sample_rate * frame_ms // 1000 * 2
+        self.buffer = bytearray()
+
+    def feed(self, data: bytes) -> List[bytes]:
+        self.buffer += data
+        count = len(self.buffer) // self.frame_bytes
+        frames = [bytes(self.buffer[i * self.frame_bytes:(i + 1) * self.frame_bytes]) for i in range(count)]
+        del self.buffer[:count * self.frame_bytes]
+        return frames
+
+    def flush(self) -> List[bytes]:
+        """The remainder, padded with silence to a whole frame"""
+        if not self.buffer:
+            return []
+        frame = bytes(self.buffer) + b"\x00" * (self.frame_bytes - len(self.buffer))
+        self.buffer.clear()
+        return [frame]
+
+
+async def synthesize_pcm(text: str):
+    return await main.synthesize_speech(text, output_format=OUTPUT_FORMAT)
+
+
+class RoomAgent:
+    """The agent in one room: listens to every participant, answers one utterance at a time"""
+
+    def __init__(self, room: str, transport: RoomTransport):
+        self.room = room
+        self.transport = transport
+        self.sink: Optional[AudioSink] = None
+        self.reply: Optional[asyncio.Task] = None
+        self.turns = 0
+        self.cancelled = 0
+        self._listeners: Set[asyncio.Task] = set()
+
+    async def run(self, url: str, token: str):
+        await self.transport.connect(url, token)
+        try:
+            self.sink = await self.transport.publish_audio("assistant", OUTPUT_SAMPLE_RATE)
+            async for identity, frames in self.transport.audio_tracks():
+                if identity == AGENT_IDENTITY:
+                    continue
+                task = asyncio.create_task(self._listen(identity, frames))
+                self._listeners.add(task)
+                task.add_done_callback(self._listeners.discard)
+        finally:
+            for task in list(self._listeners):
+                task.cancel()
+            if self.reply is not None:
+                self.reply.cancel()
+            await self.transport.disconnect()
+
+    async def _cancel_reply(self, reason: str):
+        reply, self.reply = self.reply, None
+        if reply is None or reply.done():
+            return
+        reply.cancel()
+        try:
+            await reply
+        except asyncio.CancelledError:
+            pass
+        self.sink.clear()
+        self.cancelled += 1
+        await self.transport.send_data({"type": "response_cancelled", "reason": reason})
+
+    async def _listen(self, identity: str, frames: AsyncIterator[bytes]):
+        stt = STTStream(main.DEEPGRAM_API_KEY, {
+            "encoding": "linear16", "sample_rate": str(INPUT_SAMPLE_RATE), "channels": "1",
+        })
+        try:
+            await stt.connect()
+        except Exception as e:
+            logger.warning(f"STT connection for {identity} in {self.room} failed: {e}")
+            metrics.upstream_error("deepgram", "websocket")
+            return
+
+        async def pump():
+            # Only speech (plus pre-roll and an endpointing hangover) is uploaded
+            gate = StreamingPreprocessor(INPUT_SAMPLE_RATE)
+            try:
+                async with aclosing(frames) as audio:
+                    async for frame in audio:
+                        await stt.send_gated(gate.feed(frame))
+            finally:
+                try:
+                    await stt.finish()
+                except Exception:
+                    pass  # Upstream already closed
+
+        pumping = asyncio.create_task(pump())
+        speculator = main.voice_speculator(session_key(self.room, identity))
+        try:
+            async for event in stt.events():
+                speculator.observe(event)
+                if event["type"] == "interim":
+                    await self._cancel_reply("barge_in")
+                    continue
+                await self.transport.send_data({**event, "identity": identity}, topic="transcript")
+                if event["type"] == "utterance":
+                    await self._cancel_reply("superseded")
+                    speculation = speculator.take(event["transcript"])
+                    self.reply = asyncio.create_task(self._respond(identity, event["transcript"], speculation))
+        finally:
+            speculator.close()
+            pumping.cancel()
+            await stt.close()
+
+    async def _respond(self, identity: str, message: str, speculation: Optional[Speculation] = None):
+        """Answer one utterance, publishing audio frames as TTS produces them"""
+        metrics.new_turn()
+        self.turns += 1
+        started = time.perf_counter()
+        try:
+            _, timer, tokens = await main.start_turn(message, session_key(self.room, identity), speculation)
+        except Overloaded as e:
+            await self.transport.send_data({"type": "error", "detail": e.detail, "retry_after": e.retry_after})
+            return
+
+        framer = PCMFramer(OUTPUT_SAMPLE_RATE)
+        first_audio = True
+        # The pipeline reads tokens from a task that may be cancelled before it starts; close them here
+        async with aclosing(tokens) as reply, aclosing(pipeline_events(reply, synthesize_pcm, timer)) as events:
+            async for kind, seq, payload in events:
+                if kind == "audio":
+                    for frame in framer.feed(payload):
+                        if first_audio:
+                            metrics.observe_stage("agent_first_audio", started)
+                            first_audio = False
+                        await self.sink.capture(frame)
+                elif kind == "metrics":
+                    for frame in framer.flush():
+                        await self.sink.capture(frame)
+                    await self.transport.send_data({"type": "response_end", **payload})
+                else:
+                    await self.transport.send_data({"type": kind, "seq": seq, kind: payload})
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "participants": len(self._listeners),
+            "turns": self.turns,
+            "cancelled": self.cancelled,
+            "replying": self.reply is not None and not self.reply.done(),
+        }
+
+
+class AgentWorker:
+    """Runs one RoomAgent per room in this process"""
+
+    def __init__(
+        self,
+        livekit_url: str = LIVEKIT_URL,
+        token_url: str = TOKEN_SERVER_URL,
+        transport_factory: Callable[[], RoomTransport] = LiveKitTransport,
+        max_rooms: int = AGENT_MAX_ROOMS,
+    ):
+        self.livekit_url = livekit_url
+        self.token_url = token_url
+        self.transport_factory = transport_factory
+        self.max_rooms = max_rooms
+        self.agents: Dict[str, RoomAgent] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._joining: Set[str] = set()  # Rooms dispatched whose join token is still being fetched
+        self._client: Optional[httpx.AsyncClient] = None
+
+    async def start(self):
+        self._client = httpx.AsyncClient(base_url=self.token_url, timeout=10)
+
+    async def close(self):
+        for task in list(self._tasks.values()):
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        if self._client is not None:
+            await self._client.aclose()
+
+    async def token(self, room: str) -> str:
+        """Join token for the agent's identity from the token server"""
+        response = await self._client.get("/get-token", params={"identity": AGENT_IDENTITY, "room": room})
+        response.raise_for_status()
+        return response.json()["token"]
+
+    async def dispatch(self, room: str) -> bool:
+        """Join `room` unless already there
+
+        Raises:
+            Overloaded: The worker already serves max_rooms rooms
+        """
+        if room in self._tasks or room in self._joining:
+            return False
+        if len(self._tasks) + len(self._joining) >= self.max_rooms:
+            raise Overloaded("agent", "queue_full", 30)
+        # Claim the room before awaiting the token, so a concurrent dispatch neither joins twice nor overfills
+        self._joining.add(room)
+        try:
+            token = await self.token(room)
+        finally:
+            self._joining.discard(room)
+        agent = self.agents[room] = RoomAgent(room, self.transport_factory())
+        self._tasks[room] = asyncio.create_task(self._run(room, agent, token))
+        AGENT_ROOMS.set(len(self._tasks))
+        return True
+
+    async def _run(self, room: str, agent: RoomAgent, token: str):
+        try:
+            await agent.run(self.livekit_url, token)
+            logger.info(f"Agent left {room} after {agent.turns} turns")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception(f"Agent in {room} failed: {e}")
+        finally:
+            self._tasks.pop(room, None)
+            self.agents.pop(room, None)
+            AGENT_ROOMS.set(len(self._tasks))
+
+    async def leave(self, room: str) -> bool:
+        task = self._tasks.get(room)
+        if task is None:
+            return False
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return True
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "rooms": {room: agent.stats() for room, agent in self.agents.items()},
+            "max_rooms": self.max_rooms,
+            "speculation": speculation_tracker.stats(),
+        }
+
+
+worker = AgentWorker()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await http_pool.start()
+    await worker.start()
+    for room in filter(None, (name.strip() for name in os.getenv("AGENT_ROOMS", "").split(","))):
+        try:
+            await worker.dispatch(room)
+        except Exception as e:
+            logger.warning(f"Could not join {room} at startup: {e}")
+    yield
+    await worker.close()
+    await http_pool.close()
+
+
+app = FastAPI(lifespan=lifespan)
+
+# The web client dispatches the agent into its room
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],  # Update with specific origins in production
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+app.add_middleware(metrics.MetricsMiddleware)
+
+
+class DispatchRequest(BaseModel):
+    room: str
+
+
+def authorize_room(authorization: Optional[str], room: str):
+    """The caller must hold a LiveKit token for `room` issued by our token server
+
+    Raises:
+        HTTPException: 401 without a valid token, 403 for a token of another room,
+            503 when LIVEKIT_SECRET is not configured
+    """
+    token = bearer_token(authorization)
+    if token is None:
+        raise HTTPException(status_code=401, detail="A LiveKit token for the room is required",
+                            headers={"WWW-Authenticate": "Bearer"})
+    if main.token_verifier is None:
+        raise HTTPException(status_code=503, detail="LIVEKIT_SECRET is not configured")
+    try:
+        claims = main.token_verifier.verify(token)
+    except InvalidToken as e:
+        raise HTTPException(status_code=401, detail=f"Invalid token: {e}", headers={"WWW-Authenticate": "Bearer"})
+    video = claims.get("video")
+    if not isinstance(video, dict) or video.get("room") != room:
+        raise HTTPException(status_code=403, detail=f"Token is not valid for {room}")
+
+
+@app.post("/dispatch")
+async def dispatch(request: DispatchRequest, authorization: Optional[str] = Header(None)):
+    """Send the agent into a room; needs a LiveKit token for that room"""
+    authorize_room(authorization, request.room)
+    try:
+        joined = await worker.dispatch(request.room)
+    except HTTPException:
+        raise
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"Token server error: {str(e)}")
+    return {"room": request.room, "joined": joined}
+
+
+@app.delete("/dispatch/{room}")
+async def leave(room: str, authorization: Optional[str] = Header(None)):
+    authorize_room(authorization, room)
+    if not await worker.leave(room):
+        raise HTTPException(status_code=404, detail=f"Agent is not in {room}")
+    return {"room": room, "left": True}
+
+
+@app.get("/agent/stats")
+async def agent_stats():
+    return worker.stats()
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    return Response(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
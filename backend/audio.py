@@ -0,0 +1,418 @@
+"""Audio preprocessing before STT: decode, trim silence, downmix, resample, re-encode
+
+Recorded turns arrive with leading and trailing silence at whatever rate and
+channel count the browser used. `preprocess_audio` decodes a whole recording,
+finds the speech with a vectorized energy VAD, keeps it plus a little padding,
+downmixes to mono, resamples to 16 kHz and re-encodes it (Ogg Opus, or
+16-bit WAV). WAV needs only numpy; the browser's webm/ogg recordings are
+decoded, and Opus encoded, with `av` (listed in requirements.txt). If that
+would not make the upload smaller, or the container cannot be decoded here,
+the original bytes are sent with a Content-Type sniffed from the data
+instead of the client's label. An install without `av` therefore sends
+compressed uploads on untouched: it is logged at startup, reported by
+/health and counted as medconvo_audio_passthrough_total{reason="no_decoder"}.
+
+Streamed audio goes through `StreamingPreprocessor`, which does the same
+per chunk: the resampler and VAD carry their state across chunks, and silence
+is dropped once the hangover after speech has passed. The hangover is longer
+than the STT endpointing window so end-of-utterance detection still sees the
+silence that follows speech.
+"""
+import io
+import logging
+import os
+import time
+import wave
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from metrics import observe_stage, registry as metrics_registry
+
+logger = logging.getLogger(__name__)
+
+TARGET_RATE = 16000
+FRAME_MS = 20
+# Speech must exceed the noise floor by this much, and never be quieter than the absolute floor
+VAD_MARGIN_DB = float(os.getenv("AUDIO_VAD_MARGIN_DB", "12"))
+VAD_FLOOR_DB = float(os.getenv("AUDIO_VAD_FLOOR_DB", "-50"))
+# Kept around detected speech so word onsets and endings are not clipped
+VAD_PADDING_MS = int(os.getenv("AUDIO_VAD_PADDING_MS", "200"))
+# Silence still forwarded after speech in streaming mode (must exceed STT endpointing)
+VAD_HANGOVER_MS = int(os.getenv("AUDIO_VAD_HANGOVER_MS", "1200"))
+# "auto" (Opus when `av` is installed, else WAV), "wav" or "opus"
+AUDIO_ENCODING = os.getenv("AUDIO_ENCODING", "auto")
+
+AUDIO_BYTES = metrics_registry.counter(
+    "medconvo_audio_bytes_total", "Audio bytes received from clients and sent to STT", ("direction",))
+PASSTHROUGH = metrics_registry.counter(
+    "medconvo_audio_passthrough_total",
+    "Uploads sent to STT unprocessed, by reason (no_decoder, undecodable, not_smaller)", ("reason",))
+
+_MAGIC = (
+    (b"RIFF", 0, "wav"),
+    (b"\x1a\x45\xdf\xa3", 0, "webm"),
+    (b"OggS", 0, "ogg"),
+    (b"fLaC", 0, "flac"),
+    (b"ID3", 0, "mp3"),
+    (b"ftyp", 4, "mp4"),
+)
+
+CONTENT_TYPES = {
+    "wav": "audio/wav",
+    "webm": "audio/webm",
+    "ogg": "audio/ogg",
+    "flac": "audio/flac",
+    "mp3": "audio/mpeg",
+    "mp4": "audio/mp4",
+}
+
+
+class DecodeError(Exception):
+    """The audio could not be decoded"""
+
+
+def sniff(data: bytes) -> Optional[str]:
+    """Container format from the leading bytes, or None if unknown"""
+    for magic, offset, kind in _MAGIC:
+        if data[offset:offset + len(magic)] == magic:
+            return kind
+    if len(data) > 1 and data[0] == 0xFF and data[1] & 0xE0 == 0xE0:
+        return "mp3"  # Bare MPEG frame sync
+    return None
+
+
+def _av():
+    try:
+        import av  # Optional dependency, only needed for compressed containers
+    except ImportError:
+        return None
+    return av
+
+
+def decoder_available() -> bool:
+    """Whether compressed uploads (webm/ogg/mp3...) can be preprocessed, i.e. `av` is installed"""
+    return _av() is not None
+
+
+def decode_wav(data: bytes) -> Tuple[np.ndarray, int]:
+    """PCM WAV to float32 samples of shape (frames, channels) and the sample rate
+
+    Raises:
+        DecodeError: Not a PCM WAV file
+    """
+    try:
+        with wave.open(io.BytesIO(data)) as wav:
+            channels, width, rate = wav.getnchannels(), wav.getsampwidth(), wav.getframerate()
+            raw = wav.readframes(wav.getnframes())
+    except (wave.Error, EOFError) as e:
+        raise DecodeError(f"Unsupported WAV data: {e}")
+
+    if width == 1:
+        samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif width == 2:
+        samples = np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768
+    elif width == 3:
+        bytes3 = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        ints = bytes3[:, 0] | (bytes3[:, 1] << 8) | (bytes3[:, 2] << 16)
+        samples = (np.where(ints >= 1 << 23, ints - (1 << 24), ints)).astype(np.float32) / (1 << 23)
+    elif width == 4:
+        samples = np.frombuffer(raw, dtype="<i4").astype(np.float32) / (1 << 31)
+    else:
+        raise DecodeError(f"Unsupported WAV sample width {width}")
+    frames = len(samples) // channels
+    return samples[:frames * channels].reshape(frames, channels), rate
+
+
+def decode_compressed(data: bytes) -> Tuple[np.ndarray, int]:
+    """Decode any container `av` understands straight to 16 kHz mono float32
+
+    Raises:
+        DecodeError: `av` is not installed or the data is not decodable audio
+    """
+    av = _av()
+    if av is None:
+        raise DecodeError("Compressed audio needs the `av` package")
+    try:
+        with av.open(io.BytesIO(data)) as container:
+            resampler = av.AudioResampler(format="flt", layout="mono", rate=TARGET_RATE)
+            chunks = []
+            for frame in container.decode(audio=0):
+                for converted in resampler.resample(frame):
+                    chunks.append(converted.to_ndarray().reshape(-1))
+            for converted in resampler.resample(None):
+                chunks.append(converted.to_ndarray().reshape(-1))
+    except av.error.FFmpegError as e:
+        raise DecodeError(f"Undecodable audio: {e}")
+    samples = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.float32)
+    return samples.astype(np.float32).reshape(-1, 1), TARGET_RATE
+
+
+def to_mono(samples: np.ndarray) -> np.ndarray:
+    return samples.mean(axis=1, dtype=np.float32) if samples.ndim == 2 else samples.astype(np.float32)
+
+
+def _lowpass(in_rate: int, out_rate: int, taps: int = 63) -> np.ndarray:
+    """Windowed-sinc anti-aliasing filter for downsampling; identity when upsampling"""
+    if out_rate >= in_rate:
+        return np.ones(1, dtype=np.float32)
+    cutoff = 0.45 * out_rate / in_rate  # Cycles per input sample, a little under Nyquist
+    n = np.arange(taps) - (taps - 1) / 2
+    h = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(taps)
+    return (h / h.sum()).astype(np.float32)
+
+
+class Resampler:
+    """Streaming mono resampler: FIR low-pass, then linear interpolation at the output rate"""
+
+    def __init__(self, in_rate: int, out_rate: int = TARGET_RATE):
+        self.in_rate = in_rate
+        self.out_rate = out_rate
+        self.step = in_rate / out_rate
+        self.filter = _lowpass(in_rate, out_rate)
+        self.history = np.zeros(len(self.filter) - 1, dtype=np.float32)
+        self.position = 0.0  # Next output time, in filtered samples from `carry`
+        self.carry: Optional[np.ndarray] = None  # Last filtered sample, to interpolate across chunks
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        if self.in_rate == self.out_rate:
+            return samples.astype(np.float32)
+        x = np.concatenate([self.history, samples.astype(np.float32)])
+        y = np.convolve(x, self.filter, mode="valid") if len(self.filter) > 1 else x
+        self.history = x[len(x) - len(self.history):]
+        if self.carry is not None:
+            y = np.concatenate([self.carry, y])
+        if len(y) == 0:
+            return y
+        last = len(y) - 1
+        self.carry = y[last:]
+        if self.position > last:
+            self.position -= last
+            return np.zeros(0, dtype=np.float32)
+        count = int(np.floor((last - self.position) / self.step)) + 1
+        positions = self.position + self.step * np.arange(count)
+        self.position = positions[-1] + self.step - last
+        return np.interp(positions, np.arange(len(y)), y).astype(np.float32)
+
+    def flush(self) -> np.ndarray:
+        """Push the filter's delay line through so the tail is not lost"""
+        return self.process(np.zeros(len(self.filter) // 2, dtype=np.float32))
+
+
+def resample(samples: np.ndarray, in_rate: int, out_rate: int = TARGET_RATE) -> np.ndarray:
+    resampler = Resampler(in_rate, out_rate)
+    return np.concatenate([resampler.process(samples), resampler.flush()])
+
+
+def frame_levels(samples: np.ndarray, rate: int, frame_ms: int = FRAME_MS) -> np.ndarray:
+    """RMS level in dBFS of each whole frame"""
+    size = rate * frame_ms // 1000
+    count = len(samples) // size
+    if count == 0:
+        return np.zeros(0, dtype=np.float32)
+    frames = samples[:count * size].reshape(count, size)
+    rms = np.sqrt(np.mean(np.square(frames, dtype=np.float32), axis=1))
+    return 20 * np.log10(rms + 1e-10)
+
+
+def _threshold(levels: np.ndarray) -> float:
+    floor = float(np.percentile(levels, 10))
+    peak = float(levels.max())
+    # A clip that is speech throughout has no quiet floor; stay well below its peak
+    return max(min(floor + VAD_MARGIN_DB, peak - 20), VAD_FLOOR_DB)
+
+
+def speech_bounds(samples: np.ndarray, rate: int, min_speech_ms: int = 60) -> Optional[Tuple[int, int]]:
+    """(start, end) sample indices of the speech in `samples`, padded; None if there is none
+
+    Only leading and trailing silence is trimmed; pauses inside the speech are kept.
+    """
+    levels = frame_levels(samples, rate)
+    if len(levels) == 0:
+        return None
+    voiced = levels > _threshold(levels)
+    # Runs shorter than min_speech_ms are clicks, not speech
+    run = max(1, min_speech_ms // FRAME_MS)
+    if run > 1:
+        counts = np.convolve(voiced.astype(np.int32), np.ones(run, dtype=np.int32), mode="valid")
+        onsets = np.flatnonzero(counts == run)
+        if len(onsets) == 0:
+            return None
+        first, last = onsets[0], onsets[-1] + run - 1
+    else:
+        indices = np.flatnonzero(voiced)
+        if len(indices) == 0:
+            return None
+        first, last = indices[0], indices[-1]
+    size = rate * FRAME_MS // 1000
+    pad = rate * VAD_PADDING_MS // 1000
+    return max(0, first * size - pad), min(len(samples), (last + 1) * size + pad)
+
+
+def to_int16(samples: np.ndarray) -> np.ndarray:
+    return (np.clip(samples, -1.0, 1.0) * 32767).astype("<i2")
+
+
+def encode_wav(samples: np.ndarray, rate: int = TARGET_RATE) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(to_int16(samples).tobytes())
+    return buffer.getvalue()
+
+
+def encode_opus(samples: np.ndarray, rate: int = TARGET_RATE, bitrate: int = 24000) -> bytes:
+    """Ogg Opus, mono; needs `av`
+
+    Raises:
+        DecodeError: `av` is not installed
+    """
+    av = _av()
+    if av is None:
+        raise DecodeError("Opus encoding needs the `av` package")
+    buffer = io.BytesIO()
+    with av.open(buffer, "w", format="ogg") as container:
+        stream = container.add_stream("libopus", rate=rate)
+        stream.bit_rate = bitrate
+        stream.layout = "mono"
+        frame = av.AudioFrame.from_ndarray(to_int16(samples).reshape(1, -1), format="s16", layout="mono")
+        frame.sample_rate = rate
+        for packet in stream.encode(frame):
+            container.mux(packet)
+        for packet in stream.encode(None):
+            container.mux(packet)
+    return buffer.getvalue()
+
+
+class PreparedAudio:
+    """Audio ready for STT plus what preprocessing did to it"""
+
+    def __init__(self, audio: bytes, content_type: str, speech: bool = True, **stats):
+        self.audio = audio
+        self.content_type = content_type
+        self.speech = speech
+        self.stats: Dict[str, object] = stats
+
+    def as_dict(self) -> Dict[str, object]:
+        return {"content_type": self.content_type, "speech": self.speech, "bytes": len(self.audio), **self.stats}
+
+
+def preprocess_audio(data: bytes, encoding: str = AUDIO_ENCODING) -> PreparedAudio:
+    """Trim, downmix, resample and re-encode one recording for STT
+
+    CPU-bound; call it off the event loop (asyncio.to_thread) for large uploads.
+    `speech` is False when the recording holds no speech at all, in which case
+    `audio` is empty.
+    """
+    started = time.perf_counter()
+    kind = sniff(data)
+    AUDIO_BYTES.labels("in").inc(len(data))
+
+    def passthrough(reason: str) -> PreparedAudio:
+        AUDIO_BYTES.labels("out").inc(len(data))
+        PASSTHROUGH.labels(reason).inc()
+        return PreparedAudio(data, CONTENT_TYPES.get(kind, "application/octet-stream"),
+                             input_format=kind, passthrough=reason)
+
+    if kind != "wav" and not decoder_available():
+        return passthrough("no_decoder")
+    try:
+        samples, rate = decode_wav(data) if kind == "wav" else decode_compressed(data)
+    except DecodeError as e:
+        logger.debug(f"Sending audio as-is: {e}")
+        return passthrough("undecodable")
+
+    mono = resample(to_mono(samples), rate)
+    duration = len(samples) / rate if rate else 0.0
+    bounds = speech_bounds(mono, TARGET_RATE)
+    if bounds is None:
+        observe_stage("audio_preprocess", started)
+        return PreparedAudio(b"", CONTENT_TYPES["wav"], speech=False, input_format=kind, duration_s=round(duration, 3))
+
+    speech = mono[bounds[0]:bounds[1]]
+    use_opus = encoding == "opus" or (encoding == "auto" and _av() is not None)
+    try:
+        audio, content_type = (encode_opus(speech), "audio/ogg") if use_opus else (encode_wav(speech), "audio/wav")
+    except DecodeError:
+        audio, content_type = encode_wav(speech), "audio/wav"
+    observe_stage("audio_preprocess", started)
+    if len(audio) >= len(data):
+        return passthrough("not_smaller")
+    AUDIO_BYTES.labels("out").inc(len(audio))
+    return PreparedAudio(
+        audio, content_type,
+        input_format=kind,
+        duration_s=round(duration, 3),
+        speech_s=round(len(speech) / TARGET_RATE, 3),
+        processing_ms=round((time.perf_counter() - started) * 1000, 2),
+    )
+
+
+def prepare_file(path: str, encoding: str = AUDIO_ENCODING) -> PreparedAudio:
+    """Read and preprocess one recording; picklable, for process pools (batch.py)"""
+    with open(path, "rb") as f:
+        return preprocess_audio(f.read(), encoding)
+
+
+class StreamingPreprocessor:
+    """Chunk-by-chunk downmix, resample and silence gating of 16-bit PCM
+
+    `feed` returns 16 kHz mono 16-bit PCM to forward: speech, `VAD_PADDING_MS`
+    of audio before each onset, and silence up to `VAD_HANGOVER_MS` after
+    speech. The noise floor adapts to the quietest recent frames.
+    """
+
+    def __init__(self, rate: int, channels: int = 1, hangover_ms: int = VAD_HANGOVER_MS):
+        self.channels = channels
+        self.resampler = Resampler(rate)
+        self.frame = TARGET_RATE * FRAME_MS // 1000
+        self.pre_roll = max(1, VAD_PADDING_MS // FRAME_MS)
+        self.hangover = max(1, hangover_ms // FRAME_MS)
+        self.noise_db = VAD_FLOOR_DB
+        self.pending = np.zeros(0, dtype=np.float32)
+        self.recent: List[np.ndarray] = []  # Pre-roll frames while gated
+        self.quiet_frames = self.hangover  # Start gated
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    @property
+    def gated(self) -> bool:
+        return self.quiet_frames >= self.hangover
+
+    def feed(self, pcm: bytes) -> bytes:
+        self.bytes_in += len(pcm)
+        AUDIO_BYTES.labels("in").inc(len(pcm))
+        samples = np.frombuffer(pcm, dtype="<i2").astype(np.float32) / 32768
+        if self.channels > 1:
+            samples = samples[:len(samples) // self.channels * self.channels].reshape(-1, self.channels).mean(axis=1)
+        self.pending = np.concatenate([self.pending, self.resampler.process(samples)])
+        count = len(self.pending) // self.frame
+        if count == 0:
+            return b""
+        frames = self.pending[:count * self.frame].reshape(count, self.frame)
+        self.pending = self.pending[count * self.frame:]
+        levels = 20 * np.log10(np.sqrt(np.mean(np.square(frames), axis=1)) + 1e-10)
+
+        kept = []
+        for frame, level in zip(frames, levels):
+            speech = level > max(self.noise_db + VAD_MARGIN_DB, VAD_FLOOR_DB)
+            # Noise floor follows the quietest frames: falls at once, rises slowly
+            self.noise_db = level if level < self.noise_db else 0.99 * self.noise_db + 0.01 * level
+            if speech:
+                if self.gated:
+                    kept.extend(self.recent)
+                self.recent = []
+                self.quiet_frames = 0
+                kept.append(frame)
+                continue
+            if not self.gated:
+                self.quiet_frames += 1
+                kept.append(frame)
+            else:
+                self.recent = (self.recent + [frame])[-self.pre_roll:]
+        out = to_int16(np.concatenate(kept)).tobytes() if kept else b""
+        self.bytes_out += len(out)
+        AUDIO_BYTES.labels("out").inc(len(out))
+        return out
@@ -0,0 +1,91 @@
+"""LiveKit access tokens as proof of whose conversation a request belongs to
+
+Conversation history is keyed by LiveKit room and identity. Both are taken
+from the claims of a token the token server signed (HS256 with
+LIVEKIT_SECRET, see token_server/livekit_tokens.py), never from request
+fields, so a client can only read or extend the history of the identity its
+token was issued for. Verification is a keyed HMAC over the first two
+segments, with the key state prepared once like the signer's.
+"""
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import time
+from typing import Any, Dict, Optional
+
+from sessions import session_key
+
+
+class InvalidToken(Exception):
+    """The token is malformed, was not signed with our secret, or is expired"""
+
+
+def _b64decode(segment: bytes) -> bytes:
+    return base64.urlsafe_b64decode(segment + b"=" * (-len(segment) % 4))
+
+
+class TokenVerifier:
+    """Checks HS256 LiveKit tokens issued by the token server"""
+
+    def __init__(self, secret: str, api_key: Optional[str] = None, leeway_seconds: int = 30):
+        self.api_key = api_key
+        self.leeway_seconds = leeway_seconds
+        self._mac = hmac.new(secret.encode(), digestmod=hashlib.sha256)
+
+    def verify(self, token: str) -> Dict[str, Any]:
+        """The token's claims
+
+        Raises:
+            InvalidToken: Bad signature, wrong issuer, not yet valid or expired
+        """
+        try:
+            header, payload, signature = token.encode().split(b".")
+            mac = self._mac.copy()
+            mac.update(header + b"." + payload)
+            valid = hmac.compare_digest(mac.digest(), _b64decode(signature))
+            algorithm = json.loads(_b64decode(header)).get("alg") if valid else None
+            claims = json.loads(_b64decode(payload)) if valid else None
+        except (ValueError, AttributeError, binascii.Error) as e:
+            raise InvalidToken("malformed token") from e
+        if not valid:
+            raise InvalidToken("bad signature")
+        if algorithm != "HS256" or not isinstance(claims, dict):
+            raise InvalidToken("unexpected token format")
+        if self.api_key and claims.get("iss") != self.api_key:
+            raise InvalidToken("issued for another API key")
+        try:
+            expires_at, not_before = float(claims.get("exp", 0)), float(claims.get("nbf", 0))
+        except (TypeError, ValueError) as e:
+            raise InvalidToken("malformed exp or nbf claim") from e
+        now = time.time()
+        if now > expires_at + self.leeway_seconds:
+            raise InvalidToken("token expired")
+        if now < not_before - self.leeway_seconds:
+            raise InvalidToken("token not valid yet")
+        return claims
+
+    def session_key(self, token: str) -> str:
+        """History key from the token's `video.room` and `sub` (identity) claims
+
+        Raises:
+            InvalidToken: The token does not verify or names no room and identity
+        """
+        claims = self.verify(token)
+        video = claims.get("video")
+        key = session_key(video.get("room") if isinstance(video, dict) else None, claims.get("sub"))
+        if key is None:
+            raise InvalidToken("token names no room and identity")
+        return key
+
+
+def bearer_token(authorization: Optional[str]) -> Optional[str]:
+    """The token from an "Authorization: Bearer <token>" header value"""
+    scheme, _, token = (authorization or "").partition(" ")
+    return (token.strip() or None) if scheme.lower() == "bearer" else None
+
+
+def create_token_verifier(secret: Optional[str], api_key: Optional[str] = None) -> Optional[TokenVerifier]:
+    """None when LIVEKIT_SECRET is not configured: no request can then be tied to a session"""
+    return TokenVerifier(secret, api_key) if secret else None
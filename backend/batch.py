@@ -0,0 +1,316 @@
+"""Offline batch runs of recorded consultations: audio → STT → intent routing → LLM
+
+    python batch.py recordings/ --output results.jsonl
+    python batch.py manifest.jsonl --output results.jsonl --stt-concurrency 16 --llm-concurrency 32
+
+The input is a directory (searched recursively for audio files, each keyed by
+its relative path) or a JSONL manifest of {"id", "path"} entries; an entry
+with a "transcript" skips decoding and STT, for re-running prompts on known
+questions. Files stream through bounded queues between the stages, so memory
+stays flat however large the archive is:
+
+    decode  preprocess_audio in a process pool (`--decode-workers` processes)
+    stt     the /deepgram-proxy transcription, `--stt-concurrency` calls at a time
+            (at most ADMISSION_DEEPGRAM_CONCURRENCY)
+    llm     classify_intent and the backend's model query functions (router,
+            hedging and fallbacks included) behind the backend's Gemini gate,
+            `--llm-concurrency` replies at a time (at most ADMISSION_GEMINI_CONCURRENCY)
+
+Each finished file is appended to the output as one JSON line and flushed,
+and the output doubles as the checkpoint: a rerun with the same output skips
+every id already written without an error, so an interrupted run resumes
+where it stopped and failed files are retried. A canned fallback reply (no
+model answered, or no Gemini key) is written as a failure, never as a result. Lines are in completion
+order; when an id appears more than once, the last line wins.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import aclosing
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+import main
+from audio import PreparedAudio, prepare_file
+from http_clients import pool as http_pool
+from streaming import StreamTimer
+from stt import transcript_text
+
+logger = logging.getLogger(__name__)
+
+AUDIO_EXTENSIONS = {".wav", ".webm", ".ogg", ".opus", ".flac", ".mp3", ".m4a", ".mp4"}
+
+_DONE = object()
+
+
+class BatchJob:
+    """One recording on its way through the pipeline"""
+
+    def __init__(self, job_id: str, path: Optional[str], transcript: Optional[str] = None):
+        self.id = job_id
+        self.path = path
+        self.transcript = transcript
+        self.prepared: Optional[PreparedAudio] = None
+        self.audio: Optional[Dict[str, object]] = None
+        self.intent: Optional[str] = None
+        self.reply: Optional[str] = None
+        self.llm: Dict[str, object] = {}
+        self.stage_ms: Dict[str, float] = {}
+        self.error: Optional[str] = None
+        self.failed_stage: Optional[str] = None
+
+    def fail(self, stage: str, error: BaseException):
+        self.failed_stage = stage
+        self.error = f"{type(error).__name__}: {error}"
+        logger.warning(f"{self.id} failed at {stage}: {self.error}")
+
+    def as_record(self) -> Dict[str, object]:
+        record = {
+            "id": self.id,
+            "path": self.path,
+            "transcript": self.transcript,
+            "intent": self.intent,
+            "reply": self.reply,
+            "model": self.llm.get("model"),
+            "ttft_ms": self.llm.get("ttft_ms"),
+            "stage_ms": self.stage_ms,
+        }
+        if self.audio is not None:
+            record["audio"] = self.audio
+        if self.error:
+            record["error"] = self.error
+            record["failed_stage"] = self.failed_stage
+        return record
+
+
+def scan_directory(root: str) -> Iterator[BatchJob]:
+    """Audio files under `root` in a stable order, keyed by relative path"""
+    for directory, subdirectories, files in os.walk(root):
+        subdirectories.sort()
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() in AUDIO_EXTENSIONS:
+                path = os.path.join(directory, name)
+                yield BatchJob(os.path.relpath(path, root), path)
+
+
+def read_manifest(path: str) -> Iterator[BatchJob]:
+    """Jobs from a JSONL manifest; relative paths are resolved against the manifest's directory"""
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            audio_path = entry.get("path")
+            if audio_path and not os.path.isabs(audio_path):
+                audio_path = os.path.join(base, audio_path)
+            if not audio_path and not entry.get("transcript"):
+                raise ValueError(f"{path}:{number}: entry needs a path or a transcript")
+            yield BatchJob(str(entry.get("id") or entry.get("path")), audio_path, entry.get("transcript"))
+
+
+def load_jobs(source: str) -> Iterator[BatchJob]:
+    return scan_directory(source) if os.path.isdir(source) else read_manifest(source)
+
+
+def load_checkpoint(output: str) -> Set[str]:
+    """Ids already written without an error; a torn last line from a crash is cut off"""
+    completed: Set[str] = set()
+    if not os.path.exists(output):
+        return completed
+    good_bytes = 0
+    with open(output, "rb") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            good_bytes += len(line)
+            if record.get("error"):
+                completed.discard(record["id"])
+            else:
+                completed.add(record["id"])
+    if good_bytes < os.path.getsize(output):
+        logger.warning(f"Dropping an incomplete record at the end of {output}")
+        with open(output, "r+b") as f:
+            f.truncate(good_bytes)
+    return completed
+
+
+def _clamp_to_gate(stage: str, concurrency: int, gate: str) -> int:
+    limit = main.gates[gate].concurrency
+    if concurrency > limit:
+        logger.warning(f"{stage} concurrency {concurrency} clamped to ADMISSION_{gate.upper()}_CONCURRENCY={limit}")
+        return limit
+    return concurrency
+
+
+class BatchRunner:
+    """Bounded decode → STT → LLM pipeline over a stream of jobs"""
+
+    def __init__(
+        self,
+        output: str,
+        decode_workers: int = max(1, (os.cpu_count() or 2) - 1),
+        stt_concurrency: int = 8,
+        llm_concurrency: int = 16,
+        queue_size: int = 64,
+    ):
+        self.output = output
+        self.decode_workers = decode_workers
+        # More workers than gate slots would only queue at the gate and fail on its wait deadline
+        self.stt_concurrency = _clamp_to_gate("stt", stt_concurrency, "deepgram")
+        self.llm_concurrency = _clamp_to_gate("llm", llm_concurrency, "gemini")
+        self.queue_size = queue_size
+        self.counts = {"completed": 0, "failed": 0, "skipped": 0}
+        self.stage_totals: Dict[str, List[float]] = {}
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    async def _decode(self, job: BatchJob) -> BatchJob:
+        if job.transcript is not None or job.error:
+            return job
+        started = time.perf_counter()
+        try:
+            job.prepared = await asyncio.get_running_loop().run_in_executor(self._executor, prepare_file, job.path)
+        except Exception as e:
+            job.fail("decode", e)
+        job.stage_ms["decode"] = round((time.perf_counter() - started) * 1000, 1)
+        return job
+
+    async def _transcribe(self, job: BatchJob) -> BatchJob:
+        if job.transcript is not None or job.error:
+            return job
+        started = time.perf_counter()
+        try:
+            if not main.DEEPGRAM_API_KEY:
+                raise RuntimeError("Deepgram API key not configured")
+            job.transcript = transcript_text(await main.transcribe(job.prepared))
+        except Exception as e:
+            job.fail("stt", e)
+        job.stage_ms["stt"] = round((time.perf_counter() - started) * 1000, 1)
+        if job.prepared is not None:
+            # Only the preprocessing stats are written out
+            job.audio, job.prepared = job.prepared.as_dict(), None
+        return job
+
+    async def _reply(self, job: BatchJob) -> BatchJob:
+        if job.error or not job.transcript:
+            return job
+        started = time.perf_counter()
+        try:
+            if not main.GEMINI_API_KEY:
+                raise RuntimeError("Gemini API key not configured")
+            job.intent = main.classify_intent(job.transcript)
+            timer = StreamTimer(job.intent)
+            query = main.query_medgemma if job.intent == "medical" else main.query_gemini_flash
+            async with main.gates["gemini"].slot(), aclosing(query(job.transcript, timer)) as reply:
+                job.reply = "".join([token async for token in reply])
+            timer.finish()
+            job.llm = timer.as_dict()
+            if timer.error or timer.model is None:
+                # The reply is the route's canned fallback, not an answer
+                job.error, job.failed_stage = timer.error or "no model answered", "llm"
+        except Exception as e:
+            job.fail("llm", e)
+        job.stage_ms["llm"] = round((time.perf_counter() - started) * 1000, 1)
+        return job
+
+    async def _stage(self, inbox: asyncio.Queue, outbox: asyncio.Queue, workers: int, downstream: int, handle):
+        async def worker():
+            while True:
+                job = await inbox.get()
+                if job is _DONE:
+                    return
+                await outbox.put(await handle(job))
+
+        await asyncio.gather(*(worker() for _ in range(workers)))
+        for _ in range(downstream):
+            await outbox.put(_DONE)
+
+    async def _feed(self, jobs: Iterator[BatchJob], completed: Set[str], outbox: asyncio.Queue, limit: Optional[int]):
+        fed = 0
+        for job in jobs:
+            if job.id in completed:
+                self.counts["skipped"] += 1
+                continue
+            if limit is not None and fed >= limit:
+                break
+            await outbox.put(job)
+            fed += 1
+        for _ in range(self.decode_workers):
+            await outbox.put(_DONE)
+
+    async def _write(self, inbox: asyncio.Queue, out):
+        while True:
+            job = await inbox.get()
+            if job is _DONE:
+                return
+            out.write(json.dumps(job.as_record()) + "\n")
+            out.flush()  # Every written line survives a crash and counts as checkpointed
+            self.counts["failed" if job.error else "completed"] += 1
+            for stage, ms in job.stage_ms.items():
+                total = self.stage_totals.setdefault(stage, [0.0, 0])
+                total[0] += ms
+                total[1] += 1
+
+    async def run(self, jobs: Iterator[BatchJob], limit: Optional[int] = None) -> Dict[str, Any]:
+        """Process `jobs` not yet in the output; returns counts, throughput and mean stage times"""
+        completed = load_checkpoint(self.output)
+        to_decode, to_stt, to_llm, to_write = (asyncio.Queue(self.queue_size) for _ in range(4))
+        started = time.perf_counter()
+        self._executor = ProcessPoolExecutor(self.decode_workers)
+        await http_pool.start()
+        try:
+            with open(self.output, "a") as out:
+                await asyncio.gather(
+                    self._feed(jobs, completed, to_decode, limit),
+                    self._stage(to_decode, to_stt, self.decode_workers, self.stt_concurrency, self._decode),
+                    self._stage(to_stt, to_llm, self.stt_concurrency, self.llm_concurrency, self._transcribe),
+                    self._stage(to_llm, to_write, self.llm_concurrency, 1, self._reply),
+                    self._write(to_write, out),
+                )
+        finally:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            await http_pool.close()
+        elapsed = time.perf_counter() - started
+        processed = self.counts["completed"] + self.counts["failed"]
+        return {
+            **self.counts,
+            "seconds": round(elapsed, 2),
+            "files_per_minute": round(processed / elapsed * 60, 1) if elapsed else None,
+            "mean_stage_ms": {stage: round(total / count, 1) for stage, (total, count) in self.stage_totals.items()},
+        }
+
+
+def cli(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("source", help="directory of recordings or JSONL manifest")
+    parser.add_argument("--output", "-o", required=True, help="JSONL results; also the resume checkpoint")
+    parser.add_argument("--decode-workers", type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    parser.add_argument("--stt-concurrency", type=int, default=8, help="clamped to ADMISSION_DEEPGRAM_CONCURRENCY")
+    parser.add_argument("--llm-concurrency", type=int, default=16, help="clamped to ADMISSION_GEMINI_CONCURRENCY")
+    parser.add_argument("--queue-size", type=int, default=64, help="jobs buffered between stages")
+    parser.add_argument("--limit", type=int, help="process at most this many new files")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    runner = BatchRunner(
+        args.output,
+        decode_workers=args.decode_workers,
+        stt_concurrency=args.stt_concurrency,
+        llm_concurrency=args.llm_concurrency,
+        queue_size=args.queue_size,
+    )
+    try:
+        summary = asyncio.run(runner.run(load_jobs(args.source), args.limit))
+    except KeyboardInterrupt:
+        sys.exit(f"Interrupted after {runner.counts['completed']} file(s); rerun with the same --output to resume")
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,238 @@
+"""Response cache for repeated questions on /stream
+
+Replies are cached as the list of chunks the model produced, keyed on the
+normalized prompt plus route and model, and replayed through the same SSE
+path on a hit. An optional n-gram similarity tier maps near-duplicate
+questions onto an existing entry. Storage is pluggable: an in-process LRU
+with TTL and byte limits, or any Redis-compatible server.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from contextlib import aclosing
+from typing import AsyncIterator, Callable, Dict, FrozenSet, List, Optional, Tuple
+
+from streaming import StreamTimer
+
+logger = logging.getLogger(__name__)
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace"""
+    return _WHITESPACE.sub(" ", _PUNCTUATION.sub(" ", prompt.lower())).strip()
+
+
+def ngrams(text: str, n: int = 3) -> FrozenSet[str]:
+    padded = f" {text} "
+    return frozenset(padded[i:i + n] for i in range(max(1, len(padded) - n + 1)))
+
+
+class MemoryBackend:
+    """In-process LRU store with per-entry TTL and entry/byte limits"""
+
+    def __init__(self, max_entries: int = 1000, max_bytes: int = 32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+
+    async def get(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        if len(value) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self.bytes += len(value)
+        while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, key: str):
+        _, value = self._entries.pop(key)
+        self.bytes -= len(value)
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "bytes": self.bytes, "evictions": self.evictions}
+
+
+class RedisBackend:
+    """Redis-compatible store; eviction is left to the server's maxmemory policy"""
+
+    def __init__(self, url: str, prefix: str = "med-convo:"):
+        import redis.asyncio as redis  # Optional dependency, only needed for this backend
+
+        self.client = redis.from_url(url)
+        self.prefix = prefix
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.client.get(self.prefix + key)
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        await self.client.set(self.prefix + key, value, ex=max(1, int(ttl)))
+
+    def stats(self) -> Dict[str, int]:
+        return {}
+
+
+class ResponseCache:
+    """Exact and near-duplicate lookup of model replies in front of the LLM"""
+
+    def __init__(
+        self,
+        backend,
+        ttl: float = 3600,
+        similarity: float = 0.0,
+        max_similarity_candidates: int = 512,
+    ):
+        self.backend = backend
+        self.ttl = ttl
+        self.similarity = similarity
+        self.max_similarity_candidates = max_similarity_candidates
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.stores = 0
+        # (route, model) -> normalized prompt -> n-grams, most recent last
+        self._index: Dict[Tuple[str, str], "OrderedDict[str, FrozenSet[str]]"] = {}
+
+    @staticmethod
+    def make_key(normalized: str, route: str, model: str) -> str:
+        digest = hashlib.sha256(normalized.encode()).hexdigest()
+        return f"{route}:{model}:{digest}"
+
+    def _similar_prompt(self, normalized: str, route: str, model: str) -> Optional[str]:
+        candidates = self._index.get((route, model))
+        if not candidates or self.similarity <= 0:
+            return None
+        grams = ngrams(normalized)
+        best, best_score = None, self.similarity
+        for prompt, other in candidates.items():
+            score = len(grams & other) / len(grams | other)
+            if score >= best_score:
+                best, best_score = prompt, score
+        return best
+
+    def _remember(self, normalized: str, route: str, model: str):
+        if self.similarity <= 0:
+            return
+        candidates = self._index.setdefault((route, model), OrderedDict())
+        candidates[normalized] = ngrams(normalized)
+        candidates.move_to_end(normalized)
+        while len(candidates) > self.max_similarity_candidates:
+            candidates.popitem(last=False)
+
+    async def get(self, prompt: str, route: str, model: str) -> Optional[List[str]]:
+        normalized = normalize_prompt(prompt)
+        value = await self.backend.get(self.make_key(normalized, route, model))
+        if value is not None:
+            self.hits += 1
+            return json.loads(value)
+
+        similar = self._similar_prompt(normalized, route, model)
+        if similar is not None:
+            value = await self.backend.get(self.make_key(similar, route, model))
+            if value is not None:
+                self.similar_hits += 1
+                return json.loads(value)
+
+        self.misses += 1
+        return None
+
+    async def set(self, prompt: str, route: str, model: str, chunks: List[str]):
+        normalized = normalize_prompt(prompt)
+        await self.backend.set(self.make_key(normalized, route, model), json.dumps(chunks).encode(), self.ttl)
+        self._remember(normalized, route, model)
+        self.stores += 1
+
+    async def lookup(self, prompt: str, route: str, model: str) -> Optional[List[str]]:
+        """Like `get`, but a failing backend counts as a miss"""
+        try:
+            return await self.get(prompt, route, model)
+        except Exception as e:
+            logger.warning(f"Response cache lookup failed: {e}")
+            return None
+
+    @staticmethod
+    async def replay(chunks: List[str], timer: StreamTimer) -> AsyncIterator[str]:
+        for chunk in chunks:
+            timer.mark_token()
+            yield chunk
+
+    async def stream(
+        self,
+        prompt: str,
+        route: str,
+        model: str,
+        produce: Callable[[], AsyncIterator[str]],
+        timer: StreamTimer,
+        lookup: bool = True,
+    ) -> AsyncIterator[str]:
+        """Replay a cached reply, or stream `produce()` and cache it if `model` answered it
+
+        A reply from a hedge or fallback model (`timer.model` differs) is passed
+        through but not stored, so a degraded answer never stands in for `model`'s.
+        lookup=False skips the lookup for a caller that already missed.
+        """
+        chunks = await self.lookup(prompt, route, model) if lookup else None
+        if chunks is not None:
+            for chunk in chunks:
+                timer.mark_token()
+                yield chunk
+            return
+
+        produced = []
+        async with aclosing(produce()) as produced_chunks:
+            async for chunk in produced_chunks:
+                produced.append(chunk)
+                yield chunk
+        if produced and timer.error is None and timer.model == model:
+            try:
+                await self.set(prompt, route, model, produced)
+            except Exception as e:
+                logger.warning(f"Response cache store failed: {e}")
+
+    def stats(self) -> Dict[str, object]:
+        lookups = self.hits + self.similar_hits + self.misses
+        return {
+            "hits": self.hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "hit_ratio": round((self.hits + self.similar_hits) / lookups, 3) if lookups else 0.0,
+            **self.backend.stats(),
+        }
+
+
+def create_response_cache() -> ResponseCache:
+    """Build the cache from RESPONSE_CACHE_* environment settings"""
+    if os.getenv("RESPONSE_CACHE_BACKEND", "memory") == "redis":
+        backend = RedisBackend(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+    else:
+        backend = MemoryBackend(
+            max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000")),
+            max_bytes=int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(32 * 1024 * 1024))),
+        )
+    return ResponseCache(
+        backend,
+        ttl=float(os.getenv("RESPONSE_CACHE_TTL", "3600")),
+        similarity=float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0")),
+    )
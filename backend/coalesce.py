@@ -0,0 +1,160 @@
+"""Single-flight coalescing of identical concurrent upstream calls
+
+In broadcast-style sessions many participants ask the same question, or
+request audio for the same reply text, within a few hundred milliseconds.
+A `SingleFlight` group lets only the first of those requests call the
+upstream. The others join its flight and share the streamed output.
+Chunks are fanned out to every subscriber as they arrive and are kept
+while the flight lasts, so a request that joins late first gets what was
+already sent and then follows live. The upstream call is cancelled only
+once every subscriber has gone. A finished flight is forgotten; repeating
+a completed result is the response and TTS caches' job.
+"""
+import asyncio
+import logging
+import os
+from contextlib import aclosing
+from typing import AsyncIterator, Callable, Dict, Generic, List, Optional, Tuple, TypeVar
+
+from metrics import registry as metrics_registry
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# "0" makes every request call the upstream itself
+COALESCE_REQUESTS = os.getenv("COALESCE_REQUESTS", "1") != "0"
+
+FLIGHTS = metrics_registry.counter(
+    "medconvo_flights_total", "Upstream calls started by single-flight groups", ("upstream",))
+COALESCED = metrics_registry.counter(
+    "medconvo_coalesced_total", "Requests served by joining an identical call already in flight", ("upstream",))
+
+
+class Flight(Generic[T]):
+    """One upstream stream and the chunks it has produced so far"""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.chunks: List[T] = []
+        self.done = False
+        self.error: Optional[Exception] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def wait(self, seen: int):
+        """Until there are more than `seen` chunks or the flight has ended"""
+        while len(self.chunks) <= seen and not self.done:
+            await self._changed.wait()
+
+    async def run(self, produce: Callable[[], AsyncIterator[T]]):
+        try:
+            async with aclosing(produce()) as items:
+                async for item in items:
+                    self.chunks.append(item)
+                    self._notify()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+
+
+class SingleFlight(Generic[T]):
+    """Flights in the air for one upstream, by request key"""
+
+    def __init__(self, name: str, enabled: bool = COALESCE_REQUESTS):
+        self.name = name
+        self.enabled = enabled
+        self.started = 0
+        self.coalesced = 0
+        self._flights: Dict[str, Flight[T]] = {}
+
+    def in_flight(self, key: str) -> bool:
+        flight = self._flights.get(key)
+        return flight is not None and not flight.done
+
+    def _join(self, key: str, produce: Callable[[], AsyncIterator[T]]) -> Tuple[Flight[T], bool]:
+        flight = self._flights.get(key) if self.enabled else None
+        joined = flight is not None and not flight.done
+        if joined:
+            self.coalesced += 1
+            COALESCED.labels(self.name).inc()
+        else:
+            flight = Flight(key)
+            if self.enabled:
+                self._flights[key] = flight
+            self.started += 1
+            FLIGHTS.labels(self.name).inc()
+            flight.task = asyncio.create_task(flight.run(produce))
+            flight.task.add_done_callback(lambda _: self._forget(flight))
+        flight.subscribers += 1
+        return flight, joined
+
+    def _forget(self, flight: Flight[T]):
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+
+    def _leave(self, flight: Flight[T]):
+        flight.subscribers -= 1
+        if flight.subscribers == 0 and not flight.done:
+            # Nobody is listening any more: stop the upstream call
+            flight.task.cancel()
+            self._forget(flight)
+
+    async def _follow(self, flight: Flight[T]) -> AsyncIterator[T]:
+        try:
+            seen = 0
+            while True:
+                await flight.wait(seen)
+                while seen < len(flight.chunks):
+                    seen += 1
+                    yield flight.chunks[seen - 1]
+                if flight.done and seen == len(flight.chunks):
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+        finally:
+            self._leave(flight)
+
+    async def stream(self, key: str, produce: Callable[[], AsyncIterator[T]]) -> AsyncIterator[T]:
+        """Every chunk for `key`, calling `produce()` only if no identical call is in flight"""
+        flight, _ = self._join(key, produce)
+        async with aclosing(self._follow(flight)) as chunks:
+            async for chunk in chunks:
+                yield chunk
+
+    async def open(self, key: str, produce: Callable[[], AsyncIterator[T]]) -> Tuple[AsyncIterator[T], bool]:
+        """Like `stream`, but waits for the first chunk so that opening errors are raised here
+
+        Returns:
+            The chunks from the start, and whether an identical call was already in flight
+
+        Raises:
+            Whatever `produce()` raised before its first chunk
+        """
+        flight, joined = self._join(key, produce)
+        try:
+            await flight.wait(0)
+        except BaseException:
+            self._leave(flight)
+            raise
+        if not flight.chunks and flight.error is not None:
+            self._leave(flight)
+            raise flight.error
+        return self._follow(flight), joined
+
+    def stats(self) -> Dict[str, object]:
+        requests = self.started + self.coalesced
+        return {
+            "in_flight": len(self._flights),
+            "subscribers": sum(flight.subscribers for flight in self._flights.values()),
+            "upstream_calls": self.started,
+            "coalesced": self.coalesced,
+            "coalesced_ratio": round(self.coalesced / requests, 3) if requests else 0.0,
+        }
@@ -0,0 +1,252 @@
+"""Resumable conversation channel multiplexed over one WebSocket
+
+A channel carries a whole voice conversation: microphone audio in, transcript
+events, LLM tokens and TTS audio out. Control and transcript messages are JSON
+text frames; audio travels in binary frames with a fixed 7-byte header
+
+    kind (uint8) | id (uint32) | seq (uint16) | payload
+
+where `kind` is AUDIO_IN (client microphone audio, id and seq ignored) or
+TTS_AUDIO (reply audio for sentence segment `seq`). Every message the server
+sends except heartbeats carries a channel-wide increasing `id` (the JSON "id"
+field or the frame header) and is kept in a bounded replay buffer. The channel
+outlives its socket: a client that reconnects with ?resume=<session>&last_id=<n>
+within the resume window gets every message after `n` replayed and the reply
+in progress keeps streaming. Channels that are not resumed in time are dropped
+and their in-flight reply is cancelled.
+"""
+import asyncio
+import json
+import logging
+import os
+import secrets
+import struct
+import time
+from collections import deque
+from typing import Any, Awaitable, Deque, Dict, Optional, Tuple, Union
+
+from fastapi import WebSocket
+
+from metrics import registry as metrics_registry
+
+logger = logging.getLogger(__name__)
+
+AUDIO_IN = 0x01
+TTS_AUDIO = 0x02
+
+FRAME_HEADER = struct.Struct(">BIH")
+
+RESUMES = metrics_registry.counter(
+    "medconvo_conversation_resumes_total", "Conversation reconnects by outcome (resumed, gap, expired)", ("outcome",))
+CHANNELS = metrics_registry.gauge(
+    "medconvo_conversation_channels", "Conversation channels held, attached or awaiting resume")
+
+
+def encode_frame(kind: int, message_id: int, seq: int, payload: bytes) -> bytes:
+    return FRAME_HEADER.pack(kind, message_id & 0xFFFFFFFF, seq & 0xFFFF) + payload
+
+
+def decode_frame(data: bytes) -> Tuple[int, int, int, bytes]:
+    """Split a binary frame into (kind, id, seq, payload)
+
+    Raises:
+        ValueError: The frame is shorter than its header
+    """
+    if len(data) < FRAME_HEADER.size:
+        raise ValueError(f"Frame of {len(data)} bytes is shorter than the {FRAME_HEADER.size}-byte header")
+    kind, message_id, seq = FRAME_HEADER.unpack_from(data)
+    return kind, message_id, seq, data[FRAME_HEADER.size:]
+
+
+Message = Union[str, bytes]
+
+
+class Channel:
+    """Server half of one conversation; survives reconnects of its socket"""
+
+    def __init__(self, session_id: str, key: Optional[str], replay_bytes: int):
+        self.session_id = session_id
+        self.key = key
+        self.replay_bytes = replay_bytes
+        self.websocket: Optional[WebSocket] = None
+        self.last_id = 0
+        self.turns = 0
+        self.reply: Optional[asyncio.Task] = None
+        self.last_seen = time.monotonic()
+        self.detached_at: Optional[float] = None
+        self._replay: Deque[Tuple[int, Message]] = deque()
+        self._replay_size = 0
+        self._lock = asyncio.Lock()  # One writer at a time; keeps replay and live sends in order
+
+    def touch(self):
+        self.last_seen = time.monotonic()
+
+    def _buffer(self, message_id: int, message: Message):
+        self._replay.append((message_id, message))
+        self._replay_size += len(message)
+        while self._replay_size > self.replay_bytes and len(self._replay) > 1:
+            _, dropped = self._replay.popleft()
+            self._replay_size -= len(dropped)
+
+    async def _deliver(self, message: Message):
+        websocket = self.websocket
+        if websocket is None:
+            return
+        try:
+            if isinstance(message, bytes):
+                await websocket.send_bytes(message)
+            else:
+                await websocket.send_text(message)
+        except Exception:
+            # Socket died under us; keep buffering until the client resumes
+            self.detach(websocket)
+
+    async def send_event(self, event: Dict[str, Any]):
+        """Send a JSON event, numbered and kept for replay"""
+        async with self._lock:
+            self.last_id += 1
+            message = json.dumps({**event, "id": self.last_id})
+            self._buffer(self.last_id, message)
+            await self._deliver(message)
+
+    async def send_audio(self, seq: int, payload: bytes):
+        """Send one TTS audio frame for segment `seq`, numbered and kept for replay"""
+        async with self._lock:
+            self.last_id += 1
+            frame = encode_frame(TTS_AUDIO, self.last_id, seq, payload)
+            self._buffer(self.last_id, frame)
+            await self._deliver(frame)
+
+    async def send_control(self, event: Dict[str, Any]):
+        """Send a heartbeat or handshake message; not numbered or replayed"""
+        async with self._lock:
+            await self._deliver(json.dumps(event))
+
+    async def attach(self, websocket: WebSocket, after_id: Optional[int] = None) -> bool:
+        """Make `websocket` the live socket, replaying messages after `after_id`
+
+        Returns:
+            False if some messages after `after_id` were already dropped from the replay buffer
+        """
+        async with self._lock:
+            self.websocket = websocket
+            self.detached_at = None
+            self.touch()
+            complete = after_id is None or not self._replay or self._replay[0][0] <= after_id + 1
+            await self._deliver(json.dumps({
+                "type": "ready",
+                "session": self.session_id,
+                "resumed": after_id is not None,
+                "replay_gap": not complete,
+                "last_id": self.last_id,
+            }))
+            if after_id is not None:
+                for message_id, message in list(self._replay):
+                    if message_id > after_id:
+                        await self._deliver(message)
+            return complete
+
+    def detach(self, websocket: WebSocket):
+        if self.websocket is websocket:
+            self.websocket = None
+            self.detached_at = time.monotonic()
+
+    def start_reply(self, turn: Awaitable[None]):
+        """Run `turn` as the channel's reply; the previous one must already be cancelled"""
+        self.turns += 1
+        self.reply = asyncio.create_task(turn)
+
+    async def cancel_reply(self, reason: str):
+        """Cancel the reply in progress, if any, and tell the client why"""
+        reply, self.reply = self.reply, None
+        if reply is None or reply.done():
+            return
+        reply.cancel()
+        try:
+            await reply
+        except asyncio.CancelledError:
+            pass
+        await self.send_event({"type": "response_cancelled", "reason": reason})
+
+    def close(self):
+        if self.reply is not None:
+            self.reply.cancel()
+            self.reply = None
+
+
+class ChannelRegistry:
+    """Channels of this instance by session id, kept `resume_seconds` after a disconnect"""
+
+    def __init__(self, resume_seconds: float = 30.0, replay_bytes: int = 1_000_000, max_channels: int = 1000):
+        self.resume_seconds = resume_seconds
+        self.replay_bytes = replay_bytes
+        self.max_channels = max_channels
+        self.opened = 0
+        self.resumes: Dict[str, int] = {}
+        self._channels: Dict[str, Channel] = {}
+
+    def __len__(self) -> int:
+        return len(self._channels)
+
+    def _count(self, outcome: str):
+        self.resumes[outcome] = self.resumes.get(outcome, 0) + 1
+        RESUMES.labels(outcome).inc()
+
+    def open(self, key: Optional[str]) -> Channel:
+        if len(self._channels) >= self.max_channels:
+            self._evict_detached()
+        channel = Channel(secrets.token_urlsafe(16), key, self.replay_bytes)
+        self._channels[channel.session_id] = channel
+        self.opened += 1
+        CHANNELS.set(len(self._channels))
+        return channel
+
+    def resume(self, session_id: str) -> Optional[Channel]:
+        """The detached channel for `session_id`, or None if it expired or is in use"""
+        channel = self._channels.get(session_id)
+        if channel is None or channel.websocket is not None:
+            self._count("expired")
+            return None
+        return channel
+
+    def record_resume(self, complete: bool):
+        self._count("resumed" if complete else "gap")
+
+    def release(self, channel: Channel, websocket: WebSocket):
+        """The socket closed; keep the channel around for a resume"""
+        channel.detach(websocket)
+        if channel.websocket is None:
+            asyncio.get_running_loop().call_later(self.resume_seconds, self._expire, channel, channel.detached_at)
+
+    def _expire(self, channel: Channel, detached_at: Optional[float]):
+        if channel.websocket is None and channel.detached_at == detached_at:
+            self._drop(channel)
+
+    def _drop(self, channel: Channel):
+        if self._channels.pop(channel.session_id, None) is not None:
+            channel.close()
+            CHANNELS.set(len(self._channels))
+            logger.info(f"Conversation {channel.session_id} expired after {channel.turns} turns")
+
+    def _evict_detached(self):
+        detached = [channel for channel in self._channels.values() if channel.websocket is None]
+        for channel in sorted(detached, key=lambda channel: channel.detached_at or 0)[: max(1, len(detached) // 10)]:
+            self._drop(channel)
+
+    def stats(self) -> Dict[str, object]:
+        attached = sum(1 for channel in self._channels.values() if channel.websocket is not None)
+        return {
+            "channels": len(self._channels),
+            "attached": attached,
+            "awaiting_resume": len(self._channels) - attached,
+            "opened": self.opened,
+            "resumes": dict(self.resumes),
+        }
+
+
+def create_channel_registry() -> ChannelRegistry:
+    return ChannelRegistry(
+        resume_seconds=float(os.getenv("CONVERSATION_RESUME_SECONDS", "30")),
+        replay_bytes=int(os.getenv("CONVERSATION_REPLAY_BYTES", "1000000")),
+        max_channels=int(os.getenv("CONVERSATION_MAX_CHANNELS", "1000")),
+    )
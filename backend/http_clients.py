@@ -0,0 +1,167 @@
+"""Shared async HTTP client pool for upstream APIs (ElevenLabs, Deepgram)
+
+One long-lived httpx.AsyncClient per upstream keeps connections alive between
+requests, and a per-upstream semaphore caps how many calls are in flight so a
+burst of traffic cannot open unbounded sockets. Clients are created at app
+startup and closed on shutdown; `get` also creates them lazily so serverless
+runtimes that skip lifespan events still work.
+"""
+import asyncio
+import logging
+import os
+from dataclasses import dataclass
+from typing import AsyncIterator, Dict, Optional
+
+import httpx
+
+from metrics import upstream_error
+
+logger = logging.getLogger(__name__)
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+@dataclass
+class UpstreamConfig:
+    base_url: str
+    max_connections: int = 20
+    max_keepalive: int = 10
+    max_concurrency: int = 16
+    connect_timeout: float = 5.0
+    read_timeout: float = 30.0
+    http2: bool = True
+
+
+UPSTREAMS: Dict[str, UpstreamConfig] = {
+    "elevenlabs": UpstreamConfig(
+        base_url=os.getenv("ELEVENLABS_BASE_URL", "https://api.elevenlabs.io"),
+        max_concurrency=int(os.getenv("ELEVENLABS_MAX_CONCURRENCY", "8")),
+    ),
+    "deepgram": UpstreamConfig(
+        base_url=os.getenv("DEEPGRAM_BASE_URL", "https://api.deepgram.com"),
+        max_concurrency=int(os.getenv("DEEPGRAM_MAX_CONCURRENCY", "16")),
+        read_timeout=10.0,
+    ),
+}
+
+
+class UpstreamStream:
+    """A streamed upstream response that holds a concurrency slot until closed"""
+
+    def __init__(self, response: httpx.Response, release):
+        self.response = response
+        self._release = [release]
+        self._closed = False
+
+    def on_close(self, callback):
+        """Run `callback` (e.g. releasing an admission ticket) when the stream closes"""
+        if self._closed:
+            callback()
+        else:
+            self._release.append(callback)
+
+    @property
+    def status_code(self) -> int:
+        return self.response.status_code
+
+    async def aread(self) -> bytes:
+        return await self.response.aread()
+
+    async def aiter_bytes(self, chunk_size: Optional[int] = None) -> AsyncIterator[bytes]:
+        try:
+            async for chunk in self.response.aiter_bytes(chunk_size):
+                yield chunk
+        finally:
+            await self.aclose()
+
+    async def aclose(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            await self.response.aclose()
+        finally:
+            for release in self._release:
+                release()
+
+
+class UpstreamClient:
+    """Pooled client plus concurrency limit for one upstream"""
+
+    def __init__(self, name: str, config: UpstreamConfig):
+        self.name = name
+        self.config = config
+        self.semaphore = asyncio.Semaphore(config.max_concurrency)
+        self.client = httpx.AsyncClient(
+            base_url=config.base_url,
+            http2=config.http2 and HTTP2_AVAILABLE,
+            limits=httpx.Limits(
+                max_connections=config.max_connections,
+                max_keepalive_connections=config.max_keepalive,
+            ),
+            timeout=httpx.Timeout(config.read_timeout, connect=config.connect_timeout),
+        )
+
+    def _count_errors(self, status_code: int):
+        if status_code >= 400:
+            upstream_error(self.name, f"http_{status_code // 100}xx")
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Send a request and read the full response body"""
+        async with self.semaphore:
+            try:
+                response = await self.client.request(method, url, **kwargs)
+            except httpx.HTTPError:
+                upstream_error(self.name, "transport")
+                raise
+        self._count_errors(response.status_code)
+        return response
+
+    async def stream(self, method: str, url: str, **kwargs) -> UpstreamStream:
+        """Send a request and return once headers arrive; the body is streamed by the caller"""
+        await self.semaphore.acquire()
+        try:
+            request = self.client.build_request(method, url, **kwargs)
+            response = await self.client.send(request, stream=True)
+        except BaseException as e:
+            self.semaphore.release()
+            if isinstance(e, httpx.HTTPError):
+                upstream_error(self.name, "transport")
+            raise
+        self._count_errors(response.status_code)
+        return UpstreamStream(response, self.semaphore.release)
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+class HTTPClientPool:
+    """Registry of per-upstream clients shared by every request on the worker"""
+
+    def __init__(self, upstreams: Dict[str, UpstreamConfig]):
+        self.upstreams = upstreams
+        self._clients: Dict[str, UpstreamClient] = {}
+
+    def get(self, name: str) -> UpstreamClient:
+        client = self._clients.get(name)
+        if client is None:
+            client = UpstreamClient(name, self.upstreams[name])
+            self._clients[name] = client
+        return client
+
+    async def start(self):
+        for name in self.upstreams:
+            self.get(name)
+        logger.info(f"HTTP client pool started (http2={'on' if HTTP2_AVAILABLE else 'off'})")
+
+    async def close(self):
+        clients, self._clients = self._clients, {}
+        for client in clients.values():
+            await client.aclose()
+
+
+pool = HTTPClientPool(UPSTREAMS)
@@ -0,0 +1,136 @@
+"""Compiled intent router for medical vs general questions
+
+The medical vocabulary (terms and synonyms with weights, loaded from text
+files) is compiled once into a single trie-shaped regular expression with
+word boundaries. Classifying a message is one regex scan whose cost depends
+on the message length, not on the number of terms. Matched concepts are
+scored by weight; an optional local classifier can decide messages that
+carry no vocabulary evidence.
+"""
+import importlib
+import logging
+import os
+import re
+import time
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Literal, Optional, Tuple
+
+from metrics import observe_stage
+
+logger = logging.getLogger(__name__)
+
+Intent = Literal['medical', 'general']
+
+DEFAULT_VOCABULARY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "medical_vocabulary.txt")
+
+# term -> (concept, weight); the concept is the first term on its line
+Vocabulary = Dict[str, Tuple[str, float]]
+
+
+def load_vocabulary(paths: Iterable[str]) -> Vocabulary:
+    """Read `term|synonym...<TAB>weight` lines from one or more files"""
+    vocabulary: Vocabulary = {}
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                terms, _, weight = line.partition("\t")
+                names = [term.strip().lower() for term in terms.split("|") if term.strip()]
+                if not names:
+                    continue
+                for name in names:
+                    vocabulary[name] = (names[0], float(weight) if weight.strip() else 1.0)
+    return vocabulary
+
+
+def compile_terms(terms: Iterable[str]) -> str:
+    """Build a regex alternation shaped like a trie of `terms`
+
+    Shared prefixes are matched once, and at every node longer terms are
+    preferred over shorter ones ("blood sugar" over "blood").
+    """
+    trie: dict = {}
+    for term in terms:
+        node = trie
+        for char in term:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def emit(node: dict) -> str:
+        branches = [re.escape(char) + emit(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{body})?" if "" in node else body
+
+    return emit(trie)
+
+
+class IntentRouter:
+    """Classify messages by weighted vocabulary matches, with an optional fallback classifier"""
+
+    def __init__(
+        self,
+        vocabulary: Vocabulary,
+        threshold: float = 1.0,
+        classifier: Optional[Callable[[str], float]] = None,
+    ):
+        self.vocabulary = vocabulary
+        self.threshold = threshold
+        self.classifier = classifier
+        self.pattern = re.compile(r"(?<!\w)(?:" + compile_terms(vocabulary) + r")(?!\w)")
+
+    def matches(self, message: str) -> Dict[str, float]:
+        """Matched concepts and their weights; each concept counts once"""
+        found: Dict[str, float] = {}
+        for match in self.pattern.finditer(message.lower()):
+            concept, weight = self.vocabulary[match.group()]
+            found[concept] = weight
+        return found
+
+    def score(self, message: str) -> float:
+        return sum(self.matches(message).values())
+
+    def classify(self, message: str) -> Intent:
+        score, seen = 0.0, set()
+        for match in self.pattern.finditer(message.lower()):
+            concept, weight = self.vocabulary[match.group()]
+            if concept in seen:
+                continue
+            seen.add(concept)
+            score += weight
+            if score >= self.threshold:
+                return 'medical'
+        if score == 0.0 and self.classifier is not None:
+            return 'medical' if self.classifier(message) >= 0.5 else 'general'
+        return 'general'
+
+
+def load_classifier(spec: Optional[str]) -> Optional[Callable[[str], float]]:
+    """Resolve a `module:callable` spec returning P(medical) for a message"""
+    if not spec:
+        return None
+    module_name, _, attr = spec.partition(":")
+    return getattr(importlib.import_module(module_name), attr)
+
+
+@lru_cache(maxsize=1)
+def default_router() -> IntentRouter:
+    """Router built from INTENT_VOCABULARY (comma-separated paths) and INTENT_CLASSIFIER"""
+    paths: List[str] = [path for path in os.getenv("INTENT_VOCABULARY", DEFAULT_VOCABULARY).split(",") if path]
+    router = IntentRouter(
+        load_vocabulary(paths),
+        threshold=float(os.getenv("INTENT_THRESHOLD", "1.0")),
+        classifier=load_classifier(os.getenv("INTENT_CLASSIFIER")),
+    )
+    logger.info(f"Intent router compiled {len(router.vocabulary)} terms")
+    return router
+
+
+def classify_intent(message: str) -> Intent:
+    started = time.perf_counter()
+    intent = default_router().classify(message)
+    observe_stage("intent", started)
+    return intent
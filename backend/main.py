@@ -1,17 +1,66 @@
-from fastapi import FastAPI, Request, WebSocket, HTTPException
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi import FastAPI, Request, Response, WebSocket, WebSocketDisconnect, HTTPException
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Literal, List, Dict, Any, Union
+from typing import Literal, List, Dict, Any, Union, AsyncIterator, Callable, NamedTuple, Optional
 import asyncio
 import time
-import requests
+import httpx
 import os
 import json
-import google.generativeai as genai
-from google.api_core.exceptions import GoogleAPIError
+import logging
+from contextlib import aclosing, asynccontextmanager
+from streaming import StreamTimer
+from http_clients import UpstreamStream, pool as http_pool
+from pipeline import pipeline_events, speak_pipeline
+from responses import CancellableStreamingResponse
+from starlette.background import BackgroundTask
+from stt import STTStream, STTUpstreamError, transcribe_prerecorded
+from admission import NEW, ONGOING, Overloaded, Ticket, create_gates, hold
+from audio import TARGET_RATE, PreparedAudio, StreamingPreprocessor, decoder_available, preprocess_audio
+from auth import InvalidToken, bearer_token, create_token_verifier
+from cache import ResponseCache, create_response_cache, normalize_prompt
+from coalesce import SingleFlight
+from conversation import AUDIO_IN, Channel, create_channel_registry, decode_frame
+import intent_router
+import metrics
+from models import registry as model_registry
+from model_router import create_model_router
+from sessions import create_session_store
+from sse import create_sse_streams, parse_last_event_id
+from speculation import Speculation, Speculator, Turn, tracker as speculation_tracker
+from tts import ELEVENLABS_MODEL_ID, RelayStats, TTSUpstreamError, open_tts_stream, relay_audio
+from tts_cache import create_tts_cache, load_phrases, tts_cache_key, warm_up
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Long-lived upstream connections for the lifetime of the worker
+    await http_pool.start()
+    intent_router.default_router()  # Compile the vocabulary before the first request
+    if not decoder_available():
+        logger.warning("`av` is not installed: webm/ogg uploads to /deepgram-proxy go to Deepgram without preprocessing")
+    background = []
+    if GEMINI_API_KEY and os.getenv("MODEL_WARM_UP", "build") != "off":
+        # MODEL_WARM_UP=call also sends each model a one-token request
+        background.append(asyncio.create_task(model_registry.warm_up(
+            sorted({name for policy in model_router.policies.values() for name in policy.models}),
+            call=os.getenv("MODEL_WARM_UP") == "call",
+            timeout=float(os.getenv("MODEL_WARM_UP_TIMEOUT", "10"))
+        )))
+    else:
+        model_registry.mark_ready()
+    if ELEVENLABS_API_KEY and os.getenv("TTS_WARM_UP", "1") != "0":
+        background.append(asyncio.create_task(
+            warm_up(tts_cache, warm_phrases(os.getenv("TTS_WARM_PHRASES")), tts_key, render_tts)
+        ))
+    yield
+    for task in background:
+        task.cancel()
+    await http_pool.close()
+
+app = FastAPI(lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -20,8 +69,13 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Readable by browsers: the stream id to resume a /stream reply, the turn id to report with a bug
+    expose_headers=["X-Stream-Id", "X-Turn-Id"],
 )
 
+# Request counts, durations, in-flight gauges and a correlation id (X-Turn-Id) per turn
+app.add_middleware(metrics.MetricsMiddleware)
+
 # Secrets from mounted files (GCP Secret Manager)
 def read_secret(path):
     try:
@@ -33,73 +87,270 @@ def read_secret(path):
 ELEVENLABS_API_KEY = read_secret("/secrets/ELEVENLABS_API_KEY") or os.getenv("ELEVENLABS_API_KEY", "")
 DEEPGRAM_API_KEY = read_secret("/secrets/DEEPGRAM_API_KEY") or os.getenv("DEEPGRAM_API_KEY", "")
 GEMINI_API_KEY = read_secret("/secrets/GEMINI_API_KEY") or os.getenv("GEMINI_API_KEY", "")
+LIVEKIT_API_KEY = read_secret("/secrets/LIVEKIT_API_KEY") or os.getenv("LIVEKIT_API_KEY", "")
+LIVEKIT_SECRET = read_secret("/secrets/LIVEKIT_SECRET") or os.getenv("LIVEKIT_SECRET", "")
 VOICE_ID = "EXAVITQu4vr4xnSDxMaL"  # Default voice
+FLASH_MODEL = "gemini-1.5-flash"
+MED_MODEL = "gemini-1.5-pro"  # Using a more capable model for medical queries
+VOICE_SETTINGS = { "stability": 0.5, "similarity_boost": 0.75 }
 
-# Configure Gemini API if key is available
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
+response_cache = create_response_cache()
+tts_cache = create_tts_cache()
+session_store = create_session_store()
+# Conversation history is only keyed on LiveKit tokens from our token server
+token_verifier = create_token_verifier(LIVEKIT_SECRET, LIVEKIT_API_KEY)
+# Per-upstream concurrency, rate limits and bounded wait queues
+gates = create_gates()
+# Ordered models per route with hedging; override with ROUTE_<ROUTE>_* settings
+model_router = create_model_router(f"{MED_MODEL},{FLASH_MODEL}", f"{FLASH_MODEL},{MED_MODEL}", gates["gemini"])
+# Resumable /ws/conversation channels of this instance
+channels = create_channel_registry()
+# Coalesced, resumable /stream replies; override with SSE_* settings
+sse_streams = create_sse_streams()
+# Identical concurrent model replies and /tts renders share one upstream call
+llm_flights = SingleFlight("gemini")
+tts_flights = SingleFlight("elevenlabs")
+CONVERSATION_HEARTBEAT_SECONDS = float(os.getenv("CONVERSATION_HEARTBEAT_SECONDS", "15"))
+
+# Gemini is configured with this key when the SDK is first loaded
+model_registry.configure(GEMINI_API_KEY)
 
 def classify_intent(message: str) -> Literal['medical', 'general']:
-    medical_keywords = ['diabetes', 'asthma', 'cancer', 'pregnancy', 'treatment', 'symptom', 'doctor', 'medicine', 
-                      'hospital', 'health', 'pain', 'disease', 'diagnosis', 'medical', 'patient']
-    return 'medical' if any(word in message.lower() for word in medical_keywords) else 'general'
+    # Compiled vocabulary router shared with api/backend.py
+    return intent_router.classify_intent(message)
 
-async def query_gemini_flash(prompt: str) -> List[str]:
-    try:
-        if not GEMINI_API_KEY:
-            raise ValueError("Gemini API key is not configured")
-            
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        response = await model.generate_content_async(prompt)
-        
-        if not response.text:
-            return ["I'm sorry,", " I", " couldn't", " generate", " a", " response.", " Please", " try", " again."]
-        
-        # Split response into tokens for streaming simulation
-        words = response.text.split()
-        tokens = []
-        for word in words:
-            tokens.append(word)
-            tokens.append(" ")
-        return tokens
-        
-    except (GoogleAPIError, ValueError) as e:
-        # Fallback response if API fails
-        return ["I'm", " having", " trouble", " connecting", " to", " my", " brain.", " Please", " try", " again."]
+FLASH_FALLBACK = "I'm having trouble connecting to my brain. Please try again."
+FLASH_EMPTY = "I'm sorry, I couldn't generate a response. Please try again."
+MED_FALLBACK = "I'm sorry, I'm having trouble accessing medical information. Please consult a healthcare professional."
+MED_EMPTY = "I'm sorry, I couldn't generate a medical response. Please consult a healthcare professional."
 
-async def query_medgemma(prompt: str) -> List[str]:
-    try:
-        if not GEMINI_API_KEY:
-            raise ValueError("Gemini API key is not configured")
-            
-        # Use Gemini with medical context prompt wrapping
-        model = genai.GenerativeModel('gemini-1.5-pro')  # Using a more capable model for medical queries
-        
-        # Wrap the prompt with medical context
-        medical_prompt = f"""As a medical AI assistant, answer the following medical question with factual information. 
-                         Be thorough and evidence-based, but accessible in your explanation: {prompt}"""
-        
-        response = await model.generate_content_async(medical_prompt)
-        
-        if not response.text:
-            return ["I'm sorry,", " I", " couldn't", " generate", " a", " medical", " response.", " Please", " consult", " a", " healthcare", " professional."]
-        
-        # Split response into tokens for streaming simulation
-        words = response.text.split()
-        tokens = []
-        for word in words:
-            tokens.append(word)
-            tokens.append(" ")
-        return tokens
-        
-    except (GoogleAPIError, ValueError) as e:
-        # Fallback response if API fails
-        return ["I'm", " sorry,", " I'm", " having", " trouble", " accessing", " medical", " information.", " Please", " consult", " a", " healthcare", " professional."]
+async def query_gemini_flash(prompt: str, timer: Optional[StreamTimer] = None) -> AsyncIterator[str]:
+    if not GEMINI_API_KEY:
+        yield FLASH_FALLBACK
+        return
+
+    async with aclosing(model_router.stream("general", prompt, FLASH_FALLBACK, FLASH_EMPTY, timer)) as reply:
+        async for token in reply:
+            yield token
+
+async def query_medgemma(prompt: str, timer: Optional[StreamTimer] = None) -> AsyncIterator[str]:
+    if not GEMINI_API_KEY:
+        yield MED_FALLBACK
+        return
+
+    # Wrap the prompt with medical context
+    medical_prompt = f"""As a medical AI assistant, answer the following medical question with factual information. 
+                     Be thorough and evidence-based, but accessible in your explanation: {prompt}"""
+
+    async with aclosing(model_router.stream("medical", medical_prompt, MED_FALLBACK, MED_EMPTY, timer)) as reply:
+        async for token in reply:
+            yield token
+
+class _ReplyOutcome(NamedTuple):
+    model: Optional[str]
+    error: Optional[str]
+
+class LeadSlot(NamedTuple):
+    """How a reply admits the Gemini call it ends up starting: the ticket it was admitted with, else a slot at `priority`"""
+    priority: int
+    ticket: Optional[Ticket] = None
+
+def route_primary(intent: str) -> str:
+    """The model a route asks first; replies are cached and coalesced under it"""
+    return model_router.policies[intent].models[0]
+
+def reply_flight_key(message: str, intent: str, prompt: Optional[str] = None) -> str:
+    """Requests with equal keys get the same reply: the response cache's key, or the full prompt with context"""
+    model = route_primary(intent)
+    if prompt is not None and prompt != message:
+        return ResponseCache.make_key(prompt, intent, model)
+    return ResponseCache.make_key(normalize_prompt(message), intent, model)
+
+async def _lead_reply(
+    query, text: str, label: str, lead: Optional[LeadSlot] = None,
+) -> AsyncIterator[Union[str, _ReplyOutcome]]:
+    if lead is not None:
+        # The flight owns the slot until the call ends, however many of its requests have left.
+        # A request admitted to join a flight that ended before the join (or whose ticket is
+        # gone already) starts a new call, which needs a slot of its own.
+        ticket = lead.ticket.transfer() if lead.ticket is not None else None
+        if ticket is None or ticket.released:
+            ticket = await gates["gemini"].acquire(lead.priority)
+        async with ticket:
+            async with aclosing(_lead_reply(query, text, label)) as items:
+                async for item in items:
+                    yield item
+        return
+    timer = StreamTimer(label)
+    async with aclosing(query(text, timer)) as reply:
+        async for token in reply:
+            yield token
+    yield _ReplyOutcome(timer.model, timer.error)
+
+async def shared_reply(
+    key: str, query, text: str, timer: StreamTimer, lead: Optional[LeadSlot] = None,
+) -> AsyncIterator[str]:
+    """`query(text)` shared with identical concurrent requests; `timer` sees every token and the answering model
+
+    With `lead`, a call this request ends up starting holds a Gemini slot for as long as it runs.
+    """
+    async with aclosing(llm_flights.stream(key, lambda: _lead_reply(query, text, timer.label, lead))) as items:
+        async for item in items:
+            if isinstance(item, _ReplyOutcome):
+                timer.model, timer.error = item.model, item.error
+                continue
+            timer.mark_token()
+            yield item
+
+def reply_tokens(
+    message: str,
+    intent: str,
+    timer: StreamTimer,
+    prompt: Optional[str] = None,
+    lead: Optional[LeadSlot] = None,
+    cache_lookup: bool = True,
+) -> AsyncIterator[str]:
+    """Stream the model reply for an intent, served from the response cache when possible
+
+    `prompt` carries conversation context; replies that depend on it are never cached.
+    Concurrent identical requests share one model call. cache_lookup=False
+    skips the lookup after `cached_reply` missed (the reply is still stored).
+    """
+    query = query_medgemma if intent == "medical" else query_gemini_flash
+    if not GEMINI_API_KEY:
+        return query(prompt or message, timer)
+    key = reply_flight_key(message, intent, prompt)
+    if prompt is not None and prompt != message:
+        return shared_reply(key, query, prompt, timer, lead)
+    return response_cache.stream(
+        message, intent, route_primary(intent), lambda: shared_reply(key, query, message, timer, lead), timer, cache_lookup)
+
+async def cached_reply(
+    message: str, intent: str, timer: StreamTimer, prompt: Optional[str] = None,
+) -> Optional[AsyncIterator[str]]:
+    """The response cache's reply, looked up before admission so that a hit never waits for a Gemini slot
+
+    None on a miss, and for replies that depend on conversation context.
+    """
+    if not GEMINI_API_KEY or (prompt is not None and prompt != message):
+        return None
+    chunks = await response_cache.lookup(message, intent, route_primary(intent))
+    return None if chunks is None else response_cache.replay(chunks, timer)
+
+async def admit_reply(
+    flight_key: str, priority: int, tokens: Callable[[LeadSlot], AsyncIterator[str]],
+) -> AsyncIterator[str]:
+    """`tokens(lead)` behind a Gemini slot, unless an identical call already in flight (and holding a slot) will serve them
+
+    The slot is taken here, so that an overloaded instance rejects the turn
+    before anything streams, and handed to the Gemini call the reply starts:
+    the call, shared by every request that joins it, releases it when it
+    ends. A reply that never starts a call releases it when it is closed.
+    The flight is only joined once the reply is read. If it has ended by
+    then, the reply starts a new call, which takes a slot at `priority`
+    before calling Gemini instead of running unadmitted.
 
-async def stream_tokens(tokens):
-    for tok in tokens:
-        yield f"data: {tok}\n\n"
-        await asyncio.sleep(0.1)  # Slightly faster token stream
+    Raises:
+        Overloaded: No Gemini slot became available in time
+    """
+    if llm_flights.in_flight(flight_key):
+        return tokens(LeadSlot(priority))
+    ticket = await gates["gemini"].acquire(priority)
+    return hold(ticket, tokens(LeadSlot(priority, ticket)))
+
+async def conversation_turn(
+    message: str,
+    intent: str,
+    timer: StreamTimer,
+    key: Optional[str],
+    priority: Optional[int] = None,
+    record: bool = True,
+) -> AsyncIterator[str]:
+    """Reply tokens for one turn, with history from (and saved to) the session `key` if given
+
+    A Gemini slot is taken before anything streams (unless the response
+    cache or an identical call already in flight will serve the reply), so
+    an overloaded instance answers 429/503 instead of a stalled stream. Turns of a conversation that
+    already has history are admitted ahead of new conversations. With
+    record=False the history is read but the turn is not saved.
+
+    Raises:
+        Overloaded: No Gemini slot became available in time
+    """
+    if not key:
+        priority = NEW if priority is None else priority
+        cached = await cached_reply(message, intent, timer)
+        if cached is not None:
+            return cached
+        return await admit_reply(
+            reply_flight_key(message, intent), priority,
+            lambda lead: reply_tokens(message, intent, timer, lead=lead, cache_lookup=False))
+    session = await session_store.load(key)
+    if priority is None:
+        priority = ONGOING if session.turns or session.summary else NEW
+    prompt = session.build_prompt(message)
+
+    def recorded(reply: AsyncIterator[str]) -> AsyncIterator[str]:
+        return session_store.record(session, message, reply) if record else reply
+
+    cached = await cached_reply(message, intent, timer, prompt)
+    if cached is not None:
+        return recorded(cached)
+    return await admit_reply(
+        reply_flight_key(message, intent, prompt), priority,
+        lambda lead: recorded(reply_tokens(message, intent, timer, prompt, lead, cache_lookup=False)))
+
+async def record_turn(key: str, message: str, tokens: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Pass a reply generated with record=False through and save the turn to session `key`"""
+    session = await session_store.load(key)
+    async with aclosing(session_store.record(session, message, tokens)) as reply:
+        async for token in reply:
+            yield token
+
+async def begin_turn(message: str, key: Optional[str], record: bool = True) -> Turn:
+    """Route a voice turn and admit its generation; the caller is mid-conversation on an open socket
+
+    Raises:
+        Overloaded: No Gemini slot became available in time
+    """
+    intent = classify_intent(message)
+    timer = StreamTimer(intent)
+    return intent, timer, await conversation_turn(message, intent, timer, key, priority=ONGOING, record=record)
+
+def voice_speculator(key: Optional[str]) -> Speculator:
+    # Speculative turns are recorded by whoever adopts them (start_turn)
+    return Speculator(lambda message: begin_turn(message, key, record=False))
+
+async def start_turn(message: str, key: Optional[str], speculation: Optional[Speculation] = None) -> Turn:
+    """A voice turn for `message`, reusing the speculation started for it if there is one
+
+    Raises:
+        Overloaded: No Gemini slot became available in time
+    """
+    if speculation is None:
+        return await begin_turn(message, key)
+    intent, timer, tokens = await speculation.adopt()
+    timer.turn_id = metrics.current_turn()
+    return intent, timer, record_turn(key, message, tokens) if key else tokens
+
+def token_session_key(token: Optional[str]) -> Optional[str]:
+    """History key from the room and identity a LiveKit token was issued for; None without a token
+
+    Raises:
+        InvalidToken: The token was not issued by our token server, or LIVEKIT_SECRET is not configured
+    """
+    if not token:
+        return None
+    if token_verifier is None:
+        raise InvalidToken("LIVEKIT_SECRET is not configured")
+    return token_verifier.session_key(token)
+
+def request_session_key(request: Request) -> Optional[str]:
+    # The LiveKit token from the token server, sent as "Authorization: Bearer <token>"
+    try:
+        return token_session_key(bearer_token(request.headers.get("Authorization")))
+    except InvalidToken as e:
+        raise HTTPException(status_code=401, detail=f"Invalid session token: {e}")
 
 @app.post("/stream")
 async def stream_response(request: Request):
@@ -110,13 +361,70 @@ async def stream_response(request: Request):
             raise HTTPException(status_code=400, detail="Message is required")
             
         intent = classify_intent(message)
-        tokens = await query_medgemma(message) if intent == "medical" else await query_gemini_flash(message)
-        return StreamingResponse(stream_tokens(tokens), media_type="text/event-stream")
+        timer = StreamTimer(intent)
+        tokens = await conversation_turn(message, intent, timer, request_session_key(request))
+        # {"resumable": true} keeps the reply generating for a GET /stream/<id> after a dropped connection
+        stream = await sse_streams.open(tokens, timer, resumable=body.get("resumable") is True)
+        return CancellableStreamingResponse(
+            sse_streams.read(stream),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Stream-Id": stream.stream_id}
+        )
     except json.JSONDecodeError:
         raise HTTPException(status_code=400, detail="Invalid JSON")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+@app.get("/stream/{stream_id}")
+async def resume_stream(stream_id: str, request: Request, last_event_id: Optional[str] = None):
+    """Resume a /stream reply after the Last-Event-ID header (or ?last_event_id=) and follow it live"""
+    after_id = parse_last_event_id(request.headers.get("Last-Event-ID") or last_event_id)
+    resumed = sse_streams.resume(stream_id, after_id)
+    if resumed is None:
+        raise HTTPException(status_code=404, detail="Stream expired or unknown")
+    stream, _ = resumed
+    return CancellableStreamingResponse(
+        sse_streams.read(stream, after_id, resumed=True),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Stream-Id": stream.stream_id}
+    )
+
+@app.delete("/stream/{stream_id}", status_code=204)
+async def cancel_stream(stream_id: str):
+    """Cancel a resumable /stream reply the client has abandoned (e.g. on barge-in)"""
+    if not sse_streams.cancel(stream_id):
+        raise HTTPException(status_code=404, detail="Stream expired or unknown")
+
+def tts_key(text: str) -> str:
+    return tts_cache_key(text, VOICE_ID, VOICE_SETTINGS, ELEVENLABS_MODEL_ID)
+
+async def render_tts(text: str) -> AsyncIterator[bytes]:
+    upstream = await open_tts_stream(text, VOICE_ID, ELEVENLABS_API_KEY, VOICE_SETTINGS)
+    return relay_audio(upstream)
+
+def warm_phrases(path: Optional[str] = None) -> List[str]:
+    """Fixed replies worth pre-rendering, plus any phrases listed in `path`"""
+    return [FLASH_FALLBACK, FLASH_EMPTY, MED_FALLBACK, MED_EMPTY] + load_phrases(path)
+
+async def render_shared_tts(text: str, key: str, stats: RelayStats) -> AsyncIterator[bytes]:
+    """Upstream side of a /tts flight: admission, the ElevenLabs stream and caching the audio"""
+    # Audio for a reply that was already generated: part of an ongoing conversation
+    ticket = await gates["elevenlabs"].acquire(ONGOING)
+    try:
+        upstream = await open_tts_stream(text, VOICE_ID, ELEVENLABS_API_KEY, VOICE_SETTINGS, stats)
+    except BaseException:
+        ticket.release()
+        raise
+    upstream.on_close(ticket.release)
+    try:
+        async with aclosing(tts_cache.record(key, relay_audio(upstream, stats=stats))) as audio:
+            async for chunk in audio:
+                yield chunk
+    finally:
+        await upstream.aclose()
+
 @app.post("/tts")
 async def elevenlabs_tts(request: Request):
     try:
@@ -128,37 +436,134 @@ async def elevenlabs_tts(request: Request):
             
         if not ELEVENLABS_API_KEY:
             raise HTTPException(status_code=500, detail="TTS API key is not configured")
-            
-        url = f"https://api.elevenlabs.io/v1/text-to-speech/{VOICE_ID}/stream"
-        headers = {
-            "xi-api-key": ELEVENLABS_API_KEY,
-            "Content-Type": "application/json"
-        }
-        payload = {
-            "text": text,
-            "voice_settings": { "stability": 0.5, "similarity_boost": 0.75 }
-        }
-        
-        response = requests.post(url, json=payload, headers=headers, stream=True)
-        
-        if response.status_code != 200:
-            raise HTTPException(status_code=response.status_code, detail=f"TTS API error: {response.text}")
-            
-        return StreamingResponse(response.iter_content(chunk_size=1024), media_type="audio/mpeg")
+
+        key = tts_key(text)
+        cached = tts_cache.lookup(key)
+        if cached is not None:
+            return CancellableStreamingResponse(cached, media_type="audio/mpeg", headers={"X-TTS-Cache": "hit"})
+
+        stats = RelayStats("tts")
+        audio, joined = await tts_flights.open(key, lambda: render_shared_tts(text, key, stats))
+        if joined:
+            headers = {"X-TTS-Coalesced": "1"}
+        else:
+            headers = {"Server-Timing": f"upstream;dur={stats.upstream_ms}"}
+        return CancellableStreamingResponse(audio, media_type="audio/mpeg", headers=headers)
+    except TTSUpstreamError as e:
+        raise HTTPException(status_code=e.status_code, detail=f"TTS API error: {e.detail}")
     except json.JSONDecodeError:
         raise HTTPException(status_code=400, detail="Invalid JSON")
-    except requests.RequestException as e:
+    except HTTPException:
+        raise
+    except httpx.HTTPError as e:
         raise HTTPException(status_code=500, detail=f"Error connecting to TTS service: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+async def synthesize_speech(text: str, output_format: Optional[str] = None) -> UpstreamStream:
+    """Open a TTS stream for one reply segment, holding an ElevenLabs slot until it closes"""
+    ticket = await gates["elevenlabs"].acquire(ONGOING)
+    try:
+        upstream = await open_tts_stream(
+            text, VOICE_ID, ELEVENLABS_API_KEY, VOICE_SETTINGS, output_format=output_format
+        )
+    except BaseException:
+        ticket.release()
+        raise
+    upstream.on_close(ticket.release)
+    return upstream
+
+@app.post("/speak")
+async def speak_response(request: Request):
+    """Stream the LLM reply and its TTS audio over one connection, sentence by sentence"""
+    try:
+        body = await request.json()
+        message = body.get("message", "")
+        if not message:
+            raise HTTPException(status_code=400, detail="Message is required")
+
+        if not ELEVENLABS_API_KEY:
+            raise HTTPException(status_code=500, detail="TTS API key is not configured")
+
+        intent = classify_intent(message)
+        timer = StreamTimer(intent)
+        tokens = await conversation_turn(message, intent, timer, request_session_key(request))
+        return CancellableStreamingResponse(
+            speak_pipeline(tokens, synthesize_speech, timer),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            # Frees the Gemini slot even if the client leaves before the pipeline starts
+            background=BackgroundTask(tokens.aclose)
+        )
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Invalid JSON")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
 @app.get("/health")
 async def health_check():
-    return {"status": "ok", "services": {
+    # 503 until the model clients are warm so Cloud Run only routes to ready instances
+    content = {"status": "ok" if model_registry.ready else "warming", "services": {
         "elevenlabs": "available" if ELEVENLABS_API_KEY else "unavailable",
         "deepgram": "available" if DEEPGRAM_API_KEY else "unavailable",
-        "gemini": "available" if GEMINI_API_KEY else "unavailable"
-    }}
+        "gemini": "available" if GEMINI_API_KEY else "unavailable",
+        # Without it compressed uploads skip silence trimming and resampling (see audio.py)
+        "audio_decoder": "available" if decoder_available() else "unavailable",
+    }, "models": model_registry.status()}
+    return JSONResponse(content, status_code=200 if model_registry.ready else 503)
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    # Prometheus scrape target
+    return Response(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/sessions/stats")
+async def sessions_stats():
+    return session_store.stats()
+
+@app.get("/routing/stats")
+async def routing_stats():
+    return model_router.stats()
+
+@app.get("/admission/stats")
+async def admission_stats():
+    return {name: gate.stats() for name, gate in gates.items()}
+
+@app.get("/coalescing/stats")
+async def coalescing_stats():
+    return {"llm": llm_flights.stats(), "tts": tts_flights.stats()}
+
+@app.get("/speculation/stats")
+async def speculation_stats():
+    return speculation_tracker.stats()
+
+@app.get("/conversation/stats")
+async def conversation_stats():
+    return channels.stats()
+
+@app.get("/sse/stats")
+async def sse_stats():
+    return sse_streams.stats()
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return {"responses": response_cache.stats(), "tts": tts_cache.stats()}
+
+EMPTY_TRANSCRIPT = {"results": {"channels": [{"alternatives": [{"transcript": "", "confidence": 0.0}]}]}}
+
+async def transcribe(prepared: PreparedAudio) -> Dict[str, Any]:
+    """Deepgram's result for preprocessed audio, taken behind a Deepgram slot; no call for silence
+
+    Raises:
+        STTUpstreamError: Deepgram returned a non-200 status
+        Overloaded: No Deepgram slot became available in time
+    """
+    if not prepared.speech:
+        return EMPTY_TRANSCRIPT
+    async with gates["deepgram"].slot():
+        return await transcribe_prerecorded(prepared.audio, prepared.content_type, DEEPGRAM_API_KEY)
 
 @app.post("/deepgram-proxy")
 async def deepgram_proxy(request: Request):
@@ -175,37 +580,316 @@ async def deepgram_proxy(request: Request):
             raise HTTPException(status_code=400, detail="Audio data required")
         
         audio_content = await audio.read()
+
+        # Trim silence, downmix and resample off the event loop; the label the browser
+        # gave the upload is ignored in favour of the sniffed container
+        prepared = await asyncio.to_thread(preprocess_audio, audio_content)
+        try:
+            return await transcribe(prepared)
+        except STTUpstreamError as e:
+            raise HTTPException(status_code=e.status_code, detail=f"Deepgram API error: {e.detail}")
         
-        # Forward to Deepgram
-        url = "https://api.deepgram.com/v1/listen"
-        headers = {
-            "Authorization": f"Token {DEEPGRAM_API_KEY}",
-            "Content-Type": "audio/wav"
-        }
-        
-        # Configure Deepgram parameters
-        params = {
-            "model": "nova-2",  # Use their latest model
-            "smart_format": "true",
-            "diarize": "false",
-            "punctuate": "true"
-        }
-        
-        # Send the request to Deepgram
-        response = requests.post(
-            url, 
-            headers=headers, 
-            params=params,
-            data=audio_content
-        )
-        
-        if response.status_code != 200:
-            raise HTTPException(
-                status_code=response.status_code,
-                detail=f"Deepgram API error: {response.text}"
-            )
-            
-        return response.json()
-        
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"STT proxy error: {str(e)}")
+
+async def reply_over_websocket(
+    websocket: WebSocket, message: str, key: Optional[str] = None, speculation: Optional[Speculation] = None,
+):
+    """Route a final transcript to the LLM and stream the reply as token events"""
+    metrics.new_turn()  # Each utterance is its own turn on a long-lived socket
+    try:
+        _, timer, tokens = await start_turn(message, key, speculation)
+    except Overloaded as e:
+        await websocket.send_json({"type": "error", "detail": e.detail, "retry_after": e.retry_after})
+        return
+    async with aclosing(tokens) as reply:
+        async for token in reply:
+            await websocket.send_json({"type": "token", "token": token})
+    timer.finish()
+    await websocket.send_json({"type": "response_end", **timer.as_dict()})
+
+@app.websocket("/ws/stt")
+async def stt_websocket(
+    websocket: WebSocket,
+    respond: bool = False,
+    token: Optional[str] = None,
+    sample_rate: Optional[int] = None,
+    channels: int = 1,
+):
+    """Streaming STT: binary audio frames in, interim/final/utterance transcripts out
+
+    Frames are container audio (e.g. MediaRecorder webm/opus chunks), which is
+    forwarded as-is: it is already compressed, and a partial container cannot
+    be trimmed. With ?sample_rate=<Hz>&channels=<n> they are raw 16-bit
+    little-endian PCM instead, and go through the same downmix, 16 kHz
+    resampling and silence gate as the agent worker's (audio.StreamingPreprocessor).
+    Send {"type": "stop"} (or close) to end the stream. With ?respond=true each
+    endpointed utterance is sent straight to the LLM and the reply is streamed back;
+    ?token=<LiveKit token> keeps those replies in the conversation session of
+    the room and identity it was issued for. A reply still streaming is cancelled when the caller starts speaking again
+    (barge-in) or sends {"type": "cancel"}, and a response_cancelled event is sent.
+    Replies are started speculatively on stable interim transcripts (speculation.py).
+    """
+    await websocket.accept()
+    try:
+        key = token_session_key(token)
+    except InvalidToken as e:
+        await websocket.send_json({"type": "error", "detail": f"Invalid session token: {e}"})
+        await websocket.close(code=1008)
+        return
+    if sample_rate is not None and not (8000 <= sample_rate <= 192000 and 1 <= channels <= 8):
+        await websocket.send_json({"type": "error", "detail": "Unsupported sample_rate or channels"})
+        await websocket.close(code=1003)
+        return
+    if not DEEPGRAM_API_KEY:
+        await websocket.send_json({"type": "error", "detail": "Deepgram API key not configured"})
+        await websocket.close(code=1011)
+        return
+
+    gate = StreamingPreprocessor(sample_rate, channels) if sample_rate is not None else None
+    stt = STTStream(DEEPGRAM_API_KEY, None if gate is None else {
+        "encoding": "linear16", "sample_rate": str(TARGET_RATE), "channels": "1",
+    })
+    try:
+        await stt.connect()
+    except Exception as e:
+        metrics.upstream_error("deepgram", "websocket")
+        await websocket.send_json({"type": "error", "detail": f"STT connection error: {str(e)}"})
+        await websocket.close(code=1011)
+        return
+
+    reply: Optional[asyncio.Task] = None
+    speculator = voice_speculator(key) if respond else None
+
+    async def cancel_reply(reason: str):
+        nonlocal reply
+        if reply is None or reply.done():
+            return
+        reply.cancel()
+        try:
+            await reply
+        except asyncio.CancelledError:
+            pass
+        reply = None
+        await websocket.send_json({"type": "response_cancelled", "reason": reason})
+
+    async def pump_audio():
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                if message.get("bytes"):
+                    if gate is None:
+                        await stt.send_audio(message["bytes"])
+                    else:
+                        await stt.send_gated(gate.feed(message["bytes"]))
+                elif message.get("text"):
+                    kind = json.loads(message["text"]).get("type")
+                    if kind == "stop":
+                        break
+                    if kind == "cancel":
+                        await cancel_reply("client")
+        finally:
+            try:
+                await stt.finish()
+            except Exception:
+                pass  # Upstream already closed
+
+    def pump_stopped(task: asyncio.Task):
+        # pump_audio's finally has already ended the upstream stream, which ends
+        # the event loop below and closes the socket; only the cause is left to report
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"STT audio pump failed (turn {metrics.current_turn()}): {task.exception()!r}")
+
+    pump = asyncio.create_task(pump_audio())
+    pump.add_done_callback(pump_stopped)
+    try:
+        async for event in stt.events():
+            if event["type"] == "interim" and event.get("transcript", "").strip():
+                await cancel_reply("barge_in")
+            await websocket.send_json(event)
+            if speculator is not None:
+                speculator.observe(event)
+            if respond and event["type"] == "utterance":
+                await cancel_reply("superseded")
+                speculation = speculator.take(event["transcript"])
+                reply = asyncio.create_task(reply_over_websocket(websocket, event["transcript"], key, speculation))
+        if reply is not None:
+            await reply  # Let the last answer finish before closing
+        await websocket.close()
+    except (WebSocketDisconnect, RuntimeError):
+        pass  # Client went away mid-stream
+    finally:
+        pump.cancel()
+        if reply is not None:
+            reply.cancel()
+        if speculator is not None:
+            speculator.close()
+        await stt.close()
+
+async def reply_over_channel(channel: Channel, message: str, speculation: Optional[Speculation] = None):
+    """Answer one utterance on a conversation channel: tokens, segment text and TTS audio frames"""
+    turn = channel.turns  # Before any await: a newer turn may start while this one waits
+    metrics.new_turn()
+    try:
+        intent, timer, tokens = await start_turn(message, channel.key, speculation)
+    except Overloaded as e:
+        await channel.send_event({"type": "error", "detail": e.detail, "retry_after": e.retry_after})
+        return
+    # Own the reply (and its Gemini slot) before the first await: a barge-in can cancel this task there
+    async with aclosing(tokens) as reply:
+        await channel.send_event({"type": "response_start", "turn": turn, "intent": intent})
+
+        async def forward_tokens():
+            async for token in reply:
+                await channel.send_event({"type": "token", "turn": turn, "token": token})
+                yield token
+
+        if not ELEVENLABS_API_KEY:
+            async with aclosing(forward_tokens()) as forwarded:
+                async for _ in forwarded:
+                    pass
+            timer.finish()
+            await channel.send_event({"type": "response_end", "turn": turn, **timer.as_dict()})
+            return
+
+        async with aclosing(pipeline_events(forward_tokens(), synthesize_speech, timer)) as events:
+            async for kind, seq, payload in events:
+                if kind == "audio":
+                    await channel.send_audio(seq, payload)
+                elif kind == "metrics":
+                    await channel.send_event({"type": "response_end", "turn": turn, **payload})
+                else:
+                    await channel.send_event({"type": kind, "turn": turn, "seq": seq, kind: payload})
+
+@app.websocket("/ws/conversation")
+async def conversation_websocket(
+    websocket: WebSocket,
+    token: Optional[str] = None,
+    resume: Optional[str] = None,
+    last_id: int = 0,
+):
+    """One connection for a whole voice conversation (see conversation.py for the framing)
+
+    Client to server: binary AUDIO_IN frames of microphone audio, and JSON
+    {"type": "audio_end"} (flush the transcript), {"type": "text", "text"} (a
+    typed turn), {"type": "cancel"}, {"type": "ping"} / {"type": "pong"}.
+    Server to client: {"type": "ready", "session", ...} first, then transcript
+    events (interim/final/utterance), response_start, token, text, error,
+    response_end and response_cancelled events, and binary TTS_AUDIO frames.
+    The server pings every CONVERSATION_HEARTBEAT_SECONDS and drops a socket
+    that stays silent for three intervals. Reconnect with ?resume=<session>&last_id=<id>
+    to continue where the connection broke; ?token=<LiveKit token> keys the
+    history on the room and identity the token was issued for.
+    """
+    await websocket.accept()
+    channel = channels.resume(resume) if resume else None
+    if channel is None:
+        try:
+            key = token_session_key(token)
+        except InvalidToken as e:
+            await websocket.send_json({"type": "error", "detail": f"Invalid session token: {e}"})
+            await websocket.close(code=1008)
+            return
+        channel = channels.open(key)
+        await channel.attach(websocket)
+    else:
+        channels.record_resume(await channel.attach(websocket, last_id))
+
+    stt: Optional[STTStream] = None
+    listener: Optional[asyncio.Task] = None
+
+    def respond(message: str, speculation: Optional[Speculation] = None):
+        channel.start_reply(reply_over_channel(channel, message, speculation))
+
+    async def listen(stream: STTStream):
+        nonlocal stt
+        speculator = voice_speculator(channel.key)
+        try:
+            async for event in stream.events():
+                if event["type"] == "interim":
+                    await channel.cancel_reply("barge_in")
+                await channel.send_event(event)
+                speculator.observe(event)
+                if event["type"] == "utterance":
+                    await channel.cancel_reply("superseded")
+                    respond(event["transcript"], speculator.take(event["transcript"]))
+        except Exception as e:
+            logger.warning(f"STT stream for conversation {channel.session_id} failed: {e}")
+            metrics.upstream_error("deepgram", "websocket")
+            await channel.send_event({"type": "error", "detail": "Speech recognition interrupted"})
+        finally:
+            speculator.close()
+            if stt is stream:
+                stt = None
+            await stream.close()
+
+    async def open_stt() -> Optional[STTStream]:
+        nonlocal stt, listener
+        if not DEEPGRAM_API_KEY:
+            await channel.send_event({"type": "error", "detail": "Deepgram API key not configured"})
+            return None
+        stream = STTStream(DEEPGRAM_API_KEY)
+        try:
+            await stream.connect()
+        except Exception as e:
+            metrics.upstream_error("deepgram", "websocket")
+            await channel.send_event({"type": "error", "detail": f"STT connection error: {str(e)}"})
+            return None
+        stt = stream
+        listener = asyncio.create_task(listen(stream))
+        return stream
+
+    async def heartbeat():
+        while True:
+            await asyncio.sleep(CONVERSATION_HEARTBEAT_SECONDS)
+            if time.monotonic() - channel.last_seen > 3 * CONVERSATION_HEARTBEAT_SECONDS:
+                logger.info(f"Conversation {channel.session_id} missed heartbeats, closing socket")
+                await websocket.close(code=1001)
+                return
+            await channel.send_control({"type": "ping", "t": time.time()})
+
+    pulse = asyncio.create_task(heartbeat())
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            channel.touch()
+            if message.get("bytes") is not None:
+                try:
+                    kind, _, _, payload = decode_frame(message["bytes"])
+                except ValueError as e:
+                    await channel.send_event({"type": "error", "detail": str(e)})
+                    continue
+                if kind != AUDIO_IN or not payload:
+                    continue
+                stream = stt or await open_stt()
+                if stream is not None:
+                    await stream.send_audio(payload)
+                continue
+            try:
+                event = json.loads(message.get("text") or "{}")
+            except json.JSONDecodeError:
+                await channel.send_event({"type": "error", "detail": "Invalid JSON"})
+                continue
+            kind = event.get("type")
+            if kind == "ping":
+                await channel.send_control({"type": "pong", "t": event.get("t")})
+            elif kind == "audio_end" and stt is not None:
+                await stt.finish()
+            elif kind == "text" and str(event.get("text", "")).strip():
+                await channel.cancel_reply("superseded")
+                respond(str(event["text"]).strip())
+            elif kind == "cancel":
+                await channel.cancel_reply("client")
+    except (WebSocketDisconnect, RuntimeError):
+        pass  # Client went away; the channel waits for a resume
+    finally:
+        pulse.cancel()
+        if listener is not None:
+            listener.cancel()
+        channels.release(channel, websocket)
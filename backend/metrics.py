@@ -0,0 +1,317 @@
+"""Prometheus-style metrics and per-turn correlation ids for the voice pipeline
+
+Counters, gauges and histograms live in a process-local registry and are
+rendered in the Prometheus text exposition format by GET /metrics. Recording
+a value is a dict lookup plus an addition (and a bisect for histograms), with
+no locks, I/O or background work, so instrumentation stays on in production.
+Metrics are updated from the event loop only.
+
+Each conversational turn gets a correlation id, taken from the caller's
+X-Request-ID header when it is sane or generated otherwise. It is echoed as
+X-Turn-Id, attached to the turn's metrics events and included in its logs,
+so one turn can be followed from STT through the LLM to TTS.
+"""
+import abc
+import re
+import time
+import uuid
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from starlette.routing import Match
+
+# Seconds; spans sub-millisecond stages (intent routing) up to long LLM replies
+DEFAULT_BUCKETS = (
+    0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if value == int(value) else repr(value)
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class Metric(abc.ABC):
+    """A named metric family; `labels(...)` returns the child for one label set"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    @abc.abstractmethod
+    def _new_child(self):
+        """A zeroed child for one new label set"""
+
+    def labels(self, *values: str):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+    def _render_child(self, values: Tuple[str, ...], child) -> Iterable[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self.labels().dec(amount)
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def _render_child(self, values: Tuple[str, ...], child: _HistogramChild) -> Iterable[str]:
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            labels = _format_labels(self.labelnames, values, f'le="{le}"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def _register(self, metric: Metric) -> Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# Prometheus text exposition format version served by /metrics
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+HTTP_REQUESTS = registry.counter(
+    "medconvo_http_requests_total", "HTTP requests by route, method and status", ("route", "method", "status"))
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "medconvo_http_request_duration_seconds", "HTTP request duration including the streamed body", ("route",))
+IN_FLIGHT = registry.gauge(
+    "medconvo_in_flight", "Requests and WebSocket connections currently being served", ("route",))
+STAGE_SECONDS = registry.histogram(
+    "medconvo_stage_duration_seconds", "Voice pipeline stage latency (stt, intent, tts_first_byte)", ("stage",))
+LLM_TTFT_SECONDS = registry.histogram(
+    "medconvo_llm_ttft_seconds", "Time from request to first streamed LLM token", ("model",))
+LLM_SECONDS = registry.histogram(
+    "medconvo_llm_duration_seconds", "Time from request to the end of the LLM stream", ("model",))
+UPSTREAM_ERRORS = registry.counter(
+    "medconvo_upstream_errors_total", "Failed upstream calls by upstream and kind", ("upstream", "kind"))
+CLIENT_DISCONNECTS = registry.counter(
+    "medconvo_client_disconnects_total", "Streamed responses abandoned by the client", ("route",))
+CANCELLED = registry.counter(
+    "medconvo_cancelled_total", "Upstream work cancelled before completion (llm, tts)", ("stage",))
+CANCELLED_SECONDS = registry.counter(
+    "medconvo_cancelled_work_seconds_total", "Time already spent on work that was then cancelled", ("stage",))
+
+
+def observe_stage(stage: str, started: float):
+    """Record the time since `started` (a perf_counter value) for a pipeline stage"""
+    STAGE_SECONDS.labels(stage).observe(time.perf_counter() - started)
+
+
+def record_cancelled(stage: str, started: float):
+    """Count work abandoned mid-flight and the time already spent on it"""
+    CANCELLED.labels(stage).inc()
+    CANCELLED_SECONDS.labels(stage).inc(time.perf_counter() - started)
+
+
+def upstream_error(upstream: str, kind: str):
+    UPSTREAM_ERRORS.labels(upstream, kind).inc()
+
+
+_turn_id: ContextVar[Optional[str]] = ContextVar("turn_id", default=None)
+_VALID_ID = re.compile(r"[A-Za-z0-9._:-]{1,64}")
+
+
+def new_turn(request_id: Optional[str] = None) -> str:
+    """Start a turn in the current context, reusing `request_id` if it is a sane id"""
+    turn_id = request_id if request_id and _VALID_ID.fullmatch(request_id) else uuid.uuid4().hex[:16]
+    _turn_id.set(turn_id)
+    return turn_id
+
+
+def current_turn() -> Optional[str]:
+    return _turn_id.get()
+
+
+class MetricsMiddleware:
+    """ASGI middleware: request counts, durations, in-flight gauges and turn ids
+
+    Durations cover the whole streamed response, not just the handler. Routes
+    are labelled by their declared path template (/stream/{stream_id}, not
+    each stream's own path); anything else counts as "other" so scanners
+    cannot blow up label cardinality.
+    """
+
+    MAX_REMEMBERED_PATHS = 10000
+
+    def __init__(self, app):
+        self.app = app
+        self._matched: Dict[Tuple[str, str, str], str] = {}
+
+    def _route(self, scope) -> str:
+        """Template of the route that will serve `scope`, matched the way the router does"""
+        key = (scope["type"], scope.get("method", ""), scope.get("path", ""))
+        route = self._matched.get(key)
+        if route is None:
+            route = "other"
+            for candidate in getattr(scope.get("app"), "routes", ()):
+                match, _ = candidate.matches(scope)
+                if match is Match.FULL:
+                    route = getattr(candidate, "path", "other")
+                    break
+            if len(self._matched) >= self.MAX_REMEMBERED_PATHS:
+                self._matched.clear()
+            self._matched[key] = route
+        return route
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        route = self._route(scope)
+        in_flight = IN_FLIGHT.labels(route)
+        in_flight.inc()
+        if scope["type"] == "websocket":
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                in_flight.dec()
+            return
+
+        request_id = None
+        for name, value in scope.get("headers", ()):
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")
+                break
+        turn_id = new_turn(request_id)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_turn_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", ())) + [(b"x-turn-id", turn_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_turn_id)
+        finally:
+            in_flight.dec()
+            # The router records the route it picked in the scope
+            route = getattr(scope.get("route"), "path", route)
+            HTTP_REQUEST_SECONDS.labels(route).observe(time.perf_counter() - started)
+            HTTP_REQUESTS.labels(route, scope.get("method", ""), str(status)).inc()
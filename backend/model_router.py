@@ -0,0 +1,320 @@
+"""Latency-aware model routing with hedged requests and ordered fallback
+
+Each route (medical, general) has an ordered list of models, a
+time-to-first-token SLO and an optional hedge deadline. The router keeps a
+moving latency and error profile per model and tries healthy models first.
+If the primary has not produced a token by the hedge deadline, the next
+model is started in parallel, provided both profiles are known and say it
+is faster and a Gemini admission slot is free for it right away, and
+whichever answers first wins; the loser is cancelled. A model that fails
+before its first token hands over to the next one in the list. The canned
+apology is only used once every model has failed.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from contextlib import aclosing
+from typing import AsyncIterator, Dict, List, Optional
+
+from admission import AdmissionGate, Ticket
+from metrics import LLM_SECONDS, LLM_TTFT_SECONDS, record_cancelled, registry as metrics_registry, upstream_error
+from models import registry as model_registry
+from streaming import StreamTimer, model_chunks
+
+logger = logging.getLogger(__name__)
+
+HEDGES = metrics_registry.counter(
+    "medconvo_llm_hedges_total", "Hedged LLM requests by route and outcome (won, lost, or skipped for want of a slot)",
+    ("route", "outcome"))
+FALLBACKS = metrics_registry.counter(
+    "medconvo_llm_fallbacks_total", "Replies served by a model other than the route's first choice", ("route", "model"))
+
+
+class ModelProfile:
+    """Moving time-to-first-token and error profile for one model"""
+
+    def __init__(self, alpha: float = 0.2, window: int = 100):
+        self.alpha = alpha
+        self.ttft_ewma: Optional[float] = None
+        self.error_ewma = 0.0
+        self.samples: deque = deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+        self.updated = 0.0
+
+    def observe_ttft(self, seconds: float):
+        """Record a first token (or, for a cancelled hedge loser, a lower bound on it)"""
+        self.requests += 1
+        self.ttft_ewma = seconds if self.ttft_ewma is None else (1 - self.alpha) * self.ttft_ewma + self.alpha * seconds
+        self.error_ewma *= 1 - self.alpha
+        self.samples.append(seconds)
+        self.updated = time.monotonic()
+
+    def observe_error(self):
+        self.requests += 1
+        self.errors += 1
+        self.error_ewma = (1 - self.alpha) * self.error_ewma + self.alpha
+        self.updated = time.monotonic()
+
+    def percentile(self, pct: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+    def healthy(self, ttft_slo: float, max_error_rate: float, recovery_s: float) -> bool:
+        # Profiles go stale so a model that was skipped gets retried eventually
+        if time.monotonic() - self.updated > recovery_s:
+            return True
+        if self.error_ewma >= max_error_rate:
+            return False
+        return self.ttft_ewma is None or self.ttft_ewma <= ttft_slo
+
+    def as_dict(self) -> Dict[str, object]:
+        p95 = self.percentile(95)
+        return {
+            "ttft_ewma_ms": None if self.ttft_ewma is None else round(self.ttft_ewma * 1000, 1),
+            "ttft_p95_ms": None if p95 is None else round(p95 * 1000, 1),
+            "error_rate": round(self.error_ewma, 3),
+            "requests": self.requests,
+            "errors": self.errors,
+        }
+
+
+class RoutePolicy:
+    def __init__(self, models: List[str], ttft_slo: float, hedge_after: Optional[float] = None):
+        self.models = models
+        self.ttft_slo = ttft_slo
+        self.hedge_after = hedge_after
+
+
+_END = object()
+
+
+class _Attempt:
+    """One model streaming into a queue; `first` resolves on its first token, error or end
+
+    A `ticket` (a hedge's own admission slot) is released when the attempt ends, however it ends.
+    """
+
+    def __init__(self, model_name: str, prompt: str, profile: ModelProfile, ticket: Optional[Ticket] = None):
+        self.model_name = model_name
+        self.profile = profile
+        self.started = time.perf_counter()
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.first: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.task = asyncio.create_task(self._run(prompt))
+        if ticket is not None:
+            self.task.add_done_callback(lambda _: ticket.release())
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    async def _run(self, prompt: str):
+        try:
+            async with aclosing(model_chunks(self.model_name, prompt)) as chunks:
+                async for text in chunks:
+                    if not self.first.done():
+                        ttft = self.elapsed
+                        self.profile.observe_ttft(ttft)
+                        LLM_TTFT_SECONDS.labels(self.model_name).observe(ttft)
+                        self.first.set_result(True)
+                    await self.queue.put(text)
+            if not self.first.done():
+                self.first.set_result(False)  # Finished without output
+            LLM_SECONDS.labels(self.model_name).observe(self.elapsed)
+            await self.queue.put(_END)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Error streaming from {self.model_name}: {e}")
+            upstream_error("gemini", "error")
+            if not self.first.done():
+                self.profile.observe_error()
+                self.first.set_result(e)
+            await self.queue.put(e)
+
+    def cancel(self):
+        if not self.first.done():
+            # The loser was at least this slow; keeps its profile honest
+            self.profile.observe_ttft(self.elapsed)
+        self.task.cancel()
+
+
+class ModelRouter:
+    def __init__(
+        self,
+        policies: Dict[str, RoutePolicy],
+        max_error_rate: float = 0.5,
+        recovery_s: float = 30.0,
+        hedge_gate: Optional[AdmissionGate] = None,
+    ):
+        self.policies = policies
+        self.max_error_rate = max_error_rate
+        self.recovery_s = recovery_s
+        # A hedge is an extra upstream call: it needs a slot of its own, taken without queueing
+        self.hedge_gate = hedge_gate
+        self.profiles: Dict[str, ModelProfile] = {}
+
+    def profile(self, model_name: str) -> ModelProfile:
+        profile = self.profiles.get(model_name)
+        if profile is None:
+            profile = self.profiles[model_name] = ModelProfile()
+        return profile
+
+    def candidates(self, route: str) -> List[str]:
+        """The route's models, those currently meeting its SLO and error budget first"""
+        policy = self.policies[route]
+        healthy, degraded = [], []
+        for name in policy.models:
+            ok = self.profile(name).healthy(policy.ttft_slo, self.max_error_rate, self.recovery_s)
+            (healthy if ok else degraded).append(name)
+        return healthy + degraded
+
+    def _worth_hedging(self, primary: str, hedge: str) -> bool:
+        """Only hedge onto a model known to be faster than the primary; an unprofiled model is not"""
+        primary_ttft, hedge_ttft = self.profile(primary).ttft_ewma, self.profile(hedge).ttft_ewma
+        return hedge_ttft is not None and primary_ttft is not None and hedge_ttft < primary_ttft
+
+    async def stream(
+        self,
+        route: str,
+        prompt: str,
+        fallback: str,
+        empty: Optional[str] = None,
+        timer: Optional[StreamTimer] = None,
+    ) -> AsyncIterator[str]:
+        """Stream a reply for `route`, hedging and falling back across its models
+
+        Args:
+            route: Policy name (e.g. "medical")
+            prompt: Full prompt sent to whichever model answers
+            fallback: Text yielded if every model fails before producing output
+            empty: Text yielded if the models finish without producing output
+            timer: Optional timer; `timer.model` is set to the model that answered
+
+        Yields:
+            Text chunks from the winning model
+        """
+        policy = self.policies[route]
+        queue = self.candidates(route)
+        primary = queue[0]
+        active: List[_Attempt] = []
+        winner: Optional[_Attempt] = None
+        hedged = False
+        finished_empty = False
+        started = time.perf_counter()
+        try:
+            active.append(_Attempt(queue.pop(0), prompt, self.profile(primary)))
+            while winner is None and active:
+                timeout = None
+                if not hedged and queue and len(active) == 1 and policy.hedge_after is not None:
+                    timeout = max(0.0, policy.hedge_after - active[0].elapsed)
+                done, _ = await asyncio.wait([attempt.first for attempt in active], timeout=timeout,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # Primary missed the hedge deadline
+                    hedged = True
+                    if not self._worth_hedging(active[0].model_name, queue[0]):
+                        continue
+                    ticket = self.hedge_gate.try_acquire() if self.hedge_gate is not None else None
+                    if self.hedge_gate is not None and ticket is None:
+                        HEDGES.labels(route, "skipped").inc()
+                        continue
+                    name = queue.pop(0)
+                    logger.info(f"Hedging {route} request from {active[0].model_name} to {name}")
+                    active.append(_Attempt(name, prompt, self.profile(name), ticket))
+                    continue
+                for attempt in list(active):
+                    if not attempt.first.done():
+                        continue
+                    if attempt.first.result() is True:
+                        winner = winner or attempt
+                        continue
+                    finished_empty = finished_empty or attempt.first.result() is False
+                    active.remove(attempt)
+                if winner is None and not active and queue:
+                    name = queue.pop(0)
+                    logger.info(f"Falling back from {primary} to {name} for {route}")
+                    active.append(_Attempt(name, prompt, self.profile(name)))
+
+            for attempt in active:
+                if attempt is not winner:
+                    attempt.cancel()
+            if hedged and winner is not None:
+                HEDGES.labels(route, "won" if winner.model_name != primary else "lost").inc()
+
+            if winner is None:
+                if timer:
+                    timer.error = "empty response" if finished_empty else "all models failed"
+                    timer.mark_token()
+                yield empty if finished_empty and empty else fallback
+                return
+
+            if winner.model_name != primary:
+                FALLBACKS.labels(route, winner.model_name).inc()
+            if timer:
+                timer.model = winner.model_name
+            while True:
+                item = await winner.queue.get()
+                if item is _END:
+                    break
+                if isinstance(item, Exception):
+                    # Failed mid-reply; a partial answer cannot be handed to another model
+                    if timer:
+                        timer.error = str(item)
+                    break
+                if timer:
+                    timer.mark_token()
+                    if timer.tokens == 1:
+                        model_registry.record_first_token(timer.ttft_ms)
+                yield item
+        except (asyncio.CancelledError, GeneratorExit):
+            # Client went away or barged in: stop paying for the generation
+            if any(not attempt.task.done() for attempt in active):
+                record_cancelled("llm", started)
+            raise
+        finally:
+            for attempt in active:
+                attempt.task.cancel()
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "routes": {
+                name: {"models": self.candidates(name), "ttft_slo_ms": round(policy.ttft_slo * 1000),
+                       "hedge_after_ms": None if policy.hedge_after is None else round(policy.hedge_after * 1000)}
+                for name, policy in self.policies.items()
+            },
+            "models": {name: profile.as_dict() for name, profile in self.profiles.items()},
+        }
+
+
+def _policy_from_env(route: str, models: str, ttft_slo: str, hedge_after: str) -> RoutePolicy:
+    prefix = f"ROUTE_{route.upper()}_"
+    hedge = os.getenv(prefix + "HEDGE_AFTER", hedge_after)
+    return RoutePolicy(
+        [name.strip() for name in os.getenv(prefix + "MODELS", models).split(",") if name.strip()],
+        ttft_slo=float(os.getenv(prefix + "TTFT_SLO", ttft_slo)),
+        hedge_after=float(hedge) if hedge else None,
+    )
+
+
+def create_model_router(
+    medical_models: str, general_models: str, hedge_gate: Optional[AdmissionGate] = None,
+) -> ModelRouter:
+    """Router from ROUTE_<ROUTE>_* environment settings, defaulting to the given model lists
+
+    Hedges take their own slot from `hedge_gate` and are skipped when none is free.
+    """
+    return ModelRouter(
+        {
+            "medical": _policy_from_env("medical", medical_models, "2.5", "1.5"),
+            "general": _policy_from_env("general", general_models, "1.0", "1.0"),
+        },
+        max_error_rate=float(os.getenv("ROUTE_MAX_ERROR_RATE", "0.5")),
+        recovery_s=float(os.getenv("ROUTE_RECOVERY_SECONDS", "30")),
+        hedge_gate=hedge_gate,
+    )
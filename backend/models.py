@@ -0,0 +1,138 @@
+"""Registry of reusable Gemini model clients
+
+GenerativeModel instances are built once per (model name, system
+instruction, generation config) and shared by every request instead of
+being constructed per call. At startup the registry can pre-build the
+models the app routes to and optionally send each a one-token warm-up
+request, so the first user request after a cold start does not pay for SDK
+and channel setup. Readiness and cold-start timings are exposed for /health.
+
+The SDK itself (google.generativeai with its gRPC and protobuf stack) is
+imported, and configured with the key from `configure()`, when the first
+model is built, so processes and routes that never call Gemini do not pay
+for it at start.
+"""
+import asyncio
+import json
+import logging
+import time
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Optional, Tuple
+
+if TYPE_CHECKING:
+    import google.generativeai as genai
+
+logger = logging.getLogger(__name__)
+
+# Import time of this module, a close proxy for worker start
+PROCESS_STARTED = time.perf_counter()
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 1)
+
+
+class ModelRegistry:
+    def __init__(self):
+        self._models: Dict[Tuple[str, Optional[str], str], "genai.GenerativeModel"] = {}
+        self._api_key: Optional[str] = None
+        self._genai = None
+        self.sdk_import_ms: Optional[float] = None
+        self.ready = False
+        self.startup_ms: Optional[float] = None
+        self.warm_up_ms: Optional[float] = None
+        self.warm_up_errors: Dict[str, str] = {}
+        self.first_request_ttft_ms: Optional[float] = None
+
+    def configure(self, api_key: Optional[str]):
+        """Key for the SDK; applied when it is first imported (or now, if it already is)"""
+        self._api_key = api_key
+        if self._genai is not None and api_key:
+            self._genai.configure(api_key=api_key)
+
+    def sdk(self):
+        """The Gemini SDK, imported and configured on first use"""
+        if self._genai is None:
+            started = time.perf_counter()
+            import google.generativeai as genai
+
+            if self._api_key:
+                genai.configure(api_key=self._api_key)
+            self._genai = genai
+            self.sdk_import_ms = _ms(time.perf_counter() - started)
+            logger.info(f"Gemini SDK loaded in {self.sdk_import_ms} ms")
+        return self._genai
+
+    def get(
+        self,
+        model_name: str,
+        system_instruction: Optional[str] = None,
+        generation_config: Optional[Dict[str, Any]] = None,
+    ) -> "genai.GenerativeModel":
+        key = (model_name, system_instruction, json.dumps(generation_config or {}, sort_keys=True))
+        model = self._models.get(key)
+        if model is None:
+            kwargs: Dict[str, Any] = {}
+            if system_instruction:
+                kwargs["system_instruction"] = system_instruction
+            if generation_config:
+                kwargs["generation_config"] = generation_config
+            model = self.sdk().GenerativeModel(model_name, **kwargs)
+            self._models[key] = model
+        return model
+
+    async def warm_up(self, model_names: Iterable[str], call: bool = False, timeout: float = 10.0):
+        """Build the given models and optionally send each a minimal request
+
+        The registry is marked ready afterwards even if a warm-up call failed,
+        or the SDK could not be loaded, so one unhealthy upstream cannot keep
+        the instance out of rotation; the failure shows in `warm_up_errors`.
+        """
+        started = time.perf_counter()
+
+        async def ping(name: str, model: "genai.GenerativeModel"):
+            try:
+                await asyncio.wait_for(
+                    model.generate_content_async("ping", generation_config={"max_output_tokens": 1}),
+                    timeout,
+                )
+            except Exception as e:
+                self.warm_up_errors[name] = str(e)
+                logger.warning(f"Warm-up call to {name} failed: {e}")
+
+        try:
+            # Import the SDK off the event loop so requests are served meanwhile
+            await asyncio.to_thread(self.sdk)
+            models = {name: self.get(name) for name in model_names}
+            if call:
+                await asyncio.gather(*(ping(name, model) for name, model in models.items()))
+        except Exception as e:
+            self.warm_up_errors["sdk"] = str(e)
+            logger.exception(f"Model warm-up failed: {e}")
+        finally:
+            self.mark_ready()
+            self.warm_up_ms = _ms(time.perf_counter() - started)
+            logger.info(f"Model registry ready: {self.status()}")
+
+    def mark_ready(self):
+        if not self.ready:
+            self.ready = True
+            self.startup_ms = _ms(time.perf_counter() - PROCESS_STARTED)
+
+    def record_first_token(self, ttft_ms: Optional[float]):
+        if self.first_request_ttft_ms is None and ttft_ms is not None:
+            self.first_request_ttft_ms = ttft_ms
+            logger.info(f"First request time-to-first-token: {ttft_ms} ms")
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "models": sorted({key[0] for key in self._models}),
+            "startup_ms": self.startup_ms,
+            "warm_up_ms": self.warm_up_ms,
+            "sdk_import_ms": self.sdk_import_ms,
+            "warm_up_errors": self.warm_up_errors,
+            "first_request_ttft_ms": self.first_request_ttft_ms,
+        }
+
+
+registry = ModelRegistry()
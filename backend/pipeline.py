@@ -0,0 +1,232 @@
+"""Sentence-level TTS pipelined with LLM generation
+
+The LLM token stream is cut into sentences (or clauses, once a sentence runs
+long) and each piece is sent to TTS while generation continues. Audio is
+emitted strictly in sentence order, but up to `lookahead` sentences are
+synthesized concurrently, so perceived latency drops from "full generation +
+full TTS" to "first sentence + first TTS chunk".
+"""
+import asyncio
+import base64
+import json
+import logging
+import re
+import time
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Optional, Tuple
+
+from http_clients import UpstreamStream
+from metrics import observe_stage, record_cancelled
+from streaming import StreamTimer, sse_event
+
+logger = logging.getLogger(__name__)
+
+SENTENCE_END = re.compile(r'[.!?]+["\')\]]*\s+|\n+')
+CLAUSE_END = re.compile(r'[,;:]\s+')
+
+
+class SentenceSplitter:
+    """Incrementally split streamed text into speakable chunks
+
+    Sentences are emitted at terminal punctuation or newlines. When a sentence
+    grows beyond `clause_chars` without ending, it is cut at the last clause
+    boundary so TTS can start before a long sentence finishes.
+    """
+
+    def __init__(self, clause_chars: int = 120, min_chars: int = 12):
+        self.clause_chars = clause_chars
+        self.min_chars = min_chars
+        self.buffer = ""
+
+    def feed(self, text: str) -> List[str]:
+        self.buffer += text
+        pieces = []
+        while True:
+            piece = self._next_piece()
+            if piece is None:
+                return pieces
+            if piece:
+                pieces.append(piece)
+
+    def flush(self) -> List[str]:
+        rest, self.buffer = self.buffer.strip(), ""
+        return [rest] if rest else []
+
+    def _next_piece(self) -> Optional[str]:
+        for match in SENTENCE_END.finditer(self.buffer):
+            if match.end() >= self.min_chars or match.group().startswith("\n"):
+                return self._cut(match.end())
+        if len(self.buffer) > self.clause_chars:
+            clauses = list(CLAUSE_END.finditer(self.buffer))
+            if clauses and clauses[-1].end() >= self.min_chars:
+                return self._cut(clauses[-1].end())
+        return None
+
+    def _cut(self, end: int) -> str:
+        piece, self.buffer = self.buffer[:end].strip(), self.buffer[end:]
+        return piece
+
+
+class PipelineStats:
+    """Latency milestones for one pipelined turn"""
+
+    def __init__(self, timer: StreamTimer):
+        self.timer = timer
+        self.first_text_at: Optional[float] = None
+        self.first_audio_at: Optional[float] = None
+        self.segments = 0
+        self.audio_bytes = 0
+        self.tts_errors = 0
+
+    def _ms(self, at: Optional[float]) -> Optional[float]:
+        return None if at is None else round((at - self.timer.started_at) * 1000, 1)
+
+    def as_dict(self):
+        return {
+            **self.timer.as_dict(),
+            "first_sentence_ms": self._ms(self.first_text_at),
+            "first_audio_ms": self._ms(self.first_audio_at),
+            "segments": self.segments,
+            "audio_bytes": self.audio_bytes,
+            "tts_errors": self.tts_errors,
+        }
+
+
+class _Segment:
+    def __init__(self, seq: int, text: str):
+        self.seq = seq
+        self.text = text
+        self.audio: asyncio.Queue = asyncio.Queue()
+        self.task: Optional[asyncio.Task] = None
+
+
+_DONE = object()
+
+
+async def pipeline_events(
+    tokens: AsyncIterator[str],
+    synthesize: Callable[[str], Awaitable[UpstreamStream]],
+    timer: StreamTimer,
+    lookahead: int = 2,
+    splitter: Optional[SentenceSplitter] = None,
+) -> AsyncIterator[Tuple[str, Optional[int], Any]]:
+    """Run LLM tokens through sentence splitting and TTS, yielding (kind, seq, payload)
+
+    Events:
+        ("text", seq, str) when a segment starts playing
+        ("audio", seq, bytes) MP3 bytes for that segment, in order
+        ("error", seq, str) if TTS failed for a segment (text is still sent)
+        ("metrics", None, dict) latency milestones once the turn is complete
+    """
+    splitter = splitter or SentenceSplitter()
+    stats = PipelineStats(timer)
+    slots = asyncio.Semaphore(lookahead)
+    segments: asyncio.Queue = asyncio.Queue()
+
+    async def synthesize_segment(segment: _Segment):
+        # The slot is released by the consumer once the segment has been sent,
+        # so at most `lookahead` segments of audio are ever held in memory
+        started = None
+        await slots.acquire()
+        try:
+            started = time.perf_counter()
+            upstream = await synthesize(segment.text)
+            first = True
+            async for chunk in upstream.aiter_bytes():
+                if first:
+                    observe_stage("tts_first_byte", started)
+                    first = False
+                await segment.audio.put(chunk)
+        except asyncio.CancelledError:
+            if started is not None:
+                record_cancelled("tts", started)
+            raise
+        except Exception as e:
+            logger.warning(f"TTS failed for segment {segment.seq}: {e}")
+            await segment.audio.put(e)
+        finally:
+            await segment.audio.put(_DONE)
+
+    async def produce():
+        seq = 0
+        try:
+            async for token in tokens:
+                for text in splitter.feed(token):
+                    seq = await schedule(seq, text)
+            for text in splitter.flush():
+                seq = await schedule(seq, text)
+        finally:
+            await segments.put(_DONE)
+
+    async def schedule(seq: int, text: str) -> int:
+        if stats.first_text_at is None:
+            stats.first_text_at = time.perf_counter()
+        segment = _Segment(seq, text)
+        segment.task = asyncio.create_task(synthesize_segment(segment))
+        await segments.put(segment)
+        return seq + 1
+
+    producer = asyncio.create_task(produce())
+    pending: List[_Segment] = []
+    try:
+        while True:
+            segment = await segments.get()
+            if segment is _DONE:
+                break
+            pending.append(segment)
+            stats.segments += 1
+            yield "text", segment.seq, segment.text
+            while True:
+                chunk = await segment.audio.get()
+                if chunk is _DONE:
+                    break
+                if isinstance(chunk, Exception):
+                    stats.tts_errors += 1
+                    yield "error", segment.seq, "TTS unavailable"
+                    continue
+                if stats.first_audio_at is None:
+                    stats.first_audio_at = time.perf_counter()
+                stats.audio_bytes += len(chunk)
+                yield "audio", segment.seq, chunk
+            pending.remove(segment)
+            slots.release()
+        await producer
+        timer.finish()
+        metrics = stats.as_dict()
+        logger.info(f"speak pipeline complete: {metrics}")
+        yield "metrics", None, metrics
+    finally:
+        # Client went away or the turn failed: stop generation and in-flight TTS
+        producer.cancel()
+        for segment in pending:
+            if segment.task:
+                segment.task.cancel()
+        while not segments.empty():
+            segment = segments.get_nowait()
+            if segment is not _DONE and segment.task:
+                segment.task.cancel()
+
+
+async def speak_pipeline(
+    tokens: AsyncIterator[str],
+    synthesize: Callable[[str], Awaitable[UpstreamStream]],
+    timer: StreamTimer,
+    lookahead: int = 2,
+    splitter: Optional[SentenceSplitter] = None,
+) -> AsyncIterator[str]:
+    """pipeline_events as SSE
+
+    Events:
+        text:    {"seq", "text"} when a segment starts playing
+        audio:   {"seq", "audio"} base64 MP3 bytes for that segment, in order
+        error:   {"seq", "error"} if TTS failed for a segment (text is still sent)
+        metrics: latency milestones once the turn is complete
+    """
+    async with aclosing(pipeline_events(tokens, synthesize, timer, lookahead, splitter)) as events:
+        async for kind, seq, payload in events:
+            if kind == "audio":
+                yield sse_event(json.dumps({"seq": seq, "audio": base64.b64encode(payload).decode()}), event="audio")
+            elif kind == "metrics":
+                yield sse_event(json.dumps(payload), event="metrics")
+            else:
+                yield sse_event(json.dumps({"seq": seq, kind: payload}), event=kind)
@@ -0,0 +1,55 @@
+"""Streaming responses that stop upstream work as soon as the client leaves
+
+Starlette's StreamingResponse only notices a disconnect on the next write
+when the server speaks ASGI 2.4 (current uvicorn), so a reply that is still
+waiting on Gemini or ElevenLabs keeps running, holding quota, connections and
+admission slots. CancellableStreamingResponse listens for the disconnect
+alongside the stream on every server, cancels the stream the moment it
+arrives and always closes the body iterator, so the `finally` blocks down
+the pipeline cancel model streams, close upstream HTTP requests and release
+concurrency slots right away.
+"""
+import asyncio
+import logging
+
+from starlette.responses import StreamingResponse
+
+from metrics import CLIENT_DISCONNECTS, current_turn
+
+logger = logging.getLogger(__name__)
+
+
+class CancellableStreamingResponse(StreamingResponse):
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await super().__call__(scope, receive, send)
+            return
+
+        stream = asyncio.create_task(self.stream_response(send))
+        listener = asyncio.create_task(self.listen_for_disconnect(receive))
+        disconnected = False
+        try:
+            await asyncio.wait({stream, listener}, return_when=asyncio.FIRST_COMPLETED)
+            if not stream.done():
+                disconnected = True
+                stream.cancel()
+            try:
+                await stream
+            except asyncio.CancelledError:
+                if not disconnected:
+                    raise  # The request itself was cancelled
+            except OSError:
+                disconnected = True  # Write to a closed socket
+        finally:
+            listener.cancel()
+            stream.cancel()
+            aclose = getattr(self.body_iterator, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+        if disconnected:
+            route = getattr(scope.get("route"), "path", "other")
+            CLIENT_DISCONNECTS.labels(route).inc()
+            logger.info(f"Client disconnected from {route} (turn {current_turn()}), stream cancelled")
+        if self.background is not None:
+            await self.background()
@@ -0,0 +1,243 @@
+"""Multi-turn conversation sessions with bounded, compacted history
+
+Sessions are keyed by the LiveKit room and participant identity issued by
+the token server. Each keeps a rolling summary plus the most recent turns;
+once the recent turns exceed the session's token budget, the oldest ones are
+folded into the summary so the prompt sent to the model stays bounded no
+matter how long the conversation runs. Idle sessions expire after a TTL.
+
+Storage is pluggable: the default keeps sessions in process; the Redis
+backend shares them across instances.
+"""
+import json
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from contextlib import aclosing
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_SENTENCE = re.compile(r"(?<=[.!?])\s+")
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English text)"""
+    return len(text) // 4 + 1
+
+
+def session_key(room: Optional[str], identity: Optional[str]) -> Optional[str]:
+    if not room or not identity:
+        return None
+    return f"{room}:{identity}"
+
+
+class Session:
+    """Summary plus recent (role, text, tokens) turns for one conversation"""
+
+    __slots__ = ("key", "summary", "turns", "updated_at", "prompt_tokens")
+
+    def __init__(self, key: str, summary: str = "", turns: Optional[List[Tuple[str, str, int]]] = None):
+        self.key = key
+        self.summary = summary
+        self.turns: List[Tuple[str, str, int]] = turns or []
+        self.updated_at = time.time()
+        self.prompt_tokens: List[int] = []
+
+    @property
+    def history_tokens(self) -> int:
+        return estimate_tokens(self.summary) + sum(tokens for _, _, tokens in self.turns)
+
+    @property
+    def approx_bytes(self) -> int:
+        return len(self.summary.encode()) + sum(len(text.encode()) + 64 for _, text, _ in self.turns) + 128
+
+    def add_turn(self, role: str, text: str):
+        self.turns.append((role, text, estimate_tokens(text)))
+        self.updated_at = time.time()
+
+    def build_prompt(self, message: str) -> str:
+        """Prompt with the conversation so far; the bare message on the first turn"""
+        if not self.summary and not self.turns:
+            prompt = message
+        else:
+            parts = []
+            if self.summary:
+                parts.append(f"Summary of the earlier conversation: {self.summary}")
+            if self.turns:
+                parts.append("Recent conversation:")
+                parts.extend(f"{'User' if role == 'user' else 'Assistant'}: {text}" for role, text, _ in self.turns)
+            parts.append(f"Current question: {message}")
+            prompt = "\n".join(parts)
+        self.prompt_tokens.append(estimate_tokens(prompt))
+        del self.prompt_tokens[:-20]
+        return prompt
+
+    def to_dict(self) -> Dict[str, object]:
+        return {"key": self.key, "summary": self.summary, "turns": self.turns, "updated_at": self.updated_at}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, object]) -> "Session":
+        session = cls(data["key"], data.get("summary", ""), [tuple(turn) for turn in data.get("turns", [])])
+        session.updated_at = data.get("updated_at", session.updated_at)
+        return session
+
+
+async def extractive_summary(summary: str, turns: List[Tuple[str, str, int]], max_tokens: int) -> str:
+    """Fold turns into the summary by keeping the first sentence of each, newest kept on overflow"""
+    pieces = [summary] if summary else []
+    for role, text, _ in turns:
+        first = _SENTENCE.split(text.strip(), 1)[0]
+        pieces.append(f"{'User asked' if role == 'user' else 'Assistant said'}: {first}")
+    folded = " ".join(pieces)
+    max_chars = max_tokens * 4
+    return folded if len(folded) <= max_chars else "…" + folded[-max_chars:]
+
+
+Summarizer = Callable[[str, List[Tuple[str, str, int]], int], Awaitable[str]]
+
+
+class MemorySessionBackend:
+    """Process-local sessions with LRU order for TTL sweeps"""
+
+    def __init__(self, max_sessions: int = 10000):
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+
+    async def get(self, key: str) -> Optional[Session]:
+        session = self._sessions.get(key)
+        if session is not None:
+            self._sessions.move_to_end(key)
+        return session
+
+    async def put(self, session: Session, ttl: float):
+        self._sessions[session.key] = session
+        self._sessions.move_to_end(session.key)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    async def delete(self, key: str):
+        self._sessions.pop(key, None)
+
+    def sweep(self, ttl: float) -> int:
+        cutoff = time.time() - ttl
+        expired = 0
+        while self._sessions:
+            key, session = next(iter(self._sessions.items()))
+            if session.updated_at >= cutoff:
+                break
+            del self._sessions[key]
+            expired += 1
+        return expired
+
+    def sessions(self) -> List[Session]:
+        return list(self._sessions.values())
+
+
+class RedisSessionBackend:
+    """Shared sessions for multi-instance deployments; the server enforces TTL"""
+
+    def __init__(self, url: str, prefix: str = "med-convo:session:"):
+        import redis.asyncio as redis  # Optional dependency, only needed for this backend
+
+        self.client = redis.from_url(url)
+        self.prefix = prefix
+
+    async def get(self, key: str) -> Optional[Session]:
+        raw = await self.client.get(self.prefix + key)
+        return Session.from_dict(json.loads(raw)) if raw else None
+
+    async def put(self, session: Session, ttl: float):
+        await self.client.set(self.prefix + session.key, json.dumps(session.to_dict()), ex=max(1, int(ttl)))
+
+    async def delete(self, key: str):
+        await self.client.delete(self.prefix + key)
+
+    def sweep(self, ttl: float) -> int:
+        return 0
+
+    def sessions(self) -> List[Session]:
+        return []
+
+
+class SessionStore:
+    def __init__(
+        self,
+        backend,
+        ttl: float = 1800,
+        token_budget: int = 1500,
+        summary_tokens: int = 300,
+        summarizer: Summarizer = extractive_summary,
+    ):
+        self.backend = backend
+        self.ttl = ttl
+        self.token_budget = token_budget
+        self.summary_tokens = summary_tokens
+        self.summarizer = summarizer
+        self.compactions = 0
+        self.expired = 0
+
+    async def load(self, key: str) -> Session:
+        self.expired += self.backend.sweep(self.ttl)
+        session = await self.backend.get(key)
+        if session is None or session.updated_at < time.time() - self.ttl:
+            session = Session(key)
+        return session
+
+    async def compact(self, session: Session):
+        """Fold the oldest turns into the summary until history fits the budget"""
+        if session.history_tokens <= self.token_budget:
+            return
+        target = self.token_budget * 3 // 4
+        folded = []
+        while len(session.turns) > 2 and session.history_tokens > target:
+            folded.append(session.turns.pop(0))
+        if folded:
+            session.summary = await self.summarizer(session.summary, folded, self.summary_tokens)
+            self.compactions += 1
+
+    async def record(self, session: Session, message: str, reply: AsyncIterator[str]) -> AsyncIterator[str]:
+        """Pass the reply through and save both turns once it has streamed completely"""
+        chunks = []
+        async with aclosing(reply) as stream:
+            async for chunk in stream:
+                chunks.append(chunk)
+                yield chunk
+        session.add_turn("user", message)
+        session.add_turn("assistant", "".join(chunks))
+        try:
+            await self.compact(session)
+            await self.backend.put(session, self.ttl)
+        except Exception as e:
+            logger.warning(f"Failed to save session {session.key}: {e}")
+
+    def stats(self) -> Dict[str, object]:
+        sessions = self.backend.sessions()
+        sizes = [session.approx_bytes for session in sessions]
+        prompts = [session.prompt_tokens[-1] for session in sessions if session.prompt_tokens]
+        return {
+            "sessions": len(sessions),
+            "bytes_total": sum(sizes),
+            "bytes_per_session_avg": round(sum(sizes) / len(sizes)) if sizes else 0,
+            "bytes_per_session_max": max(sizes, default=0),
+            "prompt_tokens_avg": round(sum(prompts) / len(prompts)) if prompts else 0,
+            "prompt_tokens_max": max(prompts, default=0),
+            "compactions": self.compactions,
+            "expired": self.expired,
+        }
+
+
+def create_session_store() -> SessionStore:
+    """Build the store from SESSION_* environment settings"""
+    if os.getenv("SESSION_BACKEND", "memory") == "redis":
+        backend = RedisSessionBackend(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+    else:
+        backend = MemorySessionBackend(int(os.getenv("SESSION_MAX", "10000")))
+    return SessionStore(
+        backend,
+        ttl=float(os.getenv("SESSION_TTL", "1800")),
+        token_budget=int(os.getenv("SESSION_TOKEN_BUDGET", "1500")),
+        summary_tokens=int(os.getenv("SESSION_SUMMARY_TOKENS", "300")),
+    )
@@ -0,0 +1,261 @@
+"""Speculative replies: start routing and generation on a stable interim transcript
+
+Waiting for the endpointed utterance before classifying the intent and
+calling the model puts STT endpointing, admission and the model's
+time-to-first-token back to back. A `Speculator` watches one speaker's
+transcript events instead. Once the running transcript (finals so far plus
+the current interim) has come back unchanged `stable_events` times, it
+starts the turn in the background and buffers the reply tokens. When the
+utterance arrives:
+
+- if it matches the speculated text, the speculation is adopted and its
+  buffered tokens are streamed at once (a hit);
+- otherwise the speculation is cancelled and the turn starts from scratch
+  (a miss).
+
+Matching ignores case, punctuation, whitespace and filler words. A
+speculation is also cancelled as soon as the transcript moves on. A
+speculation is never written to session history; only the adopter records
+the turn.
+"""
+import asyncio
+import logging
+import os
+import re
+import time
+from contextlib import aclosing
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from metrics import registry as metrics_registry
+from streaming import StreamTimer
+
+logger = logging.getLogger(__name__)
+
+SPECULATIVE_REPLIES = os.getenv("SPECULATIVE_REPLIES", "1") != "0"
+# Identical consecutive transcript hypotheses before a speculation starts
+SPECULATION_STABLE_EVENTS = int(os.getenv("SPECULATION_STABLE_EVENTS", "2"))
+SPECULATION_MIN_WORDS = int(os.getenv("SPECULATION_MIN_WORDS", "2"))
+# Speculations started per utterance at most; bounds the LLM calls a rambling speaker can waste
+SPECULATION_MAX_ATTEMPTS = int(os.getenv("SPECULATION_MAX_ATTEMPTS", "3"))
+
+SPECULATIONS = metrics_registry.counter(
+    "medconvo_speculation_total",
+    "Speculative replies by outcome (hit, failed, changed, mismatch, abandoned)", ("outcome",))
+SPECULATION_SAVED_SECONDS = metrics_registry.histogram(
+    "medconvo_speculation_saved_seconds", "Time to first token saved by adopted speculative replies")
+
+FILLERS = frozenset({"uh", "um", "umm", "erm", "er", "ah", "hmm", "mm", "mhm"})
+_WORD = re.compile(r"[a-z0-9']+")
+
+# (intent, timer, reply tokens)
+Turn = Tuple[str, StreamTimer, AsyncIterator[str]]
+
+
+def normalize(transcript: str) -> str:
+    """Transcript reduced to what matters for the reply: lowercase words, no punctuation or fillers"""
+    return " ".join(word for word in _WORD.findall(transcript.lower()) if word not in FILLERS)
+
+
+class SpeculationStats:
+    """Process-wide hit rate and latency saved"""
+
+    def __init__(self):
+        self.utterances = 0
+        self.started = 0
+        self.outcomes: Dict[str, int] = {}
+        self.saved_ms: List[float] = []
+        self.wasted_s = 0.0
+
+    def record(self, outcome: str, speculation: "Speculation"):
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+        SPECULATIONS.labels(outcome).inc()
+        if outcome != "hit":
+            self.wasted_s += time.perf_counter() - speculation.started_at
+
+    def record_saved(self, seconds: float):
+        SPECULATION_SAVED_SECONDS.observe(seconds)
+        self.saved_ms.append(round(seconds * 1000, 1))
+        del self.saved_ms[:-1000]  # Recent window only
+
+    def stats(self) -> Dict[str, object]:
+        hits = self.outcomes.get("hit", 0)
+        saved = sorted(self.saved_ms)
+        return {
+            "enabled": SPECULATIVE_REPLIES,
+            "utterances": self.utterances,
+            "started": self.started,
+            "outcomes": dict(self.outcomes),
+            "hit_rate": round(hits / self.utterances, 3) if self.utterances else None,
+            "precision": round(hits / self.started, 3) if self.started else None,
+            "saved_ms_avg": round(sum(saved) / len(saved), 1) if saved else None,
+            "saved_ms_p50": saved[len(saved) // 2] if saved else None,
+            "wasted_s": round(self.wasted_s, 2),
+        }
+
+
+tracker = SpeculationStats()
+
+_END = object()
+
+
+class Speculation:
+    """A turn started ahead of its final transcript, buffering reply tokens until adopted or cancelled"""
+
+    def __init__(self, transcript: str, begin: Callable[[str], Awaitable[Turn]]):
+        self.transcript = transcript
+        self.key = normalize(transcript)
+        self.started_at = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+        self.adopted_at: Optional[float] = None
+        self._items: asyncio.Queue = asyncio.Queue()
+        self._begun: asyncio.Future = asyncio.get_running_loop().create_future()
+        # A discarded speculation's admission error is nobody's business
+        self._begun.add_done_callback(lambda future: future.cancelled() or future.exception())
+        self._task = asyncio.create_task(self._run(begin))
+
+    async def _run(self, begin: Callable[[str], Awaitable[Turn]]):
+        try:
+            intent, timer, tokens = await begin(self.transcript)
+        except Exception as e:
+            if not self._begun.done():
+                self._begun.set_exception(e)
+            return
+        if not self._begun.done():
+            self._begun.set_result((intent, timer))
+        try:
+            async with aclosing(tokens) as stream:
+                async for token in stream:
+                    if self.first_token_at is None:
+                        self.first_token_at = time.perf_counter()
+                    self._items.put_nowait(token)
+        except Exception as e:
+            self._items.put_nowait(e)
+        finally:
+            self._items.put_nowait(_END)
+
+    @property
+    def saved_s(self) -> Optional[float]:
+        """Head start the adopter got on its first token"""
+        if self.adopted_at is None or self.first_token_at is None:
+            return None
+        return min(self.first_token_at, self.adopted_at) - self.started_at
+
+    async def adopt(self) -> Turn:
+        """The speculated turn, buffered tokens first
+
+        Counted as a hit only once the turn has started; one whose turn failed
+        to start (e.g. was not admitted) counts as failed.
+
+        Raises:
+            Whatever starting the turn raised (e.g. admission.Overloaded)
+        """
+        first = self.adopted_at is None
+        if first:
+            self.adopted_at = time.perf_counter()
+        try:
+            intent, timer = await asyncio.shield(self._begun)
+        except BaseException as e:
+            self.cancel()
+            if first:
+                tracker.record("abandoned" if isinstance(e, asyncio.CancelledError) else "failed", self)
+            raise
+        if first:
+            tracker.record("hit", self)
+        return intent, timer, self._drain()
+
+    async def _drain(self) -> AsyncIterator[str]:
+        try:
+            first = True
+            while True:
+                item = await self._items.get()
+                if item is _END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                if first and self.saved_s is not None:
+                    tracker.record_saved(self.saved_s)
+                first = False
+                yield item
+        finally:
+            self.cancel()  # Stop generating once the adopter stops reading
+
+    def cancel(self):
+        if not self._task.done():
+            self._task.cancel()
+        if not self._begun.done():
+            self._begun.cancel()
+
+
+class Speculator:
+    """Speculation for one speaker's stream of transcript events (see stt.STTStream.events)"""
+
+    def __init__(
+        self,
+        begin: Callable[[str], Awaitable[Turn]],
+        stable_events: int = SPECULATION_STABLE_EVENTS,
+        min_words: int = SPECULATION_MIN_WORDS,
+        max_attempts: int = SPECULATION_MAX_ATTEMPTS,
+        enabled: bool = SPECULATIVE_REPLIES,
+    ):
+        self.begin = begin
+        self.stable_events = stable_events
+        self.min_words = min_words
+        self.max_attempts = max_attempts
+        self.enabled = enabled and stable_events > 0
+        self.current: Optional[Speculation] = None
+        self._reset()
+
+    def _reset(self):
+        self.finals: List[str] = []
+        self.candidate = ""
+        self.seen = 0
+        self.attempts = 0
+
+    def _drop(self, outcome: str):
+        speculation, self.current = self.current, None
+        if speculation is not None:
+            speculation.cancel()
+            tracker.record(outcome, speculation)
+
+    def observe(self, event: Dict[str, object]):
+        """Feed one transcript event; starts or cancels the speculation as the hypothesis settles"""
+        if not self.enabled or event["type"] not in ("interim", "final"):
+            return
+        if event["type"] == "final":
+            self.finals.append(str(event["transcript"]))
+            text = " ".join(self.finals)
+        else:
+            text = " ".join(self.finals + [str(event["transcript"])])
+        key = normalize(text)
+        if key == self.candidate:
+            self.seen += 1
+        else:
+            self.candidate, self.seen = key, 1
+            if self.current is not None and self.current.key != key:
+                self._drop("changed")
+
+        stable = self.seen >= self.stable_events and len(key.split()) >= self.min_words
+        if stable and self.current is None and self.attempts < self.max_attempts:
+            self.attempts += 1
+            tracker.started += 1
+            self.current = Speculation(text, self.begin)
+
+    def take(self, transcript: str) -> Optional[Speculation]:
+        """The speculation matching the endpointed `transcript`, if any; any other is cancelled"""
+        if not self.enabled:
+            return None
+        tracker.utterances += 1
+        speculation = self.current
+        self.current = None
+        self._reset()
+        if speculation is None:
+            return None
+        if speculation.key != normalize(transcript):
+            speculation.cancel()
+            tracker.record("mismatch", speculation)
+            return None
+        return speculation  # Counted as a hit once adopted
+
+    def close(self):
+        self._drop("abandoned")
+        self._reset()
@@ -0,0 +1,329 @@
+"""Resumable, coalescing Server-Sent Events output for /stream
+
+Each reply is generated by a producer task that is independent of the HTTP
+response reading it. Tokens are joined into batches before they are framed:
+the first token goes out at once (time to first token is unchanged), later
+ones are flushed every `coalesce_ms` or once `coalesce_bytes` are pending, so
+a reply costs a few dozen writes instead of one per token. Every event is
+JSON (`{"token": ...}`, then a final `metrics` event), carries an increasing
+`id` and is kept in a short per-stream replay buffer.
+
+A reply nobody is reading is cancelled as soon as its client goes away,
+unless the request opted in to resuming it. A resumable reply keeps
+generating for `resume_seconds` after its last reader leaves: the client
+reconnects to GET /stream/<stream_id> (the id comes back in the X-Stream-Id
+header) with a Last-Event-ID header and gets every event after it, then the
+rest of the reply live. Such a client cancels a reply it no longer wants
+(barge-in) with DELETE /stream/<stream_id>. Idle connections get a `: ping`
+comment every `heartbeat_seconds` so proxies keep them open.
+"""
+import asyncio
+import json
+import logging
+import os
+import secrets
+import time
+from collections import deque
+from contextlib import aclosing
+from itertools import islice
+from typing import AsyncIterator, Callable, Deque, Dict, List, Optional, Tuple
+
+from admission import Overloaded
+from metrics import registry as metrics_registry
+from streaming import StreamTimer, sse_event
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT = ": ping\n\n"
+RETRY_MS = 1000  # Reconnect delay advertised to EventSource clients
+
+RESUMES = metrics_registry.counter(
+    "medconvo_sse_resumes_total", "SSE stream reconnects by outcome (resumed, gap, expired)", ("outcome",))
+FLUSHES = metrics_registry.counter(
+    "medconvo_sse_flushes_total", "Coalesced token batches written to SSE streams")
+STREAMS = metrics_registry.gauge(
+    "medconvo_sse_streams", "SSE streams held, live or awaiting resume")
+
+
+class Coalescer:
+    """Joins tokens into batches handed to `emit`; the first token is emitted alone and immediately
+
+    A batch is emitted `max_delay` seconds after its first token arrived or as
+    soon as it holds `max_bytes` characters, whichever comes first, so adding
+    a token costs an append and one timer is armed per batch. max_delay=0
+    passes tokens through one by one.
+    """
+
+    def __init__(self, emit: Callable[[str], None], max_delay: float, max_bytes: int):
+        self.emit = emit
+        self.max_delay = max_delay
+        self.max_bytes = max_bytes
+        self._pending: List[str] = []
+        self._size = 0
+        self._first = True
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def add(self, token: str):
+        self._pending.append(token)
+        self._size += len(token)
+        if self._first or self._size >= self.max_bytes or self.max_delay <= 0:
+            self._first = False
+            self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_delay, self.flush)
+
+    def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._pending:
+            batch = "".join(self._pending)
+            self._pending, self._size = [], 0
+            self.emit(batch)
+
+    def discard(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._pending, self._size = [], 0
+
+
+class ReplayStream:
+    """Numbered SSE frames of one reply, kept for replay while they fit in `replay_bytes`"""
+
+    def __init__(self, stream_id: str, replay_bytes: int, resume_seconds: float = 0.0):
+        self.stream_id = stream_id
+        self.replay_bytes = replay_bytes
+        self.resume_seconds = resume_seconds  # How long the reply outlives its last reader; 0 cancels it at once
+        self.last_id = 0
+        self.done = False
+        self.readers = 0
+        self.detached_at: Optional[float] = time.monotonic()
+        self.task: Optional[asyncio.Task] = None
+        self.started = False  # The producer has taken ownership of the reply tokens
+        self.dropped = False
+        self._frames: Deque[Tuple[int, str]] = deque()
+        self._size = 0
+        self._wake = asyncio.Event()
+
+    def publish(self, data: str, event: Optional[str] = None):
+        self.last_id += 1
+        frame = sse_event(data, event, event_id=self.last_id)
+        self._frames.append((self.last_id, frame))
+        self._size += len(frame)
+        while self._size > self.replay_bytes and len(self._frames) > 1:
+            _, dropped = self._frames.popleft()
+            self._size -= len(dropped)
+        self._notify()
+
+    def finish(self):
+        self.done = True
+        self._notify()
+
+    def _notify(self):
+        self._wake.set()
+        self._wake = asyncio.Event()
+
+    def complete_after(self, after_id: int) -> bool:
+        """False if some events after `after_id` were already dropped from the replay buffer"""
+        return not self._frames or self._frames[0][0] <= after_id + 1
+
+    def _frames_after(self, after_id: int) -> str:
+        if not self._frames or after_id >= self.last_id:
+            return ""
+        # Ids are contiguous, so the first unsent frame is found by offset
+        start = max(0, after_id + 1 - self._frames[0][0])
+        return "".join(frame for _, frame in islice(self._frames, start, None))
+
+    async def frames(self, after_id: int, heartbeat_seconds: float) -> AsyncIterator[str]:
+        """Everything after `after_id`, then new frames as they are published
+
+        Frames published while the reader was writing are sent in one chunk.
+        """
+        cursor = after_id
+        while True:
+            wake = self._wake
+            pending = self._frames_after(cursor)
+            if pending:
+                cursor = self.last_id
+                yield pending
+                continue
+            if self.done:
+                return
+            try:
+                await asyncio.wait_for(wake.wait(), heartbeat_seconds)
+            except asyncio.TimeoutError:
+                yield HEARTBEAT
+
+
+class SSEStreams:
+    """Replies of this instance by stream id; resumable ones are kept `resume_seconds` after their last reader leaves"""
+
+    def __init__(
+        self,
+        coalesce_ms: float = 40.0,
+        coalesce_bytes: int = 512,
+        heartbeat_seconds: float = 15.0,
+        resume_seconds: float = 10.0,
+        replay_bytes: int = 256_000,
+        max_streams: int = 1000,
+    ):
+        self.coalesce_seconds = coalesce_ms / 1000
+        self.coalesce_bytes = coalesce_bytes
+        self.heartbeat_seconds = heartbeat_seconds
+        self.resume_seconds = resume_seconds
+        self.replay_bytes = replay_bytes
+        self.max_streams = max_streams
+        self.opened = 0
+        self.flushes = 0
+        self.resumes: Dict[str, int] = {}
+        self._streams: Dict[str, ReplayStream] = {}
+
+    def __len__(self) -> int:
+        return len(self._streams)
+
+    def _count(self, outcome: str):
+        self.resumes[outcome] = self.resumes.get(outcome, 0) + 1
+        RESUMES.labels(outcome).inc()
+
+    async def open(self, tokens: AsyncIterator[str], timer: StreamTimer, resumable: bool = False) -> ReplayStream:
+        """Start producing `tokens` into a new stream; nothing is lost before the first reader attaches
+
+        Raises:
+            Overloaded: max_streams replies are held and none is waiting for a resume; `tokens` is closed
+        """
+        if len(self._streams) >= self.max_streams:
+            self._evict_detached()
+        if len(self._streams) >= self.max_streams:
+            await tokens.aclose()
+            raise Overloaded("sse", "queue_full", max(1, RETRY_MS // 1000))
+        stream = ReplayStream(secrets.token_urlsafe(12), self.replay_bytes, self.resume_seconds if resumable else 0.0)
+        stream.task = asyncio.create_task(self._produce(stream, tokens, timer))
+        self._streams[stream.stream_id] = stream
+        self.opened += 1
+        STREAMS.set(len(self._streams))
+        return stream
+
+    async def _produce(self, stream: ReplayStream, tokens: AsyncIterator[str], timer: StreamTimer):
+        def emit(batch: str):
+            stream.publish(json.dumps({"token": batch}))
+            self.flushes += 1
+            FLUSHES.inc()
+
+        stream.started = True
+        if stream.dropped:
+            # Dropped before this task first ran; the tokens (and any slot they hold) are still ours to close
+            await tokens.aclose()
+            return
+        batches = Coalescer(emit, self.coalesce_seconds, self.coalesce_bytes)
+        try:
+            async with aclosing(tokens) as reply:
+                async for token in reply:
+                    batches.add(token)
+            batches.flush()
+            timer.finish()
+            metrics = {**timer.as_dict(), "events": stream.last_id}
+            logger.info(f"stream complete: {metrics}")
+            stream.publish(json.dumps(metrics), event="metrics")
+        except asyncio.CancelledError:
+            logger.info(f"Stream {stream.stream_id} cancelled after {stream.last_id} events (turn {timer.turn_id})")
+            raise
+        except Exception as e:
+            logger.exception(f"Stream {stream.stream_id} failed (turn {timer.turn_id}): {e}")
+            batches.flush()
+            stream.publish(json.dumps({"error": "stream failed"}), event="error")
+        finally:
+            batches.discard()
+            stream.finish()
+            if stream.readers == 0:
+                self._schedule_expiry(stream)
+
+    def resume(self, stream_id: str, last_event_id: int) -> Optional[Tuple[ReplayStream, bool]]:
+        """The stream for `stream_id` and whether the replay after `last_event_id` is complete, or None if it expired"""
+        stream = self._streams.get(stream_id)
+        if stream is None:
+            self._count("expired")
+            return None
+        complete = stream.complete_after(last_event_id)
+        self._count("resumed" if complete else "gap")
+        return stream, complete
+
+    async def read(self, stream: ReplayStream, after_id: int = 0, resumed: bool = False) -> AsyncIterator[str]:
+        """Response body for one reader of `stream`, starting after event `after_id`"""
+        stream.readers += 1
+        stream.detached_at = None
+        try:
+            yield f"retry: {RETRY_MS}\n\n"
+            if resumed:
+                yield sse_event(json.dumps({
+                    "stream_id": stream.stream_id,
+                    "replay_gap": not stream.complete_after(after_id),
+                    "last_id": stream.last_id,
+                }), event="resume")
+            async for chunk in stream.frames(after_id, self.heartbeat_seconds):
+                yield chunk
+        finally:
+            stream.readers -= 1
+            if stream.readers == 0:
+                stream.detached_at = time.monotonic()
+                if stream.resume_seconds <= 0:
+                    self._drop(stream)
+                else:
+                    self._schedule_expiry(stream)
+
+    def cancel(self, stream_id: str) -> bool:
+        """Cancel a reply its client no longer wants; False if it is unknown or already expired"""
+        stream = self._streams.get(stream_id)
+        if stream is None:
+            return False
+        self._drop(stream)
+        return True
+
+    def _schedule_expiry(self, stream: ReplayStream):
+        asyncio.get_running_loop().call_later(stream.resume_seconds, self._expire, stream, stream.detached_at)
+
+    def _expire(self, stream: ReplayStream, detached_at: Optional[float]):
+        if stream.readers == 0 and stream.detached_at == detached_at:
+            self._drop(stream)
+
+    def _drop(self, stream: ReplayStream):
+        if self._streams.pop(stream.stream_id, None) is not None:
+            STREAMS.set(len(self._streams))
+        stream.dropped = True
+        # Cancelling a task that has not run yet would skip its cleanup; it sees `dropped` instead
+        if stream.started and stream.task is not None and not stream.task.done():
+            stream.task.cancel()
+
+    def _evict_detached(self):
+        detached = [stream for stream in self._streams.values() if stream.readers == 0]
+        for stream in sorted(detached, key=lambda stream: stream.detached_at or 0)[: max(1, len(detached) // 10)]:
+            self._drop(stream)
+
+    def stats(self) -> Dict[str, object]:
+        live = sum(1 for stream in self._streams.values() if stream.readers)
+        return {
+            "streams": len(self._streams),
+            "live": live,
+            "awaiting_resume": len(self._streams) - live,
+            "opened": self.opened,
+            "flushes": self.flushes,
+            "resumes": dict(self.resumes),
+        }
+
+
+def parse_last_event_id(value: Optional[str]) -> int:
+    try:
+        return max(0, int(value)) if value else 0
+    except ValueError:
+        return 0
+
+
+def create_sse_streams() -> SSEStreams:
+    return SSEStreams(
+        coalesce_ms=float(os.getenv("SSE_COALESCE_MS", "40")),
+        coalesce_bytes=int(os.getenv("SSE_COALESCE_BYTES", "512")),
+        heartbeat_seconds=float(os.getenv("SSE_HEARTBEAT_SECONDS", "15")),
+        resume_seconds=float(os.getenv("SSE_RESUME_SECONDS", "10")),
+        replay_bytes=int(os.getenv("SSE_REPLAY_BYTES", "256000")),
+        max_streams=int(os.getenv("SSE_MAX_STREAMS", "1000")),
+    )
@@ -0,0 +1,149 @@
+"""Shared LLM streaming engine used by backend/main.py and api/backend.py
+
+Model chunks are forwarded to the caller as soon as Gemini produces them, so
+the SSE client sees the first token after the model's time-to-first-token
+rather than after the whole reply has been generated.
+"""
+import asyncio
+import logging
+import time
+from contextlib import aclosing
+from typing import AsyncIterator, Dict, Optional
+
+from metrics import LLM_SECONDS, LLM_TTFT_SECONDS, current_turn, record_cancelled, upstream_error
+from models import registry as model_registry
+
+logger = logging.getLogger(__name__)
+
+
+class StreamTimer:
+    """Tracks time-to-first-token and total duration for one streamed reply"""
+
+    def __init__(self, label: str = ""):
+        self.label = label
+        self.started_at = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.tokens = 0
+        self.error: Optional[str] = None
+        self.model: Optional[str] = None
+        self.turn_id = current_turn()
+
+    def mark_token(self):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        self.tokens += 1
+
+    def finish(self):
+        if self.finished_at is None:
+            self.finished_at = time.perf_counter()
+
+    @property
+    def ttft_ms(self) -> Optional[float]:
+        if self.first_token_at is None:
+            return None
+        return round((self.first_token_at - self.started_at) * 1000, 1)
+
+    @property
+    def total_ms(self) -> float:
+        end = self.finished_at if self.finished_at is not None else time.perf_counter()
+        return round((end - self.started_at) * 1000, 1)
+
+    def as_dict(self) -> Dict[str, object]:
+        return {
+            "label": self.label,
+            "turn_id": self.turn_id,
+            "model": self.model,
+            "ttft_ms": self.ttft_ms,
+            "total_ms": self.total_ms,
+            "chunks": self.tokens,
+        }
+
+
+def _chunk_text(chunk) -> str:
+    # chunk.text raises ValueError when a chunk carries no text parts (e.g. safety blocks)
+    try:
+        return chunk.text or ""
+    except ValueError:
+        return ""
+
+
+async def model_chunks(model_name: str, prompt: str) -> AsyncIterator[str]:
+    """Raw text chunks from a Gemini model; errors propagate to the caller"""
+    model = model_registry.get(model_name)
+    response = await model.generate_content_async(prompt, stream=True)
+    async for chunk in response:
+        text = _chunk_text(chunk)
+        if text:
+            yield text
+
+
+async def stream_model(
+    model_name: str,
+    prompt: str,
+    fallback: str,
+    empty: Optional[str] = None,
+    timer: Optional[StreamTimer] = None,
+) -> AsyncIterator[str]:
+    """Stream text chunks from a Gemini model as they arrive
+
+    Args:
+        model_name: Gemini model to query
+        prompt: Full prompt sent to the model
+        fallback: Text yielded if the request fails before any output was produced
+        empty: Text yielded if the model finishes without producing output
+        timer: Optional timer updated on every forwarded chunk
+
+    Yields:
+        Text chunks in generation order
+    """
+    produced = False
+    started = time.perf_counter()
+    if timer:
+        timer.model = model_name
+    try:
+        async with aclosing(model_chunks(model_name, prompt)) as chunks:
+            async for text in chunks:
+                if not produced:
+                    LLM_TTFT_SECONDS.labels(model_name).observe(time.perf_counter() - started)
+                if timer:
+                    timer.mark_token()
+                    if not produced:
+                        model_registry.record_first_token(timer.ttft_ms)
+                produced = True
+                yield text
+    except (asyncio.CancelledError, GeneratorExit):
+        record_cancelled("llm", started)
+        raise
+    except Exception as e:
+        logger.warning(f"Error streaming from {model_name} (turn {current_turn()}): {e}")
+        upstream_error("gemini", "error")
+        if timer:
+            timer.error = str(e)
+        if produced:
+            return
+        if timer:
+            timer.mark_token()
+        yield fallback
+        return
+    finally:
+        LLM_SECONDS.labels(model_name).observe(time.perf_counter() - started)
+
+    if not produced and empty:
+        upstream_error("gemini", "empty")
+        if timer:
+            timer.error = "empty response"
+            timer.mark_token()
+        yield empty
+
+
+def sse_event(data: str, event: Optional[str] = None, event_id: Optional[int] = None) -> str:
+    """Frame one Server-Sent Event, splitting multi-line data per the SSE spec"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event:
+        lines.append(f"event: {event}")
+    for line in data.split("\n"):
+        lines.append(f"data: {line}")
+    return "\n".join(lines) + "\n\n"
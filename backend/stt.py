@@ -0,0 +1,173 @@
+"""Speech-to-text with Deepgram: live streaming relay and whole-recording transcription
+
+Audio frames are forwarded to the upstream WebSocket while the user is still
+speaking; interim and final results come back on the same connection.
+Deepgram's endpointing marks the end of an utterance (`speech_final` or an
+`UtteranceEnd` message), at which point the accumulated final transcript is
+emitted as one `utterance` event that can start the LLM stage directly.
+
+`transcribe_prerecorded` sends one finished recording over the pooled HTTP
+client; /deepgram-proxy and offline batch runs (batch.py) use it.
+"""
+import json
+import logging
+import os
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+from urllib.parse import urlencode
+
+from websockets.asyncio.client import ClientConnection, connect
+
+from http_clients import pool as http_pool
+from metrics import observe_stage
+
+logger = logging.getLogger(__name__)
+
+DEEPGRAM_WS_URL = os.getenv("DEEPGRAM_WS_URL", "wss://api.deepgram.com/v1/listen")
+
+# Live transcription settings; endpointing is the silence (ms) that ends speech
+STT_PARAMS = {
+    "model": "nova-2",
+    "smart_format": "true",
+    "punctuate": "true",
+    "interim_results": "true",
+    "endpointing": os.getenv("STT_ENDPOINTING_MS", "300"),
+    "utterance_end_ms": "1000",
+}
+
+# Deepgram closes a stream that gets no data for ~10s; while silence is gated out it is pinged instead
+KEEPALIVE_SECONDS = 5.0
+
+# Whole-recording transcription settings
+PRERECORDED_PARAMS = {
+    "model": "nova-2",  # Use their latest model
+    "smart_format": "true",
+    "diarize": "false",
+    "punctuate": "true",
+}
+
+
+class STTUpstreamError(Exception):
+    """Deepgram answered with a non-200 status"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+async def transcribe_prerecorded(
+    audio: bytes, content_type: str, api_key: str, params: Optional[Dict[str, str]] = None,
+) -> Dict[str, Any]:
+    """Deepgram's result for one whole recording
+
+    Raises:
+        STTUpstreamError: Deepgram returned a non-200 status
+        httpx.HTTPError: The upstream could not be reached
+    """
+    headers = {
+        "Authorization": f"Token {api_key}",
+        "Content-Type": content_type
+    }
+    started = time.perf_counter()
+    response = await http_pool.get("deepgram").request(
+        "POST",
+        "/v1/listen",
+        headers=headers,
+        params={**PRERECORDED_PARAMS, **(params or {})},
+        content=audio
+    )
+    observe_stage("stt", started)
+    if response.status_code != 200:
+        raise STTUpstreamError(response.status_code, response.text)
+    return response.json()
+
+
+def transcript_text(result: Dict[str, Any]) -> str:
+    """Best transcript of the first channel of a prerecorded result"""
+    channels = result.get("results", {}).get("channels") or [{}]
+    alternatives = channels[0].get("alternatives") or [{}]
+    return alternatives[0].get("transcript", "")
+
+
+class STTStream:
+    """One live transcription session with the upstream STT service"""
+
+    def __init__(self, api_key: str, params: Optional[Dict[str, str]] = None):
+        self.api_key = api_key
+        self.params = {**STT_PARAMS, **(params or {})}
+        self.connection: Optional[ClientConnection] = None
+        self._finals: List[str] = []
+        self._last_sent = time.monotonic()
+
+    async def connect(self):
+        url = f"{DEEPGRAM_WS_URL}?{urlencode(self.params)}"
+        self.connection = await connect(url, additional_headers={"Authorization": f"Token {self.api_key}"})
+
+    async def send_audio(self, frame: bytes):
+        await self.connection.send(frame)
+        self._last_sent = time.monotonic()
+
+    async def send_gated(self, speech: bytes):
+        """Send what a silence gate (audio.StreamingPreprocessor) let through, keeping the upstream open meanwhile"""
+        if speech:
+            await self.send_audio(speech)
+        elif time.monotonic() - self._last_sent > KEEPALIVE_SECONDS:
+            await self.keep_alive()
+
+    async def keep_alive(self):
+        """Keep the upstream open while no audio is being sent"""
+        await self.connection.send(json.dumps({"type": "KeepAlive"}))
+        self._last_sent = time.monotonic()
+
+    async def finish(self):
+        """Ask the upstream to flush remaining results and close"""
+        await self.connection.send(json.dumps({"type": "CloseStream"}))
+
+    async def close(self):
+        if self.connection is not None:
+            await self.connection.close()
+
+    async def events(self) -> AsyncIterator[Dict[str, object]]:
+        """Yield normalized transcript events
+
+        Events:
+            {"type": "interim", "transcript"}: partial hypothesis, may change
+            {"type": "final", "transcript"}: stable text for a span of audio
+            {"type": "utterance", "transcript"}: endpoint reached; all finals joined
+        """
+        async for raw in self.connection:
+            if isinstance(raw, bytes):
+                continue
+            message = json.loads(raw)
+            kind = message.get("type")
+
+            if kind == "Results":
+                alternatives = message.get("channel", {}).get("alternatives") or [{}]
+                transcript = alternatives[0].get("transcript", "")
+                if message.get("is_final"):
+                    if transcript:
+                        self._finals.append(transcript)
+                        yield {"type": "final", "transcript": transcript}
+                    if message.get("speech_final"):
+                        utterance = self._take_utterance()
+                        if utterance:
+                            yield utterance
+                elif transcript:
+                    yield {"type": "interim", "transcript": transcript}
+
+            elif kind == "UtteranceEnd":
+                utterance = self._take_utterance()
+                if utterance:
+                    yield utterance
+
+        # Upstream closed: whatever is left is the last utterance
+        utterance = self._take_utterance()
+        if utterance:
+            yield utterance
+
+    def _take_utterance(self) -> Optional[Dict[str, object]]:
+        if not self._finals:
+            return None
+        transcript, self._finals = " ".join(self._finals), []
+        return {"type": "utterance", "transcript": transcript}
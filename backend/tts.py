@@ -0,0 +1,143 @@
+"""ElevenLabs TTS streaming and zero-buffer audio relay
+
+Audio chunks are forwarded to the client as they arrive from ElevenLabs; no
+response body is ever held in memory. The relay only pulls the next upstream
+chunk after the previous one has been handed to the ASGI server, so a slow
+client applies backpressure all the way to the upstream socket, and a client
+disconnect closes the upstream request.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import AsyncIterator, Dict, Optional
+
+from http_clients import UpstreamStream, pool as http_pool
+from metrics import STAGE_SECONDS, current_turn, record_cancelled
+
+logger = logging.getLogger(__name__)
+
+# Maximum bytes per write to the client; smaller upstream chunks are forwarded as-is
+TTS_CHUNK_SIZE = int(os.getenv("TTS_CHUNK_SIZE", "4096"))
+# ElevenLabs model; unset uses the account default
+ELEVENLABS_MODEL_ID = os.getenv("ELEVENLABS_MODEL_ID")
+
+
+class TTSUpstreamError(Exception):
+    """ElevenLabs answered with a non-200 status"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class RelayStats:
+    """Per-request timing for one relayed audio stream"""
+
+    def __init__(self, label: str = "tts"):
+        self.label = label
+        self.turn_id = current_turn()
+        self.started_at = time.perf_counter()
+        self.headers_at: Optional[float] = None
+        self.first_byte_at: Optional[float] = None
+        self.bytes = 0
+        self.chunks = 0
+        self.cancelled = False
+
+    def _ms(self, at: Optional[float]) -> Optional[float]:
+        return None if at is None else round((at - self.started_at) * 1000, 1)
+
+    @property
+    def upstream_ms(self) -> Optional[float]:
+        return self._ms(self.headers_at)
+
+    @property
+    def ttfab_ms(self) -> Optional[float]:
+        return self._ms(self.first_byte_at)
+
+    def as_dict(self) -> Dict[str, object]:
+        return {
+            "label": self.label,
+            "turn_id": self.turn_id,
+            "upstream_headers_ms": self.upstream_ms,
+            "ttfab_ms": self.ttfab_ms,
+            "total_ms": self._ms(time.perf_counter()),
+            "bytes": self.bytes,
+            "chunks": self.chunks,
+            "cancelled": self.cancelled,
+        }
+
+
+async def open_tts_stream(
+    text: str,
+    voice_id: str,
+    api_key: str,
+    voice_settings: Dict[str, float],
+    stats: Optional[RelayStats] = None,
+    model_id: Optional[str] = ELEVENLABS_MODEL_ID,
+    output_format: Optional[str] = None,
+) -> UpstreamStream:
+    """Start an ElevenLabs streaming request and return once response headers arrive
+
+    `output_format` (e.g. "pcm_24000" for raw 16-bit mono PCM) overrides the
+    default MP3 encoding.
+
+    Raises:
+        TTSUpstreamError: ElevenLabs returned a non-200 status
+        httpx.HTTPError: The upstream could not be reached
+    """
+    headers = {
+        "xi-api-key": api_key,
+        "Content-Type": "application/json"
+    }
+    payload = {
+        "text": text,
+        "voice_settings": voice_settings
+    }
+    if model_id:
+        payload["model_id"] = model_id
+    params = {"output_format": output_format} if output_format else None
+    upstream = await http_pool.get("elevenlabs").stream(
+        "POST", f"/v1/text-to-speech/{voice_id}/stream", json=payload, headers=headers, params=params
+    )
+    if stats:
+        stats.headers_at = time.perf_counter()
+
+    if upstream.status_code != 200:
+        detail = (await upstream.aread()).decode(errors="replace")
+        await upstream.aclose()
+        raise TTSUpstreamError(upstream.status_code, detail)
+    return upstream
+
+
+async def relay_audio(
+    upstream: UpstreamStream,
+    chunk_size: int = TTS_CHUNK_SIZE,
+    stats: Optional[RelayStats] = None,
+) -> AsyncIterator[bytes]:
+    """Forward upstream audio chunk by chunk, closing the upstream on exit or disconnect
+
+    Time to first byte is recorded only when the caller's `stats` started
+    before the upstream request was opened.
+    """
+    record_ttfb = stats is not None
+    stats = stats or RelayStats()
+    try:
+        async for chunk in upstream.aiter_bytes():
+            for start in range(0, len(chunk), chunk_size):
+                piece = chunk[start:start + chunk_size]
+                if stats.first_byte_at is None:
+                    stats.first_byte_at = time.perf_counter()
+                    if record_ttfb:
+                        STAGE_SECONDS.labels("tts_first_byte").observe(stats.first_byte_at - stats.started_at)
+                stats.bytes += len(piece)
+                stats.chunks += 1
+                yield piece
+    except (asyncio.CancelledError, GeneratorExit):
+        stats.cancelled = True
+        record_cancelled("tts", stats.started_at)
+        raise
+    finally:
+        await upstream.aclose()
+        logger.info(f"audio relay finished: {stats.as_dict()}")
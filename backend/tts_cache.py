@@ -0,0 +1,243 @@
+"""Content-addressed cache for synthesized TTS audio
+
+Entries are keyed on a hash of (text, voice id, voice settings, model) and
+hold the MP3 bytes ElevenLabs returned. Recently used audio lives in an
+in-memory LRU; entries evicted from memory spill to a size-capped directory
+and are served from there through memory-mapped reads, so a hit never calls
+the upstream.
+
+The directory may be shared by several workers (and pre-filled by
+warm_tts.py), so it is the only index of the disk tier: a lookup simply
+tries to open the file, a hit refreshes its mtime, and every write rescans
+the directory and removes the least recently used files until the total is
+back under `disk_bytes`, whichever worker wrote them.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import mmap
+import os
+import tempfile
+from collections import OrderedDict
+from contextlib import aclosing
+from pathlib import Path
+from typing import AsyncIterator, Awaitable, BinaryIO, Callable, Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def tts_cache_key(text: str, voice_id: str, voice_settings: Dict[str, float], model_id: Optional[str]) -> str:
+    identity = json.dumps(
+        {"text": text, "voice": voice_id, "settings": voice_settings, "model": model_id or "default"},
+        sort_keys=True,
+    )
+    return hashlib.sha256(identity.encode()).hexdigest()
+
+
+class TTSCache:
+    """Two-tier (memory, then disk) store of rendered audio"""
+
+    def __init__(
+        self,
+        directory: str,
+        memory_bytes: int = 16 * 1024 * 1024,
+        disk_bytes: int = 256 * 1024 * 1024,
+        max_entry_bytes: int = 2 * 1024 * 1024,
+    ):
+        self.directory = Path(directory)
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_used = 0
+        # As of the last directory scan; other workers may have changed it since
+        self._disk_entries = 0
+        self._disk_used = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.spills = 0
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._disk_entries, self._disk_used = _trim_directory(self.directory, self.disk_bytes)
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.mp3"
+
+    def contains(self, key: str) -> bool:
+        return key in self._memory or self._path(key).exists()
+
+    def lookup(self, key: str) -> Optional[AsyncIterator[bytes]]:
+        """Return a chunk iterator for a cached entry, or None on a miss"""
+        data = self._memory.get(key)
+        if data is not None:
+            self._memory.move_to_end(key)
+            self.memory_hits += 1
+            return _iter_bytes(data)
+
+        try:
+            # Opened here, not when iterated: a file another worker evicts later stays readable
+            f = open(self._path(key), "rb")
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        try:
+            os.utime(f.fileno())  # Recently used, for every worker's trim
+        except OSError:
+            pass
+        self.disk_hits += 1
+        return _iter_mapped(f)
+
+    async def put(self, key: str, data: bytes):
+        if not data or len(data) > self.max_entry_bytes:
+            return
+        if key in self._memory:
+            self._memory_used -= len(self._memory.pop(key))
+        self._memory[key] = data
+        self._memory_used += len(data)
+
+        spilled = []
+        while self._memory_used > self.memory_bytes:
+            old_key, old_data = self._memory.popitem(last=False)
+            self._memory_used -= len(old_data)
+            spilled.append((old_key, old_data))
+        for old_key, old_data in spilled:
+            await self._write_disk(old_key, old_data)
+
+    async def persist(self, key: str, data: bytes):
+        """Write an entry straight to the disk tier (used by warm-up)"""
+        if data and len(data) <= self.max_entry_bytes:
+            await self._write_disk(key, data)
+
+    async def _write_disk(self, key: str, data: bytes):
+        # File I/O and the directory scan run off the event loop
+        written, (self._disk_entries, self._disk_used) = await asyncio.to_thread(
+            _write_and_trim, self._path(key), data, self.disk_bytes)
+        if written:
+            self.spills += 1
+
+    async def record(self, key: str, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        """Pass audio through unchanged and cache it once the stream completes"""
+        collected = bytearray()
+        async with aclosing(chunks) as stream:
+            async for chunk in stream:
+                if len(collected) <= self.max_entry_bytes:
+                    collected.extend(chunk)
+                yield chunk
+        await self.put(key, bytes(collected))
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "spills": self.spills,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_used,
+            "disk_entries": self._disk_entries,
+            "disk_bytes": self._disk_used,
+        }
+
+
+def _write_atomic(path: Path, data: bytes):
+    # A unique temporary name: workers sharing the directory may write the same key at once
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=path.stem, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _trim_directory(directory: Path, max_bytes: int) -> Tuple[int, int]:
+    """Delete the least recently used *.mp3 files until the directory fits; returns (entries, bytes) left"""
+    files = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith(".mp3"):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue  # Removed by another worker mid-scan
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+    used = sum(size for _, size, _ in files)
+    files.sort()
+    removed = 0
+    while used > max_bytes and removed < len(files):
+        _, size, path = files[removed]
+        removed += 1
+        used -= size
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+    return len(files) - removed, used
+
+
+def _write_and_trim(path: Path, data: bytes, max_bytes: int) -> Tuple[bool, Tuple[int, int]]:
+    """Write `path` unless another worker already has; then enforce the directory cap"""
+    written = False
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        _write_atomic(path, data)
+        written = True
+    return written, _trim_directory(path.parent, max_bytes)
+
+
+async def _iter_bytes(data: bytes, chunk_size: int = 16384) -> AsyncIterator[bytes]:
+    for start in range(0, len(data), chunk_size):
+        yield data[start:start + chunk_size]
+
+
+async def _iter_mapped(f: BinaryIO, chunk_size: int = 65536) -> AsyncIterator[bytes]:
+    # The mapping stays valid even if the file is evicted (unlinked) mid-read
+    with f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        for start in range(0, len(mapped), chunk_size):
+            yield mapped[start:start + chunk_size]
+
+
+async def warm_up(
+    cache: TTSCache,
+    phrases: Iterable[str],
+    key_for: Callable[[str], str],
+    render: Callable[[str], Awaitable[AsyncIterator[bytes]]],
+    to_disk: bool = False,
+) -> int:
+    """Pre-render phrases that are not cached yet; returns how many were rendered"""
+    rendered = 0
+    for phrase in phrases:
+        key = key_for(phrase)
+        if cache.contains(key):
+            continue
+        try:
+            audio = b"".join([chunk async for chunk in await render(phrase)])
+        except Exception as e:
+            logger.warning(f"TTS warm-up failed for {phrase!r}: {e}")
+            continue
+        if to_disk:
+            await cache.persist(key, audio)
+        else:
+            await cache.put(key, audio)
+        rendered += 1
+    logger.info(f"TTS warm-up rendered {rendered} phrase(s)")
+    return rendered
+
+
+def load_phrases(path: Optional[str]) -> list:
+    """One phrase per line; blank lines and #-comments are ignored"""
+    if not path:
+        return []
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+
+
+def create_tts_cache() -> TTSCache:
+    """Build the cache from TTS_CACHE_* environment settings"""
+    return TTSCache(
+        os.getenv("TTS_CACHE_DIR", "/tmp/med-convo-tts"),
+        memory_bytes=int(os.getenv("TTS_CACHE_MEMORY_BYTES", str(16 * 1024 * 1024))),
+        disk_bytes=int(os.getenv("TTS_CACHE_DISK_BYTES", str(256 * 1024 * 1024))),
+        max_entry_bytes=int(os.getenv("TTS_CACHE_MAX_ENTRY_BYTES", str(2 * 1024 * 1024))),
+    )
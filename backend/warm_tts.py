@@ -0,0 +1,29 @@
+"""Pre-render TTS phrases into the on-disk audio cache
+
+    python warm_tts.py [phrases.txt]
+
+Renders the backend's fixed fallback replies plus one phrase per line of the
+optional file, writing them to TTS_CACHE_DIR so every worker that shares the
+directory serves them without calling ElevenLabs.
+"""
+import asyncio
+import sys
+
+import main
+from http_clients import pool as http_pool
+from tts_cache import warm_up
+
+
+async def run(path=None):
+    if not main.ELEVENLABS_API_KEY:
+        sys.exit("ELEVENLABS_API_KEY is not configured")
+    await http_pool.start()
+    try:
+        rendered = await warm_up(main.tts_cache, main.warm_phrases(path), main.tts_key, main.render_tts, to_disk=True)
+    finally:
+        await http_pool.close()
+    print(f"Rendered {rendered} phrase(s) into {main.tts_cache.directory}")
+
+
+if __name__ == "__main__":
+    asyncio.run(run(sys.argv[1] if len(sys.argv) > 1 else None))
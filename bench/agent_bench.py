@@ -0,0 +1,155 @@
+"""Agent worker benchmark: server-side room agent vs the browser's HTTP turn
+
+Both paths answer the same spoken question against stub upstreams. The
+browser path is the old client flow: after the user stops talking, POST
+/deepgram-proxy, read /stream to the end, then download the whole /tts MP3
+before playback can start. The agent path runs many rooms concurrently in
+one AgentWorker, each a stand-in room (bench/stubs.py StubRoom) whose
+participant speaks into live STT; it measures from the end of speech to the
+first audio frame published into the room.
+
+    python bench/agent_bench.py --rooms 50
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+sys.path.append(os.path.join(ROOT, "token_server"))  # After backend/: both have a main.py
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from serve import serve
+from stubs import StubConfig, StubRoom, create_stub_app, install_stub_gemini
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))], 1) if ordered else None
+
+
+def summarize(latencies_ms):
+    return {"p50_ms": percentile(latencies_ms, 50), "p95_ms": percentile(latencies_ms, 95), "samples": len(latencies_ms)}
+
+
+def load_token_app():
+    spec = importlib.util.spec_from_file_location("token_server_main", os.path.join(ROOT, "token_server", "main.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.app
+
+
+async def browser_turns(backend_url: str, turns: int, concurrency: int):
+    import httpx
+    from livekit_tokens import TokenIssuer
+
+    issuer = TokenIssuer("stub", "stub-secret")
+
+    limit = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(client, i):
+        async with limit:
+            started = time.perf_counter()
+            stt = await client.post("/deepgram-proxy", files={"audio": ("speech.wav", b"\x00" * 6400, "audio/wav")})
+            transcript = stt.json()["results"]["channels"][0]["alternatives"][0]["transcript"]
+            reply = ""
+            token, _ = issuer.issue(f"browser-{i}", "bench")
+            headers = {"Authorization": f"Bearer {token}"}
+            async with client.stream("POST", "/stream", json={"message": transcript}, headers=headers) as response:
+                event = None
+                async for line in response.aiter_lines():
+                    if line.startswith("event: "):
+                        event = line[7:]
+                    elif line.startswith("data: ") and event is None:
+                        reply += json.loads(line[6:])["token"]
+                    elif not line:
+                        event = None
+            audio = await client.post("/tts", json={"text": reply or transcript})
+            audio.raise_for_status()
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    async with httpx.AsyncClient(base_url=backend_url, timeout=60) as client:
+        await asyncio.gather(*(one(client, i) for i in range(turns)))
+    return summarize(latencies)
+
+
+async def agent_turns(token_url: str, rooms: int):
+    import agent
+    from http_clients import pool as http_pool
+
+    stand_ins = []
+
+    def transport():
+        room = StubRoom()
+        stand_ins.append(room)
+        return room
+
+    worker = agent.AgentWorker(livekit_url="ws://stub", token_url=token_url, transport_factory=transport, max_rooms=rooms)
+    await http_pool.start()
+    await worker.start()
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker.dispatch(f"room-{i}") for i in range(rooms)))
+        await asyncio.wait_for(asyncio.gather(*(room.reply_done.wait() for room in stand_ins)), timeout=120)
+        elapsed = time.perf_counter() - started
+        latencies = [
+            (room.published[0][0] - room.speech_ended_at) * 1000
+            for room in stand_ins if room.published and room.speech_ended_at
+        ]
+        frames = sum(len(room.published) for room in stand_ins)
+        for room in stand_ins:
+            room.leave()
+    finally:
+        await worker.close()
+        await http_pool.close()
+    return {
+        "first_audio_after_speech": summarize(latencies),
+        "rooms_served": len(latencies),
+        "published_audio_s": round(frames * agent.FRAME_MS / 1000, 1),
+        "wall_s": round(elapsed, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rooms", type=int, default=50, help="concurrent rooms in one agent worker")
+    parser.add_argument("--upstream-latency", type=float, default=0.15)
+    parser.add_argument("--llm-ttft", type=float, default=0.3)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    config = StubConfig(latency=args.upstream_latency, llm_ttft=args.llm_ttft)
+    with serve(create_stub_app(config)) as stub_url:
+        os.environ.update(
+            GEMINI_API_KEY="stub", ELEVENLABS_API_KEY="stub", DEEPGRAM_API_KEY="stub",
+            LIVEKIT_API_KEY="stub", LIVEKIT_SECRET="stub-secret",
+            ELEVENLABS_BASE_URL=stub_url, DEEPGRAM_BASE_URL=stub_url,
+            DEEPGRAM_WS_URL=stub_url.replace("http", "ws") + "/v1/listen",
+            RESPONSE_CACHE_TTL="0", TTS_WARM_UP="0", MODEL_WARM_UP="off",
+            # The stubs have no account concurrency limits; measure the worker, not admission control
+            ELEVENLABS_MAX_CONCURRENCY="64", ADMISSION_ELEVENLABS_CONCURRENCY="64", ADMISSION_GEMINI_CONCURRENCY="64",
+            TTS_CACHE_DIR=tempfile.mkdtemp(prefix="agent-bench-tts-"),
+        )
+        install_stub_gemini(config)
+        import main as backend
+
+        with serve(load_token_app()) as token_url:
+            # One at a time: both paths share the backend's connection pool and gates
+            with serve(backend.app) as backend_url:
+                browser = asyncio.run(browser_turns(backend_url, args.rooms, args.rooms))
+            results = {
+                "browser_http_turn": browser,
+                "agent_worker": asyncio.run(agent_turns(token_url, args.rooms)),
+                "config": vars(args),
+            }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
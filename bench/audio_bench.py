@@ -0,0 +1,214 @@
+"""Audio preprocessing benchmark: bytes saved and processing time per audio second
+
+Each clip in bench/fixtures/audio_corpus.jsonl describes a recording (rate,
+channels, sample width, leading/trailing silence, speech segments, speech and
+noise levels). Clips are synthesized deterministically from that description:
+harmonic voiced sound with a gliding pitch and syllable-rate envelope over
+background noise. Because the speech boundaries are known, the report also
+checks that trimming never cut into speech.
+
+Every clip is measured in two upload formats, reported separately:
+
+    wav         the synthesized WAV, re-encoded to 16 kHz WAV
+    webm_opus   the clip as a browser's MediaRecorder uploads it (Opus in
+                WebM at 48 kHz, `--webm-kbps`), through the default path
+                (decode and re-encode to Ogg Opus); needs the `av` package
+
+The WAV saving mostly comes from dropping raw PCM, so it overstates what
+browser uploads gain; webm_opus is the representative figure. For every
+clip it reports the bytes uploaded before and after preprocess_audio,
+processing time per second of audio for the whole-file and (WAV only)
+streamed 20 ms chunk paths, and the upload time saved at a given uplink.
+
+    python bench/audio_bench.py --uplink-kbps 1000 --repeat 5
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import sys
+import time
+import wave
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+import audio
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "audio_corpus.jsonl")
+
+
+def _db(level: float) -> float:
+    return 10 ** (level / 20)
+
+
+def synthesize(clip):
+    """(WAV bytes, [(start_s, end_s) of each speech segment]) for one corpus entry"""
+    rate = clip["rate"]
+    rng = np.random.default_rng(clip["seed"])
+    parts, segments, at = [np.zeros(int(clip["lead_s"] * rate))], [], clip["lead_s"]
+    for i, seconds in enumerate(clip["speech_s"]):
+        if i:
+            parts.append(np.zeros(int(clip["gap_s"] * rate)))
+            at += clip["gap_s"]
+        t = np.arange(int(seconds * rate)) / rate
+        f0 = 120 + 60 * np.sin(2 * np.pi * 0.7 * t + rng.uniform(0, np.pi))
+        phase = 2 * np.pi * np.cumsum(f0) / rate
+        voiced = sum(rng.uniform(0.2, 1.0) / k * np.sin(k * phase) for k in range(1, 12))
+        syllables = 0.55 + 0.45 * np.sin(2 * np.pi * 4.5 * t + rng.uniform(0, np.pi))
+        speech = voiced * syllables
+        speech *= _db(clip["speech_dbfs"]) / (np.sqrt(np.mean(speech ** 2)) + 1e-12)
+        parts.append(speech)
+        segments.append((at, at + seconds))
+        at += seconds
+    parts.append(np.zeros(int(clip["trail_s"] * rate)))
+    mono = np.concatenate(parts)
+    mono += rng.normal(0, _db(clip["noise_dbfs"]), len(mono))
+    samples = np.repeat(mono[:, None], clip["channels"], axis=1)
+    if clip["channels"] > 1:
+        samples[:, 1] *= 0.9  # Slight channel imbalance, as from a real mic pair
+
+    width = clip["width"]
+    clipped = np.clip(samples, -1.0, 1.0)
+    if width == 1:
+        raw = (clipped * 127 + 128).astype(np.uint8).tobytes()
+    elif width == 2:
+        raw = (clipped * 32767).astype("<i2").tobytes()
+    else:
+        ints = (clipped * (2 ** 23 - 1)).astype("<i4").reshape(-1)
+        raw = np.stack([ints & 0xFF, (ints >> 8) & 0xFF, (ints >> 16) & 0xFF], axis=1).astype(np.uint8).tobytes()
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(clip["channels"])
+        wav.setsampwidth(width)
+        wav.setframerate(rate)
+        wav.writeframes(raw)
+    return buffer.getvalue(), segments
+
+
+def speech_kept(data: bytes, segments, prepared) -> float:
+    """Fraction of the true speech that lies inside the trimmed audio's bounds"""
+    if not segments:
+        return 1.0
+    if not prepared.speech:
+        return 0.0
+    samples, rate = audio.decode_wav(data)
+    mono = audio.resample(audio.to_mono(samples), rate)
+    start, end = audio.speech_bounds(mono, audio.TARGET_RATE)
+    start_s, end_s = start / audio.TARGET_RATE, end / audio.TARGET_RATE
+    total = sum(b - a for a, b in segments)
+    kept = sum(max(0.0, min(b, end_s) - max(a, start_s)) for a, b in segments)
+    return kept / total
+
+
+def encode_webm(data: bytes, kbps: float) -> bytes:
+    """The WAV clip as MediaRecorder would record it: Opus in WebM at 48 kHz, same channel count"""
+    av = audio._av()
+    samples, rate = audio.decode_wav(data)
+    channels = min(samples.shape[1], 2)
+    resampled = np.stack([audio.resample(samples[:, c], rate, 48000) for c in range(channels)], axis=1)
+    layout = "mono" if channels == 1 else "stereo"
+    buffer = io.BytesIO()
+    with av.open(buffer, "w", format="webm") as container:
+        stream = container.add_stream("libopus", rate=48000)
+        stream.bit_rate = int(kbps * 1000)
+        stream.layout = layout
+        frame = av.AudioFrame.from_ndarray(audio.to_int16(resampled).reshape(1, -1), format="s16", layout=layout)
+        frame.sample_rate = 48000
+        for packet in stream.encode(frame):
+            container.mux(packet)
+        for packet in stream.encode(None):
+            container.mux(packet)
+    return buffer.getvalue()
+
+
+def stream_clip(data: bytes, repeat: int):
+    """Streamed path over 20 ms chunks of 16-bit PCM at the clip's rate; returns (bytes out, seconds)"""
+    samples, rate = audio.decode_wav(data)
+    channels = samples.shape[1]
+    pcm = audio.to_int16(samples).reshape(-1).tobytes()
+    chunk = rate * 20 // 1000 * channels * 2
+    best, out = float("inf"), 0
+    for _ in range(repeat):
+        gate = audio.StreamingPreprocessor(rate, channels)
+        started = time.perf_counter()
+        out = sum(len(gate.feed(pcm[i:i + chunk])) for i in range(0, len(pcm), chunk))
+        best = min(best, time.perf_counter() - started)
+    return out, best
+
+
+def measure(clips, fmt: str, args):
+    """(summary, per-clip rows) for one upload format"""
+    rows, totals = [], {"audio_s": 0.0, "bytes_in": 0, "bytes_out": 0, "stream_bytes_out": 0, "file_s": 0.0, "stream_s": 0.0}
+    for clip in clips:
+        wav, segments = synthesize(clip)
+        samples, rate = audio.decode_wav(wav)
+        duration = len(samples) / rate
+        data = wav if fmt == "wav" else encode_webm(wav, args.webm_kbps)
+        best = float("inf")
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            prepared = audio.preprocess_audio(data, encoding="wav" if fmt == "wav" else "auto")
+            best = min(best, time.perf_counter() - started)
+        stream_out, stream_s = stream_clip(wav, args.repeat) if fmt == "wav" else (None, None)
+        rows.append({
+            "clip": clip["name"],
+            "audio_s": round(duration, 2),
+            "bytes_in": len(data),
+            "bytes_out": len(prepared.audio),
+            "saved_pct": round(100 * (1 - len(prepared.audio) / len(data)), 1),
+            "speech_kept_pct": round(100 * speech_kept(wav, segments, prepared), 1),
+            "file_ms_per_audio_s": round(1000 * best / duration, 2),
+            "stream_ms_per_audio_s": None if stream_s is None else round(1000 * stream_s / duration, 2),
+            "upload_ms_saved": round((len(data) - len(prepared.audio)) * 8 / args.uplink_kbps, 1),
+            "passthrough": prepared.stats.get("passthrough"),
+        })
+        totals["audio_s"] += duration
+        totals["bytes_in"] += len(data)
+        totals["bytes_out"] += len(prepared.audio)
+        totals["file_s"] += best
+        if stream_s is not None:
+            totals["stream_bytes_out"] += stream_out
+            totals["stream_s"] += stream_s
+
+    summary = {
+        "clips": len(rows),
+        "audio_s": round(totals["audio_s"], 1),
+        "bytes_in": totals["bytes_in"],
+        "bytes_out": totals["bytes_out"],
+        "saved_pct": round(100 * (1 - totals["bytes_out"] / totals["bytes_in"]), 1),
+        "file_ms_per_audio_s": round(1000 * totals["file_s"] / totals["audio_s"], 2),
+        "min_speech_kept_pct": min(row["speech_kept_pct"] for row in rows),
+        "passthrough": sum(1 for row in rows if row["passthrough"]),
+    }
+    if fmt == "wav":
+        summary["stream_saved_pct"] = round(100 * (1 - totals["stream_bytes_out"] / totals["bytes_in"]), 1)
+        summary["stream_ms_per_audio_s"] = round(1000 * totals["stream_s"] / totals["audio_s"], 2)
+    return summary, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", default=CORPUS)
+    parser.add_argument("--repeat", type=int, default=5, help="timing runs per clip (best is reported)")
+    parser.add_argument("--uplink-kbps", type=float, default=1000, help="client uplink used to estimate upload time")
+    parser.add_argument("--webm-kbps", type=float, default=32, help="Opus bitrate of the browser-style uploads")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    with open(args.corpus) as f:
+        clips = [json.loads(line) for line in f if line.strip()]
+
+    summary, clip_rows = {"uplink_kbps": args.uplink_kbps}, {}
+    for fmt in ("wav", "webm_opus"):
+        if fmt != "wav" and not audio.decoder_available():
+            summary[fmt] = {"skipped": "needs the av package"}
+            continue
+        summary[fmt], clip_rows[fmt] = measure(clips, fmt, args)
+    print(json.dumps({"summary": summary, "clips": clip_rows}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Offline batch throughput: files per minute through decode → STT → LLM against stub upstreams
+
+Writes `--files` WAV recordings synthesized from bench/fixtures/audio_corpus.jsonl
+into a temporary directory and runs backend/batch.py over them twice: one
+file at a time per stage, then with the given process pool and per-stage
+concurrency. The pipelined run is interrupted halfway (`--limit`) and resumed
+from its output, so the report also shows that the checkpoint skips finished
+files and that every file ends up written exactly once.
+
+    python bench/batch_bench.py --files 200 --decode-workers 4 --stt-concurrency 16 --llm-concurrency 32
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from audio_bench import CORPUS, synthesize
+from serve import serve
+from stubs import StubConfig, create_stub_app, install_stub_gemini
+
+
+def write_recordings(directory: str, count: int):
+    with open(CORPUS) as f:
+        clips = [json.loads(line) for line in f if line.strip()]
+    recordings = [synthesize(clip)[0] for clip in clips]
+    for i in range(count):
+        with open(os.path.join(directory, f"consultation-{i:05d}.wav"), "wb") as out:
+            out.write(recordings[i % len(recordings)])
+
+
+def run(batch, source: str, output: str, workers, limit=None):
+    runner = batch.BatchRunner(output, decode_workers=workers[0], stt_concurrency=workers[1], llm_concurrency=workers[2])
+    return asyncio.run(runner.run(batch.load_jobs(source), limit))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--decode-workers", type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    parser.add_argument("--stt-concurrency", type=int, default=16)
+    parser.add_argument("--llm-concurrency", type=int, default=32)
+    parser.add_argument("--upstream-latency", type=float, default=0.15, help="stub STT response time")
+    parser.add_argument("--llm-ttft", type=float, default=0.3)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    workdir = tempfile.mkdtemp(prefix="batch-bench-")
+    source = os.path.join(workdir, "recordings")
+    os.makedirs(source)
+    write_recordings(source, args.files)
+
+    config = StubConfig(latency=args.upstream_latency, llm_ttft=args.llm_ttft)
+    with serve(create_stub_app(config)) as stub_url:
+        os.environ.update(
+            GEMINI_API_KEY="stub", DEEPGRAM_API_KEY="stub", DEEPGRAM_BASE_URL=stub_url,
+            MODEL_WARM_UP="off", TTS_WARM_UP="0",
+            # Leave the stage concurrency to the batch runner
+            ADMISSION_DEEPGRAM_CONCURRENCY=str(max(args.stt_concurrency, 1)),
+            ADMISSION_GEMINI_CONCURRENCY=str(max(args.llm_concurrency, 1)),
+        )
+        install_stub_gemini(config)
+        import batch
+
+        pipelined = (args.decode_workers, args.stt_concurrency, args.llm_concurrency)
+        report = {"sequential": run(batch, source, os.path.join(workdir, "sequential.jsonl"), (1, 1, 1))}
+        output = os.path.join(workdir, "pipelined.jsonl")
+        interrupted = run(batch, source, output, pipelined, limit=args.files // 2)
+        resumed = run(batch, source, output, pipelined)
+        with open(output) as f:
+            ids = [json.loads(line)["id"] for line in f]
+        seconds = interrupted["seconds"] + resumed["seconds"]
+        report["pipelined"] = {
+            "first_half": interrupted,
+            "resumed": resumed,
+            "files_per_minute": round(len(ids) / seconds * 60, 1) if seconds else None,
+            "written_once": len(ids) == len(set(ids)) == args.files,
+        }
+        report["speedup"] = round(report["pipelined"]["files_per_minute"] / report["sequential"]["files_per_minute"], 1)
+        report["stub_calls"] = dict(config.calls)
+    report["config"] = vars(args)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
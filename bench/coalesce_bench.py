@@ -0,0 +1,131 @@
+"""Request coalescing benchmark: broadcast rooms where everyone asks the same thing
+
+Each round, `--listeners` participants of one room send the same question to
+/stream and request the same text from /tts, all within `--window-ms` of
+each other, against stub upstreams. Rounds run once with single-flight
+coalescing off and once on. The report gives upstream calls made (counted at
+the stubs), requests coalesced, rejected requests, and p50/p95 time to first
+token and first audio byte as the participants see them.
+
+    python bench/coalesce_bench.py --listeners 32 --rounds 3 --window-ms 300
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+sys.path.append(os.path.join(ROOT, "token_server"))  # After backend/: both have a main.py
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from serve import serve
+from stubs import StubConfig, create_stub_app, install_stub_gemini
+from livekit_tokens import TokenIssuer
+
+issuer = TokenIssuer("stub", "stub-secret")
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))], 1) if ordered else None
+
+
+async def listener(client, i: int, question: str, tts_text: str, window: float, results):
+    await asyncio.sleep(random.uniform(0, window))
+    started = time.perf_counter()
+    token, _ = issuer.issue(f"listener-{i}-{question}", "broadcast")
+    headers = {"Authorization": f"Bearer {token}"}
+    async with client.stream("POST", "/stream", json={"message": question}, headers=headers) as response:
+        if response.status_code != 200:
+            results["rejected"] += 1
+            return
+        first = True
+        async for line in response.aiter_lines():
+            # The first event is the first token; metrics come last
+            if first and line.startswith("data: "):
+                results["ttft"].append((time.perf_counter() - started) * 1000)
+                first = False
+
+    started = time.perf_counter()
+    async with client.stream("POST", "/tts", json={"text": tts_text}) as response:
+        if response.status_code != 200:
+            results["rejected"] += 1
+            return
+        first = True
+        async for _ in response.aiter_bytes():
+            if first:
+                results["tts_first_byte"].append((time.perf_counter() - started) * 1000)
+                first = False
+
+
+async def run_mode(backend_url: str, mode: str, args):
+    import httpx
+
+    results = {"ttft": [], "tts_first_byte": [], "rejected": 0}
+    limits = httpx.Limits(max_connections=args.listeners * 2)
+    async with httpx.AsyncClient(base_url=backend_url, timeout=60, limits=limits) as client:
+        for round_no in range(args.rounds):
+            question = f"What are the symptoms of diabetes, question {mode} {round_no}?"
+            tts_text = f"Welcome to round {round_no} of the {mode} session."
+            await asyncio.gather(*(
+                listener(client, i, question, tts_text, args.window_ms / 1000, results)
+                for i in range(args.listeners)
+            ))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--listeners", type=int, default=32, help="participants asking the same thing per round")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--window-ms", type=float, default=300, help="spread of the identical requests")
+    parser.add_argument("--llm-ttft", type=float, default=0.3)
+    parser.add_argument("--upstream-latency", type=float, default=0.15)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    random.seed(7)
+    config = StubConfig(latency=args.upstream_latency, llm_ttft=args.llm_ttft)
+    with serve(create_stub_app(config)) as stub_url:
+        os.environ.update(
+            GEMINI_API_KEY="stub", ELEVENLABS_API_KEY="stub", DEEPGRAM_API_KEY="stub",
+            LIVEKIT_API_KEY="stub", LIVEKIT_SECRET="stub-secret",
+            ELEVENLABS_BASE_URL=stub_url, DEEPGRAM_BASE_URL=stub_url,
+            # Measure coalescing, not the response and TTS caches
+            RESPONSE_CACHE_TTL="0", TTS_CACHE_MAX_ENTRY_BYTES="0", TTS_WARM_UP="0", MODEL_WARM_UP="off",
+            TTS_CACHE_DIR=tempfile.mkdtemp(prefix="coalesce-bench-tts-"),
+        )
+        install_stub_gemini(config)
+        import main as backend
+
+        report = {}
+        with serve(backend.app) as backend_url:
+            for mode in ("off", "on"):
+                backend.llm_flights.enabled = backend.tts_flights.enabled = mode == "on"
+                before = dict(config.calls)
+                coalesced_before = backend.llm_flights.coalesced + backend.tts_flights.coalesced
+                results = asyncio.run(run_mode(backend_url, mode, args))
+                requests = args.listeners * args.rounds
+                report[f"coalescing_{mode}"] = {
+                    "requests_per_endpoint": requests,
+                    "llm_upstream_calls": config.calls.get("llm", 0) - before.get("llm", 0),
+                    "tts_upstream_calls": config.calls.get("tts", 0) - before.get("tts", 0),
+                    "coalesced": backend.llm_flights.coalesced + backend.tts_flights.coalesced - coalesced_before,
+                    "rejected": results["rejected"],
+                    "ttft_ms": {"p50": percentile(results["ttft"], 50), "p95": percentile(results["ttft"], 95)},
+                    "tts_first_byte_ms": {
+                        "p50": percentile(results["tts_first_byte"], 50),
+                        "p95": percentile(results["tts_first_byte"], 95),
+                    },
+                }
+        report["config"] = vars(args)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
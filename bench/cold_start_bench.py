@@ -0,0 +1,169 @@
+"""Cold-start benchmark for the serverless entry points
+
+Every run starts a fresh interpreter, as a new Vercel or Cloud Run instance
+does, imports one entry point, runs its ASGI startup and serves the route a
+cold instance typically gets first:
+
+- api/health.py:  GET /api/health
+- api/token.py:   GET /api/get-token
+- api/backend.py: GET /api/metrics
+- backend/main.py (Cloud Run): GET /health
+
+The report gives p50 and worst of the whole cold start (process spawn to
+response), and of its import, startup and first-request parts. `sdk_load_ms`
+is what loading the Gemini SDK adds to the first model call of an instance,
+for entry points that load it lazily (it is 0 when it was loaded at import).
+With `--importtime` each entry point also gets its heaviest direct imports
+from `python -X importtime` (see bench/importtime_report.py).
+
+`--root` points at another checkout, so a change can be compared with the
+code before it:
+
+    git worktree add /tmp/medconvo-base HEAD~1
+    python bench/cold_start_bench.py --runs 10 --root /tmp/medconvo-base
+    python bench/cold_start_bench.py --runs 10 --importtime
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from importtime_report import ROOT, loader, report, run_python
+
+# (name, entry point, first route)
+TARGETS = [
+    ("vercel_health", "api/health.py", "/api/health"),
+    ("vercel_token", "api/token.py", "/api/get-token?identity=bench&room=bench"),
+    ("vercel_backend", "api/backend.py", "/api/metrics"),
+    ("cloud_run_backend", "backend/main.py", "/health"),
+]
+
+# Runs in the fresh interpreter after the loader; drives the ASGI app directly
+# so that no HTTP client is imported into the measurement
+FIRST_REQUEST = """
+import asyncio, json, time
+
+async def first_request(app, target):
+    started = time.perf_counter()
+    lifespan_in, lifespan_out = asyncio.Queue(), asyncio.Queue()
+    await lifespan_in.put({"type": "lifespan.startup"})
+    lifespan = asyncio.create_task(app(
+        {"type": "lifespan", "asgi": {"version": "3.0"}, "state": {}}, lifespan_in.get, lifespan_out.put))
+    await lifespan_out.get()
+    startup_ms = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    path, _, query = target.partition("?")
+    requests = asyncio.Queue()
+    await requests.put({"type": "http.request", "body": b"", "more_body": False})
+    response = {"body": b""}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            response["body"] += message.get("body", b"")
+
+    await app({
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": query.encode(),
+        "root_path": "", "headers": [(b"host", b"localhost")], "client": ("127.0.0.1", 1),
+        "server": ("localhost", 80), "state": {},
+    }, requests.get, send)
+    request_ms = (time.perf_counter() - started) * 1000
+    responded_at = time.time()
+
+    await lifespan_in.put({"type": "lifespan.shutdown"})
+    await lifespan
+    return startup_ms, request_ms, responded_at, response["status"]
+
+import_ms = (time.perf_counter() - IMPORT_STARTED) * 1000
+startup_ms, request_ms, responded_at, status = asyncio.run(first_request(module.app, TARGET))
+sdk_load_ms = 0.0
+registry = getattr(module, "model_registry", None)
+if registry is not None and hasattr(registry, "sdk"):
+    started = time.perf_counter()
+    registry.sdk()
+    sdk_load_ms = (time.perf_counter() - started) * 1000
+print(json.dumps({"import_ms": import_ms, "startup_ms": startup_ms, "request_ms": request_ms,
+                  "responded_at": responded_at, "status": status, "sdk_load_ms": sdk_load_ms}))
+"""
+
+
+def child_code(path: str, target: str) -> str:
+    return f"import time\nIMPORT_STARTED = time.perf_counter()\nTARGET = {target!r}\n" + loader(path) + FIRST_REQUEST
+
+
+def bench_env():
+    env = dict(os.environ)
+    env.update(
+        GEMINI_API_KEY="bench", ELEVENLABS_API_KEY="bench", DEEPGRAM_API_KEY="bench",
+        LIVEKIT_API_KEY="bench", LIVEKIT_SECRET="bench-secret",
+        # Cold start only: no warm-up calls to upstreams
+        MODEL_WARM_UP="off", TTS_WARM_UP="0",
+        TTS_CACHE_DIR=tempfile.mkdtemp(prefix="cold-start-bench-tts-"),
+    )
+    return env
+
+
+def summarize(values):
+    ordered = sorted(values)
+    return {"p50": round(ordered[len(ordered) // 2], 1), "max": round(ordered[-1], 1)}
+
+
+def bench_target(path: str, target: str, runs: int, env):
+    code = child_code(path, target)
+    run_python(code, env)  # Compile bytecode first; a deployed image ships it
+    samples = []
+    for _ in range(runs):
+        spawned_at = time.time()
+        result = run_python(code, env)
+        sample = json.loads(result.stdout.strip().splitlines()[-1])
+        sample["cold_start_ms"] = (sample["responded_at"] - spawned_at) * 1000
+        samples.append(sample)
+    statuses = sorted({sample["status"] for sample in samples})
+    return {
+        "route": target,
+        "status": statuses[0] if len(statuses) == 1 else statuses,
+        **{key: summarize([sample[key] for sample in samples])
+           for key in ("cold_start_ms", "import_ms", "startup_ms", "request_ms", "sdk_load_ms")},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10, help="cold starts per entry point")
+    parser.add_argument("--root", default=ROOT, help="checkout to benchmark")
+    parser.add_argument("--importtime", action="store_true", help="add an -X importtime breakdown per entry point")
+    parser.add_argument("--top", type=int, default=8, help="modules per -X importtime breakdown")
+    args = parser.parse_args()
+
+    env = bench_env()
+    # Interpreter start alone, the floor under every cold start
+    started = time.perf_counter()
+    for _ in range(args.runs):
+        subprocess.run([sys.executable, "-c", "pass"], check=True)
+    results = {
+        "root": os.path.abspath(args.root),
+        "interpreter_start_and_exit_ms": round((time.perf_counter() - started) * 1000 / args.runs, 1),
+    }
+    for name, entry_point, target in TARGETS:
+        path = os.path.join(os.path.abspath(args.root), entry_point)
+        if not os.path.exists(path):
+            results[name] = None
+            continue
+        results[name] = bench_target(path, target, args.runs, env)
+        if args.importtime:
+            profile = report(path, repeat=3, top=args.top, env=env)
+            results[name]["import_profile_ms"] = profile["direct_imports_ms"]
+            results[name]["import_by_package_ms"] = profile["self_ms_by_package"]
+    results["config"] = vars(args)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Load test: blocking `requests` calls vs the shared async client pool
+
+Serves a stub ElevenLabs upstream locally, then drives concurrent /tts calls
+at two apps: a replica of the old handler (synchronous requests.post inside
+an async route) and the real backend/main.py app using http_clients.pool.
+While the load runs, /health is probed to show how long the event loop stalls.
+
+    python bench/http_pool_load.py --requests 64 --concurrency 32 --latency 0.2
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+import httpx
+import requests
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from serve import serve
+from stubs import StubConfig, create_stub_app
+
+
+def create_blocking_app(upstream: str) -> FastAPI:
+    """The pre-pool handler: a synchronous upstream call on the event loop"""
+    app = FastAPI()
+
+    @app.post("/tts")
+    async def tts(request: Request):
+        body = await request.json()
+        response = requests.post(f"{upstream}/v1/text-to-speech/voice/stream", json={"text": body["text"]}, stream=True)
+        return StreamingResponse(response.iter_content(chunk_size=1024), media_type="audio/mpeg")
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok"}
+
+    return app
+
+
+def load_backend_app(upstream: str) -> FastAPI:
+    os.environ["ELEVENLABS_BASE_URL"] = upstream
+    os.environ.setdefault("ELEVENLABS_API_KEY", "bench")
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+    import main
+    return main.app
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def drive(base_url: str, total: int, concurrency: int):
+    limit = asyncio.Semaphore(concurrency)
+    latencies, probes = [], []
+    done = asyncio.Event()
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=httpx.Limits(max_connections=concurrency + 1)) as client:
+        async def one():
+            async with limit:
+                start = time.perf_counter()
+                response = await client.post("/tts", json={"text": "hello there"})
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+
+        async def probe():
+            while not done.is_set():
+                start = time.perf_counter()
+                await client.get("/health")
+                probes.append(time.perf_counter() - start)
+                await asyncio.sleep(0.05)
+
+        probe_task = asyncio.create_task(probe())
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(total)))
+        wall = time.perf_counter() - start
+        done.set()
+        await probe_task
+
+    return {
+        "requests": total,
+        "wall_s": round(wall, 3),
+        "throughput_rps": round(total / wall, 2),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "health_probe_max_ms": round(max(probes) * 1000, 1) if probes else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=0.2, help="stub upstream latency in seconds")
+    args = parser.parse_args()
+
+    results = {}
+    with serve(create_stub_app(StubConfig(latency=args.latency))) as upstream:
+        with serve(create_blocking_app(upstream)) as url:
+            results["before_blocking_requests"] = asyncio.run(drive(url, args.requests, args.concurrency))
+        with serve(load_backend_app(upstream)) as url:
+            results["after_async_pool"] = asyncio.run(drive(url, args.requests, args.concurrency))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Import-time profile of a serverless entry point, per module and per package
+
+Loads one entry point (a file such as api/token.py or backend/main.py) in a
+fresh interpreter under `python -X importtime`, and turns the raw
+stderr log into a report:
+
+- the total import time of the entry point;
+- the modules it imports directly, with the cumulative time of each;
+- the heaviest modules anywhere in the tree, by cumulative time;
+- self time summed per top-level package (fastapi, pydantic, google, ...).
+
+The entry point is imported once beforehand so that bytecode compilation is
+not counted, and each figure is the minimum over `--repeat` runs.
+
+    python bench/importtime_report.py api/token.py --top 15
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Imports a file the way a serverless runtime does: as a module of its own.
+# backend/main.py needs its directory on sys.path for its flat imports; api/
+# files add what they share themselves, and api/token.py would shadow the
+# stdlib token module.
+LOADER = """
+import importlib.util, sys
+if {search_dir!r}:
+    sys.path.insert(0, {search_dir!r})
+spec = importlib.util.spec_from_file_location("entry_point", {path!r})
+module = importlib.util.module_from_spec(spec)
+sys.modules["entry_point"] = module
+spec.loader.exec_module(module)
+"""
+
+
+def loader(path: str) -> str:
+    directory = os.path.dirname(path)
+    return LOADER.format(path=path, search_dir="" if os.path.basename(directory) == "api" else directory)
+
+
+def run_python(code: str, env=None, importtime: bool = False) -> subprocess.CompletedProcess:
+    """`code` in a fresh interpreter, started outside the repo so nothing shadows the stdlib"""
+    args = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", code]
+    result = subprocess.run(args, capture_output=True, text=True, cwd=tempfile.gettempdir(), env=env)
+    if result.returncode:
+        raise RuntimeError(f"{code.strip()}\n{result.stderr[-2000:]}")
+    return result
+
+
+def parse(stderr: str) -> List[Tuple[str, int, float, float]]:
+    """(module, depth, self ms, cumulative ms) per `import time:` line, in log order"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        rows.append((name.strip(), depth, int(self_us) / 1000, int(cumulative_us) / 1000))
+    return rows
+
+
+def profile(path: str, repeat: int = 3, env=None) -> Dict[str, Tuple[int, float, float]]:
+    """Best (depth, self ms, cumulative ms) per module that the entry point itself imported"""
+    run_python(loader(path), env)  # Compile bytecode first
+    best: Dict[str, Tuple[int, float, float]] = {}
+    for _ in range(repeat):
+        # Everything the interpreter imported before the loader ran is not the entry point's
+        rows = parse(run_python(loader(path), env, importtime=True).stderr)
+        start = max((i for i, row in enumerate(rows) if row[0] in ("importlib.util", "site")), default=-1) + 1
+        for name, depth, self_ms, cumulative_ms in rows[start:]:
+            previous = best.get(name)
+            if previous is None or cumulative_ms < previous[2]:
+                best[name] = (depth, self_ms, cumulative_ms)
+    return best
+
+
+def report(path: str, repeat: int = 3, top: int = 15, env=None) -> Dict[str, object]:
+    modules = profile(path, repeat, env)
+    packages: Dict[str, float] = {}
+    for name, (_, self_ms, _) in modules.items():
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0.0) + self_ms
+    direct = {name: row for name, row in modules.items() if row[0] == 0}
+    return {
+        "entry_point": os.path.relpath(path, ROOT),
+        "total_ms": round(sum(row[2] for row in direct.values()), 1),
+        "modules_imported": len(modules),
+        "direct_imports_ms": {
+            name: round(row[2], 1)
+            for name, row in sorted(direct.items(), key=lambda item: -item[1][2])[:top]
+        },
+        "heaviest_modules_ms": {
+            name: round(row[2], 1)
+            for name, row in sorted(modules.items(), key=lambda item: -item[1][2])[:top]
+        },
+        "self_ms_by_package": {
+            package: round(ms, 1)
+            for package, ms in sorted(packages.items(), key=lambda item: -item[1])[:top]
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("entry_points", nargs="+", help="files to import, e.g. api/backend.py")
+    parser.add_argument("--repeat", type=int, default=3, help="profiled runs (best per module is reported)")
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    print(json.dumps([report(os.path.abspath(path), args.repeat, args.top) for path in args.entry_points], indent=2))
+
+
+if __name__ == "__main__":
+    main()
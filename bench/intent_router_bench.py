@@ -0,0 +1,85 @@
+"""Intent router accuracy and micro-benchmark
+
+Scores the compiled router and the two legacy keyword scans against the
+labeled fixture, then times one classification as the vocabulary grows from
+the shipped list to tens of thousands of synthetic terms.
+
+    python bench/intent_router_bench.py
+"""
+import argparse
+import json
+import os
+import random
+import string
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+from intent_router import DEFAULT_VOCABULARY, IntentRouter, load_vocabulary
+
+FIXTURE = os.path.join(ROOT, "bench", "fixtures", "intent_labels.jsonl")
+
+LEGACY_BACKEND = ['diabetes', 'asthma', 'cancer', 'pregnancy', 'treatment', 'symptom', 'doctor', 'medicine',
+                  'hospital', 'health', 'pain', 'disease', 'diagnosis', 'medical', 'patient']
+LEGACY_API = ['diabetes', 'asthma', 'cancer', 'pregnancy', 'treatment', 'symptom']
+
+
+def legacy_classifier(keywords):
+    def classify(message):
+        return 'medical' if any(word in message.lower() for word in keywords) else 'general'
+    return classify
+
+
+def accuracy(classify, rows):
+    correct = sum(classify(row["message"]) == row["label"] for row in rows)
+    misses = [row["message"] for row in rows if classify(row["message"]) != row["label"]]
+    return {"accuracy": round(correct / len(rows), 3), "errors": misses}
+
+
+def synthetic_vocabulary(base, size, seed=7):
+    rng = random.Random(seed)
+    vocabulary = dict(base)
+    while len(vocabulary) < size:
+        term = "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(5, 14)))
+        vocabulary[term] = (term, 1.0)
+    return vocabulary
+
+
+def time_us(classify, messages, number):
+    seconds = timeit.timeit(lambda: [classify(message) for message in messages], number=number)
+    return round(seconds / (number * len(messages)) * 1e6, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=200, help="timing repetitions over the fixture")
+    args = parser.parse_args()
+
+    with open(FIXTURE) as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    messages = [row["message"] for row in rows]
+    vocabulary = load_vocabulary([DEFAULT_VOCABULARY])
+    router = IntentRouter(vocabulary)
+
+    results = {
+        "fixture": {"messages": len(rows)},
+        "accuracy": {
+            "legacy_backend_keywords": accuracy(legacy_classifier(LEGACY_BACKEND), rows),
+            "legacy_api_keywords": accuracy(legacy_classifier(LEGACY_API), rows),
+            "compiled_router": accuracy(router.classify, rows),
+        },
+        "us_per_message": {
+            "legacy_backend_keywords": time_us(legacy_classifier(LEGACY_BACKEND), messages, args.number),
+        },
+    }
+    for size in (len(vocabulary), 1000, 10000, 50000):
+        sized = router if size == len(vocabulary) else IntentRouter(synthetic_vocabulary(vocabulary, size))
+        legacy = legacy_classifier(list(sized.vocabulary))
+        results["us_per_message"][f"compiled_router_{size}_terms"] = time_us(sized.classify, messages, args.number)
+        results["us_per_message"][f"linear_scan_{size}_terms"] = time_us(legacy, messages, max(1, args.number // 20))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,407 @@
+"""Voice-session load test for the backend, Vercel API and token server apps
+
+Each app under test runs in its own process against local stub upstreams
+(ElevenLabs and Deepgram over HTTP, Gemini faked inside the app process), so
+runs are reproducible and cost nothing. Concurrent simulated voice sessions
+fetch a LiveKit token, then for every turn transcribe audio (STT), stream
+the reply (/stream) and synthesize its first sentence (/tts).
+
+The report is JSON: throughput, p50/p95/p99 per endpoint, time to first
+token and first audio byte, and app-process memory per connection. Save it
+with --output and compare runs across commits.
+
+    python bench/load_test.py --app all --sessions 32 --turns 3 --output results.json
+    python bench/load_test.py --app backend --error-rate 0.05 --llm-ttft 0.5
+"""
+import argparse
+import asyncio
+import dataclasses
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH)
+sys.path.insert(0, BENCH)
+from stubs import StubConfig, create_stub_app, install_stub_gemini
+
+FIXTURE = os.path.join(BENCH, "fixtures", "intent_labels.jsonl")
+# Shared by the token server and the backends, which verify its tokens
+LIVEKIT_ENV = {"LIVEKIT_API_KEY": "bench-key", "LIVEKIT_SECRET": "bench-secret-bench-secret-bench-secret"}
+
+# Routes and STT request style per app
+APPS = {
+    "backend": {"health": "/health", "stt": "/deepgram-proxy", "stt_form": True, "stream": "/stream", "tts": "/tts"},
+    "api": {"health": "/api/health", "stt": "/api/deepgram-proxy", "stt_form": False, "stream": "/api/stream", "tts": "/api/tts"},
+}
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def load_app(name: str, stub_config: StubConfig):
+    """Import one app inside a server process (each lives in its own directory)"""
+    if name == "stubs":
+        return create_stub_app(stub_config)
+    if name == "backend":
+        sys.path.insert(0, os.path.join(ROOT, "backend"))
+        import main
+        return main.app
+    if name == "api":
+        import importlib.util
+        spec = importlib.util.spec_from_file_location("api_backend", os.path.join(ROOT, "api", "backend.py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module.app
+    if name == "token":
+        sys.path.insert(0, os.path.join(ROOT, "token_server"))
+        import main
+        return main.app
+    raise ValueError(f"Unknown app {name}")
+
+
+def run_server(name: str, port: int, stub_config: StubConfig, seed: int):
+    """Entry point of a server process"""
+    import uvicorn
+
+    random.seed(seed)  # Stub error injection is reproducible per run
+    if name in APPS:
+        install_stub_gemini(stub_config)
+    uvicorn.run(load_app(name, stub_config), host="127.0.0.1", port=port, log_level="warning")
+
+
+class ServerProcess:
+    """One app served by uvicorn in a child process"""
+
+    def __init__(self, name: str, stub_config: StubConfig, env: Dict[str, str], seed: int = 0):
+        self.name = name
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--serve", name, "--port", str(self.port),
+             "--stub-config", json.dumps(dataclasses.asdict(stub_config)), "--seed", str(seed)],
+            env={**os.environ, **env},
+        )
+
+    async def wait_ready(self, path: Optional[str], timeout: float = 60.0):
+        deadline = time.monotonic() + timeout
+        async with httpx.AsyncClient(base_url=self.url) as client:
+            while time.monotonic() < deadline:
+                if self.process.poll() is not None:
+                    raise RuntimeError(f"{self.name} server exited with {self.process.returncode}")
+                try:
+                    # Any answer means the socket is up; app health routes must also say 200
+                    response = await client.get(path or "/")
+                    if path is None or response.status_code == 200:
+                        return
+                except httpx.TransportError:
+                    pass
+                await asyncio.sleep(0.1)
+        raise TimeoutError(f"{self.name} server not ready after {timeout}s")
+
+    def rss_kb(self) -> Optional[int]:
+        """Resident set size of the server process (Linux /proc only)"""
+        try:
+            with open(f"/proc/{self.process.pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1])
+        except OSError:
+            pass
+        return None
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def summarize(values: List[float]) -> Dict[str, Optional[float]]:
+    return {f"p{pct}_ms": None if not values else round(percentile(values, pct) * 1000, 1) for pct in (50, 95, 99)}
+
+
+class EndpointStats:
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.first_byte: List[float] = []
+        self.errors = 0
+
+    def report(self, wall: float, first_byte_name: Optional[str] = None) -> Dict[str, object]:
+        report: Dict[str, object] = {
+            "requests": len(self.latencies) + self.errors,
+            "errors": self.errors,
+            "rps": round(len(self.latencies) / wall, 2),
+            **summarize(self.latencies),
+        }
+        if first_byte_name:
+            report[first_byte_name] = summarize(self.first_byte)
+        return report
+
+
+def load_questions() -> List[str]:
+    with open(FIXTURE) as f:
+        return [json.loads(line)["message"] for line in f if line.strip()]
+
+
+def first_sentence(text: str, limit: int = 200) -> str:
+    return _SENTENCE_END.split(text.strip(), 1)[0][:limit]
+
+
+def token_text(data: str) -> str:
+    """Token text from an SSE data line ({"token"} JSON; older servers sent plain text)"""
+    if data.startswith("{"):
+        try:
+            return json.loads(data).get("token", "")
+        except ValueError:
+            pass
+    return data
+
+
+async def voice_session(
+    client: httpx.AsyncClient,
+    token_client: Optional[httpx.AsyncClient],
+    routes: Dict[str, object],
+    session: int,
+    args,
+    questions: List[str],
+    stats: Dict[str, EndpointStats],
+    audio: bytes,
+):
+    rng = random.Random(args.seed + session)
+    identity, room = f"bench-{session}", "bench-room"
+    headers: Dict[str, str] = {}
+
+    if token_client is not None:
+        start = time.perf_counter()
+        try:
+            response = await token_client.get("/get-token", params={"identity": identity, "room": room})
+            response.raise_for_status()
+            stats["token"].latencies.append(time.perf_counter() - start)
+            headers["Authorization"] = f"Bearer {response.json()['token']}"
+        except httpx.HTTPError:
+            stats["token"].errors += 1
+
+    for turn in range(args.turns):
+        start = time.perf_counter()
+        try:
+            if routes["stt_form"]:
+                response = await client.post(routes["stt"], files={"audio": ("turn.wav", audio, "audio/wav")})
+            else:
+                response = await client.post(routes["stt"], content=audio, headers={"Content-Type": "audio/wav"})
+            response.raise_for_status()
+            stats["stt"].latencies.append(time.perf_counter() - start)
+        except httpx.HTTPError:
+            stats["stt"].errors += 1
+
+        # Ask a fixture question rather than the stub transcript so turns differ
+        question = rng.choice(questions)
+        message = question if args.repeat_questions else f"{question} (session {session}, turn {turn})"
+        reply, start, first = [], time.perf_counter(), None
+        try:
+            async with client.stream("POST", routes["stream"], json={"message": message}, headers=headers) as response:
+                response.raise_for_status()
+                event = None
+                async for line in response.aiter_lines():
+                    if line.startswith("event:"):
+                        event = line[6:].strip()
+                    elif line.startswith("data:") and event is None:
+                        if first is None:
+                            first = time.perf_counter() - start
+                        reply.append(token_text(line[5:].lstrip()))
+                    elif not line:
+                        event = None
+            stats["stream"].latencies.append(time.perf_counter() - start)
+            if first is not None:
+                stats["stream"].first_byte.append(first)
+        except httpx.HTTPError:
+            stats["stream"].errors += 1
+            continue
+
+        text = first_sentence("".join(reply))
+        if not text:
+            continue
+        start, first = time.perf_counter(), None
+        try:
+            async with client.stream("POST", routes["tts"], json={"text": text}) as response:
+                response.raise_for_status()
+                async for _ in response.aiter_bytes():
+                    if first is None:
+                        first = time.perf_counter() - start
+            stats["tts"].latencies.append(time.perf_counter() - start)
+            if first is not None:
+                stats["tts"].first_byte.append(first)
+        except httpx.HTTPError:
+            stats["tts"].errors += 1
+
+        if args.think:
+            await asyncio.sleep(args.think)
+
+
+async def sample_rss(server: ServerProcess, samples: List[int], done: asyncio.Event):
+    while not done.is_set():
+        rss = server.rss_kb()
+        if rss is not None:
+            samples.append(rss)
+        await asyncio.sleep(0.05)
+
+
+async def run_load(name: str, server: ServerProcess, token_server: Optional[ServerProcess], args) -> Dict[str, object]:
+    routes = APPS[name]
+    stats = {endpoint: EndpointStats() for endpoint in ("token", "stt", "stream", "tts")}
+    questions = load_questions()
+    audio = random.Random(args.seed).randbytes(args.audio_bytes)
+    limits = httpx.Limits(max_connections=args.sessions * 2, max_keepalive_connections=args.sessions)
+
+    async with httpx.AsyncClient(base_url=server.url, timeout=120, limits=limits) as client, \
+            httpx.AsyncClient(base_url=token_server.url if token_server else server.url, timeout=30, limits=limits) as token_client:
+        baseline = server.rss_kb()
+        samples: List[int] = []
+        done = asyncio.Event()
+        sampler = asyncio.create_task(sample_rss(server, samples, done))
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            voice_session(client, token_client if token_server else None, routes, session, args, questions, stats, audio)
+            for session in range(args.sessions)
+        ))
+        wall = time.perf_counter() - start
+        done.set()
+        await sampler
+
+    peak = max(samples, default=None)
+    completed_turns = len(stats["stream"].latencies)
+    report = {
+        "wall_s": round(wall, 3),
+        "sessions": args.sessions,
+        "turns_completed": completed_turns,
+        "turns_per_s": round(completed_turns / wall, 2),
+        "endpoints": {
+            "stt": stats["stt"].report(wall),
+            "stream": stats["stream"].report(wall, "ttft"),
+            "tts": stats["tts"].report(wall, "ttfb"),
+        },
+        "memory": {
+            "baseline_rss_kb": baseline,
+            "peak_rss_kb": peak,
+            # Growth under load spread over the concurrent sessions (one connection each)
+            "per_connection_kb": None if baseline is None or peak is None else round((peak - baseline) / args.sessions, 1),
+        },
+    }
+    if token_server:
+        report["endpoints"]["token"] = stats["token"].report(wall)
+    return report
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> Dict[str, object]:
+    stub_config = StubConfig(
+        latency=args.latency,
+        audio_chunks=args.audio_chunks,
+        chunk_interval=args.chunk_interval,
+        error_rate=args.error_rate,
+        llm_ttft=args.llm_ttft,
+        llm_chunks=args.llm_chunks,
+        llm_chunk_interval=args.llm_chunk_interval,
+    )
+    names = list(APPS) if args.app == "all" else [args.app]
+    results: Dict[str, object] = {
+        "commit": git_commit(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("serve", "port", "stub_config", "output")},
+        "apps": {},
+    }
+
+    stubs = ServerProcess("stubs", stub_config, {}, args.seed)
+    servers = [stubs]
+    try:
+        await stubs.wait_ready(None)
+        token_server = None
+        if not args.skip_token:
+            token_server = ServerProcess("token", stub_config, LIVEKIT_ENV, args.seed)
+            servers.append(token_server)
+            await token_server.wait_ready("/health")
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            env = {
+                "GEMINI_API_KEY": "bench", "ELEVENLABS_API_KEY": "bench", "DEEPGRAM_API_KEY": "bench",
+                "ELEVENLABS_BASE_URL": stubs.url, "DEEPGRAM_BASE_URL": stubs.url,
+                "TTS_WARM_UP": "0", "TTS_CACHE_DIR": cache_dir,
+                **LIVEKIT_ENV,  # Backends key conversation history on the token server's tokens
+            }
+            for name in names:
+                server = ServerProcess(name, stub_config, env, args.seed)
+                servers.append(server)
+                await server.wait_ready(APPS[name]["health"])
+                results["apps"][name] = await run_load(name, server, token_server, args)
+                server.stop()
+    finally:
+        for server in servers:
+            server.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--app", choices=["backend", "api", "all"], default="all")
+    parser.add_argument("--sessions", type=int, default=16, help="concurrent voice sessions")
+    parser.add_argument("--turns", type=int, default=3, help="turns per session")
+    parser.add_argument("--think", type=float, default=0.0, help="seconds between turns")
+    parser.add_argument("--repeat-questions", action="store_true", help="reuse fixture questions verbatim so reply caches can hit")
+    parser.add_argument("--skip-token", action="store_true", help="do not start the token server")
+    parser.add_argument("--audio-bytes", type=int, default=32000, help="audio uploaded per STT call")
+    parser.add_argument("--latency", type=float, default=0.2, help="stub TTS/STT latency before the first byte (s)")
+    parser.add_argument("--audio-chunks", type=int, default=20, help="stub TTS chunks per reply")
+    parser.add_argument("--chunk-interval", type=float, default=0.01, help="stub TTS seconds between chunks")
+    parser.add_argument("--llm-ttft", type=float, default=0.3, help="stub Gemini time to first chunk (s)")
+    parser.add_argument("--llm-chunks", type=int, default=8, help="stub Gemini chunks per reply")
+    parser.add_argument("--llm-chunk-interval", type=float, default=0.03, help="stub Gemini seconds between chunks")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of stub upstream calls that fail")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    # Internal: run one app in a server process
+    parser.add_argument("--serve", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--stub-config", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        run_server(args.serve, args.port, StubConfig(**json.loads(args.stub_config)), args.seed)
+        return
+
+    results = asyncio.run(run(args))
+    report = json.dumps(results, indent=2)
+    print(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Model routing benchmark: fixed model vs hedged, fallback-capable routing
+
+Runs the medical route against stub Gemini models: a slow, jittery primary
+and a fast secondary. The fixed strategy always uses the primary (the old
+query_medgemma behaviour); the routed strategy uses ModelRouter with hedging
+and fallback. Reports time to first token percentiles, how often a canned
+apology was served, and which model answered.
+
+    python bench/model_router_bench.py --requests 200 --primary-error-rate 0.1
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from stubs import StubConfig, install_stub_gemini
+
+PRIMARY = "gemini-1.5-pro"
+SECONDARY = "gemini-1.5-flash"
+FALLBACK = "I'm sorry, I'm having trouble accessing medical information."
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def drive(stream, requests: int, concurrency: int):
+    from streaming import StreamTimer
+
+    limit = asyncio.Semaphore(concurrency)
+    ttfts, models, apologies = [], Counter(), 0
+
+    async def one(i):
+        nonlocal apologies
+        async with limit:
+            timer = StreamTimer("medical")
+            reply = "".join([chunk async for chunk in stream(f"question {i}", timer)])
+            if reply == FALLBACK:
+                apologies += 1
+            else:
+                ttfts.append(timer.ttft_ms)
+                models[timer.model] += 1
+
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return {
+        "ttft_p50_ms": percentile(ttfts, 50) if ttfts else None,
+        "ttft_p95_ms": percentile(ttfts, 95) if ttfts else None,
+        "ttft_p99_ms": percentile(ttfts, 99) if ttfts else None,
+        "apology_rate": round(apologies / requests, 3),
+        "answered_by": dict(models),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--primary-ttft", type=float, default=1.2)
+    parser.add_argument("--secondary-ttft", type=float, default=0.3)
+    parser.add_argument("--jitter", type=float, default=0.8, help="relative TTFT jitter of every model")
+    parser.add_argument("--primary-error-rate", type=float, default=0.1)
+    parser.add_argument("--hedge-after", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)  # Expected stub failures are counted, not logged
+    random.seed(args.seed)
+    install_stub_gemini(StubConfig(
+        llm_chunks=4, llm_chunk_interval=0.01, llm_jitter=args.jitter,
+        model_ttft={PRIMARY: args.primary_ttft, SECONDARY: args.secondary_ttft},
+        model_error_rate={PRIMARY: args.primary_error_rate},
+    ))
+    from model_router import ModelRouter, RoutePolicy
+    from streaming import stream_model
+
+    router = ModelRouter({"medical": RoutePolicy([PRIMARY, SECONDARY], ttft_slo=2.5, hedge_after=args.hedge_after)})
+    results = {
+        "fixed_primary": asyncio.run(drive(
+            lambda prompt, timer: stream_model(PRIMARY, prompt, FALLBACK, timer=timer), args.requests, args.concurrency)),
+        "routed": asyncio.run(drive(
+            lambda prompt, timer: router.stream("medical", prompt, FALLBACK, timer=timer), args.requests, args.concurrency)),
+        "profiles": router.stats()["models"],
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""Speculative replies benchmark: hit rate and time to first token after the endpoint
+
+Each scenario in bench/fixtures/speculation_scripts.jsonl is a timed sequence
+of interim, final and endpoint results that the stub live STT plays back
+(StubConfig.stt_script). Sessions talk to /ws/stt?respond=true on the real
+backend app with stub Gemini behind it, once with speculation off and once
+on. For every scenario the report gives the time from the `utterance` event
+to the first reply token as the client sees it, the speculation outcomes
+(hit, changed, abandoned) and the expected outcome from the fixture.
+
+    python bench/speculation_bench.py --sessions 8 --llm-ttft 0.3
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+sys.path.append(os.path.join(ROOT, "token_server"))  # After backend/: both have a main.py
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from serve import serve
+from stubs import StubConfig, create_stub_app, install_stub_gemini
+from livekit_tokens import TokenIssuer
+
+SCRIPTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "speculation_scripts.jsonl")
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))], 1) if ordered else None
+
+
+async def one_session(ws_url: str, identity: str):
+    """Milliseconds from the utterance event to the first token event"""
+    from websockets.asyncio.client import connect
+
+    token, _ = TokenIssuer("stub", "stub-secret").issue(identity, "bench")
+    async with connect(f"{ws_url}/ws/stt?respond=true&token={token}") as websocket:
+        await websocket.send(b"\x00" * 640)  # Any audio starts the scripted transcript
+        utterance_at = None
+        latency = None
+        async for raw in websocket:
+            event = json.loads(raw)
+            if event["type"] == "utterance":
+                utterance_at = time.perf_counter()
+            elif event["type"] == "token" and latency is None and utterance_at is not None:
+                latency = (time.perf_counter() - utterance_at) * 1000
+            elif event["type"] in ("response_end", "error"):
+                break
+        await websocket.send(json.dumps({"type": "stop"}))
+        return latency
+
+
+async def run_scenario(ws_url: str, mode: str, scenario, sessions: int):
+    latencies = await asyncio.gather(*(
+        one_session(ws_url, f"{mode}-{scenario['name']}-{i}") for i in range(sessions)
+    ))
+    return [latency for latency in latencies if latency is not None]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scripts", default=SCRIPTS)
+    parser.add_argument("--sessions", type=int, default=8, help="concurrent sessions per scenario and mode")
+    parser.add_argument("--llm-ttft", type=float, default=0.3)
+    parser.add_argument("--stable-events", type=int, default=2)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    with open(args.scripts) as f:
+        scenarios = [json.loads(line) for line in f if line.strip()]
+
+    config = StubConfig(llm_ttft=args.llm_ttft)
+    with serve(create_stub_app(config)) as stub_url:
+        os.environ.update(
+            GEMINI_API_KEY="stub", ELEVENLABS_API_KEY="stub", DEEPGRAM_API_KEY="stub",
+            LIVEKIT_API_KEY="stub", LIVEKIT_SECRET="stub-secret",
+            ELEVENLABS_BASE_URL=stub_url, DEEPGRAM_BASE_URL=stub_url,
+            DEEPGRAM_WS_URL=stub_url.replace("http", "ws") + "/v1/listen",
+            RESPONSE_CACHE_TTL="0", TTS_WARM_UP="0", MODEL_WARM_UP="off",
+            TTS_CACHE_DIR=tempfile.mkdtemp(prefix="speculation-bench-tts-"),
+        )
+        install_stub_gemini(config)
+        import main as backend
+        import speculation
+
+        rows = []
+        with serve(backend.app) as backend_url:
+            ws_url = backend_url.replace("http", "ws")
+            for scenario in scenarios:
+                config.stt_script = scenario["events"]
+                row = {"scenario": scenario["name"], "expect": scenario["expect"]}
+                for mode in ("off", "on"):
+                    enabled = mode == "on"
+                    backend.voice_speculator = lambda key, enabled=enabled: speculation.Speculator(
+                        lambda message: backend.begin_turn(message, key, record=False),
+                        stable_events=args.stable_events, enabled=enabled)
+                    before = dict(speculation.tracker.outcomes)
+                    latencies = asyncio.run(run_scenario(ws_url, mode, scenario, args.sessions))
+                    row[f"first_token_ms_{mode}_p50"] = percentile(latencies, 50)
+                    if enabled:
+                        row["outcomes"] = {
+                            outcome: count - before.get(outcome, 0)
+                            for outcome, count in speculation.tracker.outcomes.items()
+                            if count - before.get(outcome, 0)
+                        }
+                off, on = row["first_token_ms_off_p50"], row["first_token_ms_on_p50"]
+                row["saved_ms_p50"] = round(off - on, 1) if off is not None and on is not None else None
+                rows.append(row)
+
+        stats = speculation.tracker.stats()
+        saved = [row["saved_ms_p50"] for row in rows if row["saved_ms_p50"] is not None]
+        results = {
+            "summary": {
+                "hit_rate": stats["hit_rate"],
+                "precision": stats["precision"],
+                "saved_ms_avg_per_turn": round(sum(saved) / len(saved), 1) if saved else None,
+                "saved_ms_p50_on_hits": stats["saved_ms_p50"],
+                "wasted_llm_s": stats["wasted_s"],
+                "outcomes": stats["outcomes"],
+            },
+            "scenarios": rows,
+            "config": vars(args),
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""SSE framing micro-benchmark: per-token events vs the coalescing replay layer
+
+Streams `--replies` synthetic replies of `--tokens` word tokens through
+(a) the previous framing, one SSE event per token, and (b) sse.SSEStreams
+with coalescing and a replay buffer, reading each reply the way the HTTP
+response does. Tokens arrive either back to back (pure framing cost) or
+`--token-gap-ms` apart (a streaming model). The report gives CPU time per
+token, writes and bytes per reply and the delay added to the first token.
+
+    python bench/sse_bench.py --tokens 300 --replies 200 --token-gap-ms 2
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+from sse import SSEStreams
+from streaming import StreamTimer, sse_event
+
+
+async def tokens(count: int, gap: float, first_at: list):
+    for i in range(count):
+        if gap:
+            await asyncio.sleep(gap)
+        if i == 0:
+            first_at.append(time.perf_counter())
+        yield f"word{i % 97} " if i % 40 else "line\n"
+
+
+async def per_token(reply, timer):
+    # The framing /stream used before: one JSON event per model chunk
+    async for token in reply:
+        yield sse_event(json.dumps({"token": token}))
+    timer.finish()
+    yield sse_event(json.dumps(timer.as_dict()), event="metrics")
+
+
+async def run(mode: str, args, gap: float):
+    streams = SSEStreams(coalesce_ms=args.coalesce_ms, coalesce_bytes=args.coalesce_bytes, resume_seconds=0)
+    writes = size = 0
+    first_delays = []
+    cpu_started = time.process_time()
+    for _ in range(args.replies):
+        first_at, timer = [], StreamTimer("bench")
+        source = tokens(args.tokens, gap, first_at)
+        body = per_token(source, timer) if mode == "per_token" else streams.read(await streams.open(source, timer))
+        seen_first = False
+        async for chunk in body:
+            if not seen_first and '"token"' in chunk:
+                first_delays.append((time.perf_counter() - first_at[0]) * 1000)
+                seen_first = True
+            writes += 1
+            size += len(chunk)
+    cpu = time.process_time() - cpu_started
+    total_tokens = args.tokens * args.replies
+    first_delays.sort()
+    return {
+        "cpu_us_per_token": round(cpu / total_tokens * 1e6, 2),
+        "writes_per_reply": round(writes / args.replies, 1),
+        "bytes_per_reply": round(size / args.replies),
+        "first_token_delay_ms_p50": round(first_delays[len(first_delays) // 2], 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tokens", type=int, default=300, help="tokens per reply")
+    parser.add_argument("--replies", type=int, default=200)
+    parser.add_argument("--token-gap-ms", type=float, default=2.0, help="model inter-token gap in the streaming run")
+    parser.add_argument("--coalesce-ms", type=float, default=40.0)
+    parser.add_argument("--coalesce-bytes", type=int, default=512)
+    args = parser.parse_args()
+
+    report = {}
+    for label, gap in (("back_to_back", 0.0), ("streaming", args.token_gap_ms / 1000)):
+        report[label] = {mode: asyncio.run(run(mode, args, gap)) for mode in ("per_token", "coalesced")}
+    report["config"] = vars(args)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+"""Local stand-ins for the ElevenLabs, Deepgram and Gemini APIs and a LiveKit room
+
+Used by the benchmarks so runs are reproducible and never touch (or pay for)
+the real upstreams. Latency, chunking and error rates are configurable per
+app instance. ElevenLabs and Deepgram are served over HTTP; Gemini is faked
+at the SDK boundary (`install_stub_gemini`) because the SDK's async client
+talks gRPC and cannot be pointed at a local HTTP server. `StubRoom` takes the
+place of a LiveKit room for the agent worker (backend/agent.py).
+"""
+import asyncio
+import itertools
+import math
+import random
+import struct
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+@dataclass
+class StubConfig:
+    latency: float = 0.2           # seconds before the first byte
+    audio_chunks: int = 20         # chunks per TTS response
+    audio_chunk_size: int = 1024   # bytes per TTS chunk
+    chunk_interval: float = 0.01   # seconds between TTS chunks
+    transcript: str = "what are symptoms of diabetes"
+    words_per_final: int = 3       # live STT: words per is_final result
+    # live STT: if set, played once audio starts instead of `transcript`; items are
+    # {"after_ms", "type": "interim" | "final" | "endpoint", "transcript"}
+    stt_script: Optional[List[Dict[str, object]]] = None
+    error_rate: float = 0.0        # fraction of TTS/STT/LLM calls that fail
+    llm_ttft: float = 0.3          # seconds before the first LLM chunk
+    llm_chunks: int = 8            # chunks per LLM reply
+    llm_chunk_interval: float = 0.03
+    llm_jitter: float = 0.0        # LLM TTFT is scaled by a random factor in [1 - jitter, 1 + jitter]
+    model_ttft: Dict[str, float] = field(default_factory=dict)        # per-model llm_ttft overrides
+    model_error_rate: Dict[str, float] = field(default_factory=dict)  # per-model error_rate overrides
+    calls: Dict[str, int] = field(default_factory=dict)  # requests served so far, by upstream ("tts", "stt", "llm")
+    llm_reply: str = (
+        "Common symptoms include increased thirst, frequent urination and fatigue. "
+        "Blurred vision and slow-healing sores can also occur. "
+        "I'm an AI, not a doctor, so please talk to a healthcare professional about your symptoms."
+    )
+
+
+def _count(config: StubConfig, upstream: str):
+    config.calls[upstream] = config.calls.get(upstream, 0) + 1
+
+
+def _fail(config: StubConfig) -> bool:
+    return config.error_rate > 0 and random.random() < config.error_rate
+
+
+def create_stub_app(config: StubConfig = None) -> FastAPI:
+    config = config or StubConfig()
+    app = FastAPI()
+
+    @app.post("/v1/text-to-speech/{voice_id}/stream")
+    async def tts(voice_id: str, request: Request):
+        await request.body()
+        _count(config, "tts")
+        await asyncio.sleep(config.latency)
+        if _fail(config):
+            return JSONResponse({"detail": "stub TTS error"}, status_code=500)
+
+        async def audio():
+            for _ in range(config.audio_chunks):
+                yield b"\xff" * config.audio_chunk_size
+                await asyncio.sleep(config.chunk_interval)
+
+        return StreamingResponse(audio(), media_type="audio/mpeg")
+
+    @app.post("/v1/listen")
+    async def listen(request: Request):
+        await request.body()
+        _count(config, "stt")
+        await asyncio.sleep(config.latency)
+        if _fail(config):
+            return JSONResponse({"err_msg": "stub STT error"}, status_code=500)
+        return {"results": {"channels": [{"alternatives": [{"transcript": "what are symptoms of diabetes", "confidence": 0.99}]}]}}
+
+    @app.websocket("/v1/listen")
+    async def listen_live(websocket: WebSocket):
+        """Live STT: one word per audio frame as interim, finals every few words,
+        speech_final (endpoint) once the scripted transcript is exhausted.
+        With config.stt_script, the first audio frame starts that timed sequence instead."""
+        await websocket.accept()
+        words = config.transcript.split()
+        heard, pending = 0, []
+
+        def result(text, is_final=False, speech_final=False):
+            return {"type": "Results", "is_final": is_final, "speech_final": speech_final,
+                    "channel": {"alternatives": [{"transcript": text, "confidence": 0.99}]}}
+
+        async def play(script):
+            for step in script:
+                await asyncio.sleep(step.get("after_ms", 0) / 1000)
+                kind = step["type"]
+                await websocket.send_json(result(step["transcript"], kind != "interim", kind == "endpoint"))
+
+        if config.stt_script is not None:
+            player = None
+            try:
+                while True:
+                    message = await websocket.receive()
+                    if message["type"] == "websocket.disconnect":
+                        return
+                    if message.get("text"):
+                        if "KeepAlive" in message["text"]:
+                            continue
+                        break  # CloseStream
+                    if player is None:
+                        player = asyncio.create_task(play(config.stt_script))
+                if player is not None:
+                    await player
+                await websocket.close()
+            except WebSocketDisconnect:
+                pass
+            finally:
+                if player is not None:
+                    player.cancel()
+            return
+
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    return
+                if message.get("text"):
+                    if "KeepAlive" in message["text"]:
+                        continue
+                    break  # CloseStream
+                if heard >= len(words):
+                    continue
+                pending.append(words[heard])
+                heard += 1
+                await websocket.send_json(result(" ".join(pending)))
+                endpoint = heard == len(words)
+                if len(pending) >= config.words_per_final or endpoint:
+                    await asyncio.sleep(config.latency / 4)
+                    await websocket.send_json(result(" ".join(pending), is_final=True, speech_final=endpoint))
+                    pending = []
+            if pending:
+                await websocket.send_json(result(" ".join(pending), is_final=True, speech_final=True))
+            await websocket.close()
+        except WebSocketDisconnect:
+            pass
+
+    return app
+
+
+class _StubChunk:
+    def __init__(self, text: str):
+        self.text = text
+
+
+def stub_gemini(config: StubConfig = None):
+    """A GenerativeModel replacement that streams a canned reply
+
+    Each reply starts with a running number so replies (and their TTS audio)
+    differ between calls unless the app's own caches serve them.
+    """
+    config = config or StubConfig()
+    counter = itertools.count(1)
+
+    class StubGenerativeModel:
+        def __init__(self, model_name: str, **kwargs):
+            self.model_name = model_name
+
+        async def generate_content_async(self, prompt, stream: bool = False, **kwargs):
+            _count(config, "llm")
+            ttft = config.model_ttft.get(self.model_name, config.llm_ttft)
+            if config.llm_jitter:
+                ttft *= random.uniform(1 - config.llm_jitter, 1 + config.llm_jitter)
+            await asyncio.sleep(ttft)
+            error_rate = config.model_error_rate.get(self.model_name, config.error_rate)
+            if error_rate > 0 and random.random() < error_rate:
+                raise RuntimeError(f"stub {self.model_name} error")
+            words = f"Reply {next(counter)}. {config.llm_reply}".split()
+            size = max(1, -(-len(words) // config.llm_chunks))
+            pieces = [" ".join(words[i:i + size]) + " " for i in range(0, len(words), size)]
+            if not stream:
+                return _StubChunk("".join(pieces))
+
+            async def chunks():
+                for i, piece in enumerate(pieces):
+                    if i:
+                        await asyncio.sleep(config.llm_chunk_interval)
+                    yield _StubChunk(piece)
+
+            return chunks()
+
+    return StubGenerativeModel
+
+
+def install_stub_gemini(config: StubConfig = None):
+    """Patch the Gemini SDK so every model the app builds is the stub"""
+    import google.generativeai as genai
+
+    genai.GenerativeModel = stub_gemini(config)
+
+
+class _StubSink:
+    def __init__(self, room: "StubRoom"):
+        self.room = room
+
+    async def capture(self, pcm: bytes):
+        self.room.published.append((time.perf_counter(), len(pcm)))
+
+    def clear(self):
+        self.room.cleared += 1
+
+
+class StubRoom:
+    """Stand-in for a LiveKit room (agent.RoomTransport)
+
+    One participant speaks `frames` frames of a voiced tone in real time, then stays
+    in the room until `leave()`. Published audio frames and data messages are
+    recorded with their arrival times.
+    """
+
+    def __init__(self, identity: str = "patient", frames: int = 10, frame_interval: float = 0.02, frame_bytes: int = 640):
+        self.identity = identity
+        self.frames = frames
+        self.frame_interval = frame_interval
+        self.frame_bytes = frame_bytes
+        self.published: List[Tuple[float, int]] = []
+        self.data: List[Tuple[float, dict]] = []
+        self.cleared = 0
+        self.speech_ended_at: Optional[float] = None
+        self.reply_done = asyncio.Event()
+        self._closed = asyncio.Event()
+
+    async def connect(self, url: str, token: str):
+        self.token = token
+
+    def _tone(self) -> bytes:
+        # 200 Hz at -20 dBFS, 16 kHz 16-bit mono: loud enough to pass the agent's silence gate
+        samples = self.frame_bytes // 2
+        return struct.pack(f"<{samples}h", *(int(3277 * math.sin(2 * math.pi * 200 * i / 16000)) for i in range(samples)))
+
+    async def _speak(self):
+        frame = self._tone()
+        for _ in range(self.frames):
+            yield frame
+            await asyncio.sleep(self.frame_interval)
+        self.speech_ended_at = time.perf_counter()
+
+    async def audio_tracks(self):
+        yield self.identity, self._speak()
+        await self._closed.wait()
+
+    async def publish_audio(self, name: str, sample_rate: int):
+        return _StubSink(self)
+
+    async def send_data(self, payload: dict, topic: str = "agent"):
+        self.data.append((time.perf_counter(), payload))
+        # A turn-level error has no segment `seq`; segment TTS errors do not end the turn
+        if payload.get("type") == "response_end" or (payload.get("type") == "error" and "seq" not in payload):
+            self.reply_done.set()
+
+    async def disconnect(self):
+        self._closed.set()
+
+    def leave(self):
+        self._closed.set()
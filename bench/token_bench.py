@@ -0,0 +1,91 @@
+"""Token issuance benchmark: tokens/second for signing, single and batch requests
+
+Compares python-jose against the shared HS256 signer, then drives the token
+server in-process through /get-token (one token per request, cold and cached)
+and /batch-token.
+
+    python bench/token_bench.py --tokens 2000 --batch-size 100
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+import httpx
+
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "token_server"))
+os.environ.setdefault("LIVEKIT_API_KEY", "bench-key")
+os.environ.setdefault("LIVEKIT_SECRET", "bench-secret-bench-secret-bench-secret")
+
+from jose import jwt
+import main as token_server
+from livekit_tokens import HS256Signer, TokenIssuer
+
+
+def rate(count, seconds):
+    return round(count / seconds, 1)
+
+
+def bench_signing(count):
+    issuer = TokenIssuer("key", "secret")
+    claims = [issuer.claims(f"user-{i}", "room", int(time.time())) for i in range(count)]
+
+    start = time.perf_counter()
+    for claim in claims:
+        jwt.encode(claim, "secret", algorithm="HS256")
+    jose_rate = rate(count, time.perf_counter() - start)
+
+    signer = HS256Signer("secret")
+    start = time.perf_counter()
+    tokens = [signer.sign(claim) for claim in claims]
+    fast_rate = rate(count, time.perf_counter() - start)
+
+    # The fast path must produce tokens jose accepts
+    decoded = jwt.decode(tokens[0], "secret", algorithms=["HS256"], options={"verify_sub": False})
+    assert decoded["video"]["room"] == "room"
+    return {"python_jose_tokens_per_s": jose_rate, "hs256_signer_tokens_per_s": fast_rate}
+
+
+async def bench_http(count, batch_size):
+    token_server._issuer = None
+    transport = httpx.ASGITransport(app=token_server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://token") as client:
+        results = {}
+        for label in ("single_cold", "single_cached"):
+            start = time.perf_counter()
+            for i in range(count):
+                response = await client.get("/get-token", params={"identity": f"user-{i}", "room": "clinic"})
+                response.raise_for_status()
+            results[f"{label}_tokens_per_s"] = rate(count, time.perf_counter() - start)
+
+        token_server._issuer = None
+        start = time.perf_counter()
+        for offset in range(0, count, batch_size):
+            batch = [{"identity": f"user-{i}", "room": "clinic"} for i in range(offset, min(count, offset + batch_size))]
+            response = await client.post("/batch-token", json={"requests": batch})
+            response.raise_for_status()
+        results["batch_cold_tokens_per_s"] = rate(count, time.perf_counter() - start)
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tokens", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+
+    results = {
+        "signing": bench_signing(args.tokens),
+        "http": asyncio.run(bench_http(args.tokens, args.batch_size)),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
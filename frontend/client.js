@@ -3,11 +3,26 @@ let audioChunks = [];
 let livekitRoom;
 let livekitToken;
 let audioTrack;
+// The reply in flight: aborted when the user starts speaking again (barge-in)
+let turnController;
+let currentAudio;
 
 // Configuration - edit these URLs based on your deployment
 const BACKEND_URL = window.location.hostname === 'localhost' ? 'http://localhost:8080' : '/api';
 const TOKEN_SERVER_URL = window.location.hostname === 'localhost' ? 'http://localhost:8081' : '/api';
 const DEEPGRAM_PROXY_URL = `${BACKEND_URL}/deepgram-proxy`;
+// Server-side LiveKit agent worker (backend/agent.py); when set, it answers in the room and the browser only publishes the mic
+const AGENT_URL = null;
+// Persistent conversation socket; null keeps the per-turn HTTP flow (Vercel functions cannot hold WebSockets)
+const CONVERSATION_WS_URL = window.location.hostname === 'localhost' ? 'ws://localhost:8080/ws/conversation' : null;
+
+// Binary frames on the conversation socket: kind (uint8) | id (uint32) | seq (uint16) | payload
+const AUDIO_IN = 0x01;
+const TTS_AUDIO = 0x02;
+const FRAME_HEADER_BYTES = 7;
+
+let conversation = null;  // { ws, session, lastId, ready, reply }
+let playQueue = [];
 
 async function initLiveKit() {
   try {
@@ -27,6 +42,7 @@ async function initLiveKit() {
       livekitRoom = new window.LivekitClient.Room();
       await livekitRoom.connect(`wss://your-livekit-host.livekit.cloud`, livekitToken);
       console.log('Connected to LiveKit room:', roomName);
+      if (AGENT_URL) await joinAgent(roomName);
     } else {
       console.warn('LiveKit client not loaded');
     }
@@ -36,23 +52,219 @@ async function initLiveKit() {
   }
 }
 
+// Ask the agent worker into the room; its voice arrives as a remote track, text on the data channel
+async function joinAgent(roomName) {
+  const { RoomEvent, Track } = window.LivekitClient;
+  livekitRoom.on(RoomEvent.TrackSubscribed, track => {
+    if (track.kind === Track.Kind.Audio) document.body.appendChild(track.attach());
+  });
+  livekitRoom.on(RoomEvent.TrackUnsubscribed, track => track.detach().forEach(el => el.remove()));
+  livekitRoom.on(RoomEvent.DataReceived, payload => {
+    const event = JSON.parse(new TextDecoder().decode(payload));
+    if (event.type === 'utterance') appendMessage("🗣️ You: " + event.transcript);
+    else if (event.type === 'text') appendMessage("🤖 AI: " + event.text);
+    else if (event.type === 'error' && event.seq === undefined) appendMessage("⚠️ " + event.detail);
+  });
+  const response = await fetch(`${AGENT_URL}/dispatch`, {
+    method: "POST",
+    // The agent only joins rooms the caller holds a token for
+    headers: { "Content-Type": "application/json", "Authorization": `Bearer ${livekitToken}` },
+    body: JSON.stringify({ room: roomName })
+  });
+  if (!response.ok) throw new Error('Agent dispatch failed: ' + response.status);
+}
+
+// Stop the current reply: closes its requests so the server cancels the LLM/TTS work
+function cancelTurn() {
+  if (turnController) turnController.abort();
+  turnController = null;
+  if (conversation?.reply) {
+    sendConversation({ type: 'cancel' });
+    conversation.reply = null;
+  }
+  stopPlayback();
+}
+
+function stopPlayback() {
+  playQueue = [];
+  if (currentAudio) currentAudio.pause();
+  currentAudio = null;
+}
+
+// Open (or resume) the conversation socket; resolves once the server says it is ready
+function connectConversation(resume = false) {
+  if (!CONVERSATION_WS_URL) return Promise.reject(new Error('Conversation socket not configured'));
+  if (conversation?.ready && !resume) return Promise.resolve(conversation);
+
+  const params = new URLSearchParams();
+  if (resume && conversation?.session) {
+    params.set('resume', conversation.session);
+    params.set('last_id', conversation.lastId);
+  } else {
+    conversation = { session: null, lastId: 0, ready: false, reply: null };
+    // The LiveKit token keys the server-side conversation history to its room + identity
+    if (livekitToken) params.set('token', livekitToken);
+  }
+  const state = conversation;
+  const ws = new WebSocket(`${CONVERSATION_WS_URL}?${params}`);
+  ws.binaryType = 'arraybuffer';
+  state.ws = ws;
+  state.ready = false;
+
+  return new Promise((resolve, reject) => {
+    ws.onmessage = message => {
+      if (message.data instanceof ArrayBuffer) {
+        onConversationFrame(state, message.data);
+        return;
+      }
+      const event = JSON.parse(message.data);
+      if (event.id) state.lastId = event.id;
+      if (event.type === 'ready') {
+        state.session = event.session;
+        state.ready = true;
+        if (event.replay_gap) console.warn('Conversation resumed with missing messages');
+        resolve(state);
+        return;
+      }
+      onConversationEvent(state, event);
+    };
+    ws.onerror = () => reject(new Error('Conversation socket failed'));
+    ws.onclose = () => {
+      const wasReady = state.ready;
+      state.ready = false;
+      if (conversation !== state) return;
+      if (!wasReady) {
+        // Never connected, or the resume was refused: start over next time
+        conversation = null;
+        reject(new Error('Conversation socket closed'));
+        return;
+      }
+      setTimeout(() => connectConversation(true).catch(() => { conversation = null; }), 1000);
+    };
+  });
+}
+
+function sendConversation(event) {
+  if (conversation?.ready) conversation.ws.send(JSON.stringify(event));
+}
+
+function sendAudioFrame(buffer) {
+  if (!conversation?.ready) return;
+  const frame = new Uint8Array(FRAME_HEADER_BYTES + buffer.byteLength);
+  frame[0] = AUDIO_IN;
+  frame.set(new Uint8Array(buffer), FRAME_HEADER_BYTES);
+  conversation.ws.send(frame);
+}
+
+function onConversationFrame(state, data) {
+  const view = new DataView(data);
+  if (view.getUint8(0) !== TTS_AUDIO) return;
+  state.lastId = view.getUint32(1);
+  const seq = view.getUint16(5);
+  if (!state.reply) return;  // Cancelled locally
+  const chunks = state.reply.audio.get(seq) || [];
+  chunks.push(data.slice(FRAME_HEADER_BYTES));
+  state.reply.audio.set(seq, chunks);
+}
+
+function onConversationEvent(state, event) {
+  switch (event.type) {
+    case 'ping':
+      sendConversation({ type: 'pong', t: event.t });
+      break;
+    case 'interim':
+      stopPlayback();  // Barge-in; the server cancels the reply as well
+      break;
+    case 'utterance':
+      appendMessage("🗣️ You: " + event.transcript);
+      break;
+    case 'response_start':
+      state.reply = { text: '', audio: new Map() };
+      break;
+    case 'token':
+      if (state.reply) state.reply.text += event.token;
+      break;
+    case 'text':
+      // A new segment starts: the previous one has all its audio
+      if (state.reply && event.seq > 0) queueSegment(state.reply, event.seq - 1);
+      break;
+    case 'response_end':
+      if (state.reply) {
+        appendMessage("🤖 AI: " + state.reply.text);
+        for (const seq of [...state.reply.audio.keys()].sort((a, b) => a - b)) queueSegment(state.reply, seq);
+      }
+      state.reply = null;
+      console.log('Turn timing:', event);
+      break;
+    case 'response_cancelled':
+      state.reply = null;
+      stopPlayback();
+      break;
+    case 'error':
+      console.error('Conversation error:', event.detail);
+      appendMessage("⚠️ " + event.detail);
+      break;
+  }
+}
+
+// Play reply segments back to back as their audio completes
+function queueSegment(reply, seq) {
+  const chunks = reply.audio.get(seq);
+  if (!chunks) return;
+  reply.audio.delete(seq);
+  playQueue.push(new Blob(chunks, { type: 'audio/mpeg' }));
+  if (!currentAudio) playNext();
+}
+
+function playNext() {
+  const blob = playQueue.shift();
+  if (!blob) {
+    currentAudio = null;
+    return;
+  }
+  const audio = currentAudio = new Audio(URL.createObjectURL(blob));
+  audio.onended = () => {
+    URL.revokeObjectURL(audio.src);
+    if (audio === currentAudio) playNext();
+  };
+  audio.play().catch(e => console.error('Audio playback error:', e));
+}
+
 async function startMic() {
+  cancelTurn();
   try {
     const stream = await navigator.mediaDevices.getUserMedia({ audio: true });
+    if (AGENT_URL && livekitRoom?.state === 'connected') {
+      // The agent listens to the published track; no recording or uploads
+      audioTrack = await window.LivekitClient.LocalAudioTrack.createFromMediaStreamTrack(stream.getAudioTracks()[0]);
+      await livekitRoom.localParticipant.publishTrack(audioTrack);
+      appendMessage("🎙️ Listening...");
+      return;
+    }
+    const socket = await connectConversation().catch(() => null);
     mediaRecorder = new MediaRecorder(stream);
-    mediaRecorder.start();
 
-    appendMessage("🎙️ Listening...");
-    
-    mediaRecorder.ondataavailable = event => {
-      audioChunks.push(event.data);
-    };
+    if (socket) {
+      // Stream audio as it is recorded; transcripts and the reply come back on the socket
+      mediaRecorder.ondataavailable = event => {
+        event.data.arrayBuffer().then(sendAudioFrame);
+      };
+      mediaRecorder.onstop = () => sendConversation({ type: 'audio_end' });
+      mediaRecorder.start(250);
+    } else {
+      mediaRecorder.ondataavailable = event => {
+        audioChunks.push(event.data);
+      };
 
-    mediaRecorder.onstop = () => {
-      const audioBlob = new Blob(audioChunks, { type: 'audio/wav' });
-      audioChunks = [];
-      sendAudioToSTT(audioBlob);
-    };
+      mediaRecorder.onstop = () => {
+        const audioBlob = new Blob(audioChunks, { type: mediaRecorder.mimeType || 'audio/webm' });
+        audioChunks = [];
+        sendAudioToSTT(audioBlob);
+      };
+      mediaRecorder.start();
+    }
+
+    appendMessage("🎙️ Listening...");
 
     // If LiveKit is initialized, publish the audio track
     if (livekitRoom?.state === 'connected') {
@@ -118,55 +330,136 @@ function getAIResponse(text) {
   // Display thinking indicator
   const thinkingId = 'thinking-' + Date.now();
   appendMessage(`<div id="${thinkingId}">🤖 AI is thinking...</div>`);
-  
-  fetch(`${BACKEND_URL}/stream`, {
-    method: "POST",
-    headers: { "Content-Type": "application/json" },
-    body: JSON.stringify({ message: text })
-  })
-  .then(res => {
-    if (!res.ok) throw new Error('AI Response error: ' + res.status);
-    
-    const reader = res.body.getReader();
-    const decoder = new TextDecoder();
-    let aiReply = '';
-    
-    // Remove thinking indicator once we start getting a response
+  const removeThinking = () => {
     const thinkingEl = document.getElementById(thinkingId);
     if (thinkingEl) thinkingEl.remove();
-    
-    reader.read().then(function process({ done, value }) {
-      if (done) {
-        appendMessage("🤖 AI: " + aiReply);
-        playTTS(aiReply);
-        return;
-      }
-      let chunk = decoder.decode(value, { stream: true });
-      aiReply += chunk.replace(/data: /g, "").replace(/\n\n/g, "");
-      reader.read().then(process);
-    });
+  };
+  
+  cancelTurn();
+  const controller = turnController = new AbortController();
+  const reply = { text: '', streamId: null, lastEventId: 0, done: false };
+  const headers = { "Content-Type": "application/json" };
+  // The LiveKit token keys the server-side conversation history to its room + identity
+  if (livekitToken) headers.Authorization = `Bearer ${livekitToken}`;
+  // Resumable replies outlive a dropped connection, so an interrupted one is cancelled explicitly
+  controller.signal.addEventListener('abort', () => {
+    if (reply.streamId && !reply.done) {
+      fetch(`${BACKEND_URL}/stream/${reply.streamId}`, { method: "DELETE" }).catch(() => {});
+    }
+  });
+  const request = fetch(`${BACKEND_URL}/stream`, {
+    method: "POST",
+    headers,
+    body: JSON.stringify({ message: text, resumable: true }),
+    signal: controller.signal
+  });
+  readReplyStream(request, reply, controller, removeThinking)
+  .then(() => {
+    appendMessage("🤖 AI: " + reply.text);
+    playTTS(reply.text, controller);
   })
   .catch(error => {
-    console.error('AI response error:', error);
     // Remove thinking indicator if there was an error
-    const thinkingEl = document.getElementById(thinkingId);
-    if (thinkingEl) thinkingEl.remove();
+    removeThinking();
+    if (error.name === 'AbortError') return;  // Interrupted by the user
     
+    console.error('AI response error:', error);
     appendMessage("⚠️ Error getting AI response");
   });
 }
 
-function playTTS(text) {
+// Read a /stream reply; if the connection drops mid-reply, resume it after the last event received
+async function readReplyStream(request, reply, controller, onStart, maxResumes = 3) {
+  for (let attempt = 0; ; attempt++) {
+    try {
+      const res = await request;
+      if (!res.ok) {
+        const error = new Error('AI Response error: ' + res.status);
+        error.fatal = true;
+        throw error;
+      }
+      reply.streamId = res.headers.get('X-Stream-Id') || reply.streamId;
+      onStart();
+      await readReplyEvents(res, reply);
+      if (reply.done) return;
+      throw new Error('Reply stream ended early');
+    } catch (error) {
+      if (error.name === 'AbortError' || error.fatal || !reply.streamId || attempt >= maxResumes) throw error;
+      console.warn('Reply stream interrupted, resuming:', error);
+      await new Promise(resolve => setTimeout(resolve, 500 * (attempt + 1)));
+      request = fetch(`${BACKEND_URL}/stream/${reply.streamId}`, {
+        headers: { "Last-Event-ID": String(reply.lastEventId) },
+        signal: controller.signal
+      });
+    }
+  }
+}
+
+async function readReplyEvents(res, reply) {
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  for (;;) {
+    const { done, value } = await reader.read();
+    if (done) return;
+    buffer += decoder.decode(value, { stream: true });
+    const events = buffer.split("\n\n");
+    buffer = events.pop();
+    for (const raw of events) {
+      const event = parseSSEEvent(raw);
+      if (event.id !== null) reply.lastEventId = event.id;
+      if (event.data === null) continue;  // Heartbeat or retry hint
+      if (event.type === 'metrics') {
+        console.log('Stream timing:', event.data);
+        reply.done = true;
+      } else if (event.type === 'error') {
+        reply.done = true;
+      } else if (event.type === 'resume') {
+        if (event.data.replay_gap) console.warn('Part of the reply was lost before resuming');
+      } else {
+        reply.text += event.data;
+      }
+    }
+  }
+}
+
+// Parse one SSE event block into its id, type and data (JSON {token} payloads are unwrapped)
+function parseSSEEvent(raw) {
+  let type = 'message';
+  let id = null;
+  const dataLines = [];
+  for (const line of raw.split("\n")) {
+    if (line.startsWith(":")) continue;  // Comment
+    if (line.startsWith("id: ")) id = Number(line.slice(4));
+    else if (line.startsWith("event: ")) type = line.slice(7);
+    else if (line.startsWith("data: ")) dataLines.push(line.slice(6));
+  }
+  if (!dataLines.length) return { id, type, data: null };
+  let data = dataLines.join("\n");
+  try {
+    const parsed = JSON.parse(data);
+    if (parsed && typeof parsed === 'object') {
+      data = 'token' in parsed ? parsed.token : parsed;
+    }
+  } catch (e) {
+    // Plain-text token
+  }
+  return { id, type, data };
+}
+
+function playTTS(text, controller = turnController) {
+  if (controller?.signal.aborted) return;
   appendMessage("🔊 Playing audio response...");
   
   fetch(`${BACKEND_URL}/tts`, {
     method: "POST",
     headers: { "Content-Type": "application/json" },
-    body: JSON.stringify({ text })
+    body: JSON.stringify({ text }),
+    signal: controller?.signal
   }).then(response => {
     if (!response.ok) throw new Error('TTS error: ' + response.status);
     
-    const audio = new Audio();
+    const audio = currentAudio = new Audio();
     const reader = response.body.getReader();
     const stream = new ReadableStream({
       start(controller) {
@@ -178,13 +471,14 @@ function playTTS(text) {
             }
             controller.enqueue(value);
             push();
-          });
+          }, error => controller.error(error));
         }
         push();
       }
     });
 
-    const audioBlob = new Response(stream).blob().then(blob => {
+    return new Response(stream).blob().then(blob => {
+      if (audio !== currentAudio) return;  // Barged in while downloading
       const url = URL.createObjectURL(blob);
       audio.src = url;
       
@@ -219,6 +513,7 @@ function playTTS(text) {
     });
   })
   .catch(error => {
+    if (error.name === 'AbortError') return;  // Interrupted by the user
     console.error('TTS error:', error);
     appendMessage("⚠️ Error playing audio response");
   });
@@ -0,0 +1,99 @@
+"""LiveKit access token issuance shared by token_server/main.py and api/token.py
+
+Tokens are HS256 JWTs signed directly with hmac/hashlib: the header segment is
+encoded once and the keyed HMAC state is copied per token, which skips
+python-jose's per-call key parsing and header handling. Tokens for the same
+(identity, room) are reused while more than half of their lifetime remains,
+so a burst of joins at the start of a clinic session signs each pair once.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Tuple
+
+# Grant claims LiveKit expects (camelCase keys in the `video` grant)
+DEFAULT_GRANTS = {
+    "roomJoin": True,
+    "canPublish": True,
+    "canSubscribe": True,
+    "canPublishData": True,
+}
+
+
+def _b64url(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+
+class HS256Signer:
+    """Minimal JWT signer for HS256"""
+
+    _HEADER = _b64url(json.dumps({"alg": "HS256", "typ": "JWT"}, separators=(",", ":")).encode())
+
+    def __init__(self, secret: str):
+        self._mac = hmac.new(secret.encode(), digestmod=hashlib.sha256)
+
+    def sign(self, claims: Dict[str, Any]) -> str:
+        payload = _b64url(json.dumps(claims, separators=(",", ":")).encode())
+        signing_input = self._HEADER + b"." + payload
+        mac = self._mac.copy()
+        mac.update(signing_input)
+        return (signing_input + b"." + _b64url(mac.digest())).decode()
+
+
+class TokenIssuer:
+    """Signs LiveKit tokens and reuses still-fresh ones per (identity, room)"""
+
+    def __init__(self, api_key: str, secret: str, ttl_seconds: int = 3600, cache_size: int = 10000):
+        self.api_key = api_key
+        self.ttl_seconds = ttl_seconds
+        self.cache_size = cache_size
+        self.signer = HS256Signer(secret)
+        self.signed = 0
+        self.reused = 0
+        self._cache: "OrderedDict[Tuple[str, str], Tuple[str, int]]" = OrderedDict()
+        self._lock = threading.Lock()  # sync routes run on the threadpool
+
+    def claims(self, identity: str, room: str, now: int) -> Dict[str, Any]:
+        return {
+            "jti": f"{identity}-{now}",
+            "iss": self.api_key,
+            "sub": identity,
+            "nbf": now,
+            "exp": now + self.ttl_seconds,
+            "video": {"room": room, **DEFAULT_GRANTS},
+        }
+
+    def issue(self, identity: str, room: str) -> Tuple[str, int]:
+        """Return (token, expires_at), reusing a cached token with >= half its TTL left"""
+        now = int(time.time())
+        key = (identity, room)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached and cached[1] - now >= self.ttl_seconds // 2:
+                self._cache.move_to_end(key)
+                self.reused += 1
+                return cached
+
+        claims = self.claims(identity, room, now)
+        issued = (self.signer.sign(claims), claims["exp"])
+        with self._lock:
+            self._cache[key] = issued
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            self.signed += 1
+        return issued
+
+    def issue_many(self, pairs: Iterable[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        results = []
+        for identity, room in pairs:
+            token, expires_at = self.issue(identity, room)
+            results.append({"token": token, "identity": identity, "room": room, "expires_at": expires_at})
+        return results
+
+    def stats(self) -> Dict[str, int]:
+        return {"signed": self.signed, "reused": self.reused, "cached": len(self._cache)}
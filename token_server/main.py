@@ -1,11 +1,11 @@
 from fastapi import FastAPI, Query, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from jose import jwt
+from pydantic import BaseModel, Field
 from starlette.status import HTTP_500_INTERNAL_SERVER_ERROR
+from typing import List, Optional
 import os
-import time
 import logging
+from livekit_tokens import TokenIssuer
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -51,33 +51,33 @@ def validate_config():
         )
     return True
 
-def create_token(identity: str, room: str, ttl_seconds: int = 3600):
+_issuer: Optional[TokenIssuer] = None
+
+def get_issuer() -> TokenIssuer:
+    """Shared issuer (signing key + token reuse cache), created on first use"""
+    global _issuer
+    if _issuer is None:
+        _issuer = TokenIssuer(
+            LIVEKIT_API_KEY,
+            LIVEKIT_SECRET,
+            ttl_seconds=int(os.getenv("TOKEN_TTL_SECONDS", "3600")),
+            cache_size=int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+        )
+    return _issuer
+
+def create_token(identity: str, room: str) -> str:
     """Create a LiveKit access token
     
     Args:
         identity: User identifier
         room: Room name to join
-        ttl_seconds: Token validity period in seconds (default: 1 hour)
         
     Returns:
-        JWT token string
+        JWT token string, reused from the cache while it is still fresh
     """
     try:
-        now = int(time.time())
-        payload = {
-            "jti": f"{identity}-{now}",
-            "iss": LIVEKIT_API_KEY,
-            "sub": identity,
-            "nbf": now,
-            "exp": now + ttl_seconds,
-            "video": {
-                "room_join": True,
-                "room": room,
-                "can_publish": True,
-                "can_subscribe": True
-            }
-        }
-        return jwt.encode(payload, LIVEKIT_SECRET, algorithm="HS256")
+        token, _ = get_issuer().issue(identity, room)
+        return token
     except Exception as e:
         logger.error(f"Error creating token: {str(e)}")
         raise HTTPException(
@@ -102,10 +102,31 @@ def get_token(
             detail=str(e)
         )
         
+class TokenRequest(BaseModel):
+    identity: str = Field(..., min_length=1, description="User identifier")
+    room: str = Field(..., min_length=1, description="Room name to join")
+
+class BatchTokenRequest(BaseModel):
+    requests: List[TokenRequest] = Field(..., max_length=1000)
+
+@app.post("/batch-token")
+def batch_token(batch: BatchTokenRequest, _: bool = Depends(validate_config)):
+    """Generate tokens for many (identity, room) pairs in one request"""
+    try:
+        tokens = get_issuer().issue_many((item.identity, item.room) for item in batch.requests)
+        return {"tokens": tokens}
+    except Exception as e:
+        logger.error(f"Error in batch_token: {str(e)}")
+        raise HTTPException(
+            status_code=HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
 @app.get("/health")
 async def health_check():
     """Check if the token server is properly configured"""
     return {
         "status": "ok" if LIVEKIT_API_KEY and LIVEKIT_SECRET else "misconfigured",
-        "configured": bool(LIVEKIT_API_KEY and LIVEKIT_SECRET)
+        "configured": bool(LIVEKIT_API_KEY and LIVEKIT_SECRET),
+        "tokens": _issuer.stats() if _issuer else None
     }